@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Walk-forward backtest of the alpha/R-squared stock selection.
+
+At each rebalance date the Fama-French portfolios are rebuilt from the
+fundamentals known at that date, the factor regressions are refitted on the
+trailing window, the top N symbols by objective are bought in equal dollar
+amounts and held until the next rebalance date. Only prices up to the
+rebalance date are used to choose, so the holding-period returns are out of
+sample.
+
+Rebalance dates are independent of each other and are spread over a process
+pool. The price panel is copied once into shared memory and every worker
+maps the same block read-only, so adding workers does not add copies of the
+panel or pickling of it per task.
+"""
+
+import atexit
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from FactorUtils import FactorUtils
+from RegressionUtils import RegressionUtils
+from SelectionUtils import SelectionUtils
+
+# State of a pool worker, set once by _initWorker
+_worker = {}
+
+def _initWorker(shm_name, shape, context):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # The parent unlinks the block; each worker only closes its own mapping
+    atexit.register(shm.close)
+    prices = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    prices.flags.writeable = False
+    _worker.update(context)
+    _worker['shm'] = shm
+    _worker['prices'] = prices
+#end def
+
+def _runPeriod(start, end):
+    return evaluatePeriod(_worker, start, end)
+#end def
+
+# Chooses a portfolio at row start and holds it to row end
+# Inputs
+#    context : dictionary with 'prices' (T x M), 'dates', 'symbols',
+#              'market' (T) and 'risk_free' (T, daily rate), 'fundamentals'
+#              ({date: snapshot}), 'eligible' (M booleans) and the settings
+#              'N', 'train_window', 'min_periods' and 'selection'
+#    start   : row of the rebalance date
+#    end     : row of the next rebalance date (or the last row)
+# Outputs
+#    (start, shortlist DataFrame, array of end - start daily portfolio returns)
+def evaluatePeriod(context, start, end):
+    P = context['prices']
+    window = context['train_window']
+    lo = start - window
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        R = P[lo+1:start+1] / P[lo:start] - 1.0
+        market = context['market']
+        excess = market[lo+1:start+1] / market[lo:start] - 1.0 - context['risk_free'][lo+1:start+1]
+    #end with
+
+    # Portfolios from the fundamentals known on the rebalance date. Later
+    # snapshots would leak the future into the choice
+    dates = context['dates']
+    snapshots = context['fundamentals']
+    known = [d for d in snapshots if pd.Timestamp(d) <= pd.Timestamp(dates[start])]
+    if len(known) == 0:
+        raise ValueError('No fundamentals known on '+str(dates[start]))
+    #end if
+    snapshot = snapshots[max(known, key=pd.Timestamp)]
+    returns = pd.DataFrame(R, index=dates[lo+1:start+1], columns=context['symbols'], copy=False)
+    factors = FactorUtils().buildFactors(returns, snapshot)
+
+    X = np.column_stack([np.ones(window), excess, factors['SMB'].to_numpy(), factors['HML'].to_numpy()])
+    rows = np.isfinite(X).all(axis=1)
+    Y = R[rows]
+    mask = np.isfinite(Y) & context['eligible']
+    result = RegressionUtils().fitOLS(np.where(mask, Y, np.nan), X[rows], mask=mask)
+
+    params = pd.DataFrame({'symbol': context['symbols'],
+                           'alpha': result['params'][0],
+                           'rsquared': result['rsquared'],
+                           'nobs': result['nobs']})
+    params = params[(params['nobs'] >= context['min_periods']) & params['alpha'].notna()]
+    selection = context['selection']
+    shortlist = selection.selectTop(selection.computeObjective(params), context['N'])
+
+    picks = pd.Index(context['symbols']).get_indexer(shortlist['symbol'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        held = P[start+1:end+1, picks] / P[start:end, picks] - 1.0
+    #end with
+    weights = np.full((1, len(picks)), 1.0 / max(len(picks), 1))
+    performance = FactorUtils().holdingPeriodReturns(held, weights)[:, 0]
+    return start, shortlist, performance
+#end def
+
+class Backtester:
+
+    # Inputs
+    #    prices         : DataFrame of closing prices, dates x symbols
+    #    market         : Series of the market index level on the same dates
+    #    fundamentals   : one snapshot DataFrame, or {date: snapshot}
+    #    risk_free      : optional Series of daily risk-free rates on the same
+    #                     dates (missing days count as zero)
+    #    N              : number of stocks held
+    #    train_window   : trading days of returns each regression is fitted on
+    #    min_periods    : fewest observations a symbol needs to be ranked
+    #                     (defaults to half the window)
+    #    rebalance_freq : pandas period alias for the rebalance schedule
+    #    exclude        : symbols never selected (index funds, ETFs)
+    #    selection      : SelectionUtils with the objective weights to test
+    #    max_workers    : size of the process pool; 0 or 1 runs in-process
+    def __init__(self, prices, market, fundamentals, risk_free=None, N=10, train_window=252,
+                 min_periods=None, rebalance_freq='M', exclude=(), selection=None, max_workers=None):
+        self.prices = prices
+        self.market = market.reindex(prices.index)
+        self.risk_free = (risk_free.reindex(prices.index) if risk_free is not None
+                          else pd.Series(0.0, index=prices.index)).fillna(0.0)
+        if isinstance(fundamentals, pd.DataFrame):
+            fundamentals = {prices.index[0]: fundamentals}
+        #end if
+        self.fundamentals = fundamentals
+        self.N = N
+        self.train_window = train_window
+        self.min_periods = train_window // 2 if min_periods is None else min_periods
+        self.rebalance_freq = rebalance_freq
+        self.exclude = set(exclude)
+        self.selection = SelectionUtils() if selection is None else selection
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+    #end def
+
+    # (start, end) row pairs of every holding period with a full training
+    # window behind it. Rebalance dates before the first fundamentals
+    # snapshot are skipped, as nothing was known to choose with
+    def getPeriods(self):
+        dates = self.prices.index
+        position = dates.get_indexer(FactorUtils().rebalanceDates(dates, self.rebalance_freq))
+        starts = [i for i in position if self.train_window <= i < len(dates) - 1]
+        first = min(pd.Timestamp(d) for d in self.fundamentals)
+        skipped = [i for i in starts if pd.Timestamp(dates[i]) < first]
+        if len(skipped) > 0:
+            print('Skipping '+str(len(skipped))+' rebalance dates before the first fundamentals snapshot ('+
+                  str(first.date())+')')
+        #end if
+        starts = [i for i in starts if pd.Timestamp(dates[i]) >= first]
+        return list(zip(starts, starts[1:] + [len(dates) - 1]))
+    #end def
+
+    def _context(self):
+        return {'dates': self.prices.index,
+                'symbols': list(self.prices.columns),
+                'market': self.market.to_numpy(dtype=np.float64),
+                'risk_free': self.risk_free.to_numpy(dtype=np.float64),
+                'fundamentals': self.fundamentals,
+                'eligible': ~self.prices.columns.isin(self.exclude),
+                'N': self.N,
+                'train_window': self.train_window,
+                'min_periods': self.min_periods,
+                'selection': self.selection}
+    #end def
+
+    # Runs every holding period
+    # Outputs
+    #    dictionary with 'returns' (Series of daily portfolio returns over the
+    #    out-of-sample dates) and 'holdings' (DataFrame of each shortlist with
+    #    its rebalance date)
+    def run(self):
+        periods = self.getPeriods()
+        if len(periods) == 0:
+            raise ValueError('Not enough history for a '+str(self.train_window)+'-day training window')
+        #end if
+        starts = [a for a, b in periods]
+        ends = [b for a, b in periods]
+        context = self._context()
+
+        if self.max_workers <= 1:
+            context['prices'] = self.prices.to_numpy(dtype=np.float64)
+            results = [evaluatePeriod(context, a, b) for a, b in periods]
+        else:
+            values = self.prices.to_numpy(dtype=np.float64)
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            try:
+                np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+                del values
+                with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_initWorker,
+                                         initargs=(shm.name, self.prices.shape, context)) as executor:
+                    results = list(executor.map(_runPeriod, starts, ends))
+                #end with
+            finally:
+                shm.close()
+                shm.unlink()
+            #end try
+        #end if
+
+        dates = self.prices.index
+        returns = []
+        holdings = []
+        for (start, shortlist, performance), end in zip(results, ends):
+            returns.append(pd.Series(performance, index=dates[start+1:end+1]))
+            shortlist = shortlist.copy()
+            shortlist.insert(0, 'date', dates[start])
+            holdings.append(shortlist)
+        #end for
+        return {'returns': pd.concat(returns),
+                'holdings': pd.concat(holdings, ignore_index=True)}
+    #end def
+
+    # Cumulative return, annualized return and volatility, and Sharpe ratio
+    # (against the risk-free series) of a run's daily returns
+    def getSummary(self, returns):
+        returns = returns.dropna()
+        excess = returns - self.risk_free.reindex(returns.index).fillna(0.0)
+        years = len(returns) / 252
+        total = float(np.prod(1.0 + returns.to_numpy()) - 1.0)
+        volatility = float(returns.std() * 252 ** 0.5)
+        return {'cumulative_return': total,
+                'annualized_return': (1.0 + total) ** (1.0 / years) - 1.0 if years > 0 else np.nan,
+                'annualized_volatility': volatility,
+                'sharpe': float(excess.mean() / excess.std() * 252 ** 0.5) if len(excess) > 1 else np.nan}
+    #end def
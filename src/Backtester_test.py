@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the walk-forward backtest on a panel with planted alphas, and that
+the process pool gives the same result as a serial run
+"""
+
+import numpy as np
+import pandas as pd
+from Backtester import Backtester
+from SelectionUtils import SelectionUtils
+
+def make_panel(T=400, M=30, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2020-01-01', periods=T).strftime('%Y-%m-%d')
+    symbols = ['s'+str(i) for i in range(M)]
+    market = 0.0003 + 0.01 * rng.standard_normal(T)
+    alpha = np.zeros(M)
+    alpha[[5, 8, 12]] = 0.002
+    R = alpha + np.outer(market, rng.uniform(0.5, 1.5, M)) + 0.005 * rng.standard_normal((T, M))
+    prices = pd.DataFrame(100 * np.cumprod(1 + R, axis=0), index=dates, columns=symbols)
+    prices.iloc[:50, 10] = np.nan
+    # Smallest and largest 10% each span growth, neutral and value
+    booktomarket = np.linspace(0.2, 0.8, M)
+    booktomarket[[0, 1, 2]] = booktomarket[[M-3, M-2, M-1]] = [0.1, 0.5, 0.9]
+    fundamentals = pd.DataFrame({'symbol': symbols,
+                                 'marketcap': np.linspace(1, 100, M),
+                                 'booktomarket': booktomarket})
+    return prices, pd.Series(np.cumprod(1 + market), index=dates), fundamentals
+
+def test_walk_forward_picks_alpha_out_of_sample():
+    prices, market, fundamentals = make_panel()
+    # Rank on alpha alone so the planted alphas are what gets picked
+    bt = Backtester(prices, market, fundamentals, N=3, train_window=120,
+                    selection=SelectionUtils(w_fit=0.0, w_alpha=1.0), max_workers=1)
+    result = bt.run()
+    periods = bt.getPeriods()
+    assert result['returns'].index[0] == prices.index[periods[0][0] + 1]
+    assert result['returns'].index[-1] == prices.index[-1]
+    assert not result['returns'].index.has_duplicates
+    assert set(result['holdings']['symbol']) == {'s5', 's8', 's12'}
+
+    # The first holding period is the equal-weight buy-and-hold of the picks
+    start, end = periods[0]
+    picks = result['holdings'][result['holdings']['date'] == prices.index[start]]['symbol']
+    value = prices[list(picks)].iloc[start:end+1].div(prices[list(picks)].iloc[start]).mean(axis=1)
+    expected = value.pct_change().iloc[1:]
+    assert np.allclose(result['returns'].iloc[:end-start], expected.to_numpy())
+    assert bt.getSummary(result['returns'])['cumulative_return'] > 0
+
+def test_process_pool_matches_serial():
+    prices, market, fundamentals = make_panel(T=300, M=20, seed=1)
+    serial = Backtester(prices, market, fundamentals, N=4, train_window=100, max_workers=1).run()
+    pooled = Backtester(prices, market, fundamentals, N=4, train_window=100, max_workers=2).run()
+    pd.testing.assert_series_equal(serial['returns'], pooled['returns'])
+    pd.testing.assert_frame_equal(serial['holdings'], pooled['holdings'])
+
+def test_rebalance_dates_before_the_first_snapshot_are_skipped():
+    prices, market, fundamentals = make_panel(T=300, M=20, seed=2)
+    later = prices.index[200]
+    bt = Backtester(prices, market, {later: fundamentals}, N=4, train_window=100, max_workers=1)
+    result = bt.run()
+    assert len(bt.getPeriods()) > 0
+    assert (result['holdings']['date'] >= later).all()
+    assert result['returns'].index[0] > later
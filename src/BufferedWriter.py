@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Background writer for streaming ingestion.
+
+Items are collected into batches of batch_size and handed to a writer
+thread, which passes each batch to a write function (e.g. a database
+upsert) while the caller keeps producing. At most max_pending batches wait
+for the writer; beyond that add() blocks, so memory stays bounded however
+many items flow through, and a slow database slows the producer down
+instead of letting batches pile up.
+"""
+
+import queue
+import threading
+
+_STOP = object()
+
+class BufferedWriter:
+
+    # Inputs
+    #    write       : called as write(batch) with a list of items, on the
+    #                  writer thread
+    #    batch_size  : items per write call
+    #    max_pending : full batches allowed to wait for the writer
+    def __init__(self, write, batch_size=50, max_pending=2):
+        self.write = write
+        self.batch_size = batch_size
+        self.buffer = []
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.batches = 0
+        self.items = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    #end def
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is _STOP:
+                return
+            #end if
+            if self.error is not None:
+                continue
+            #end if
+            try:
+                self.write(batch)
+                self.batches += 1
+                self.items += len(batch)
+            except BaseException as e:
+                # Keep draining so the producer never blocks on a dead writer
+                self.error = e
+            #end try
+        #end while
+    #end def
+
+    def _raiseError(self):
+        if self.error is not None:
+            raise self.error
+        #end if
+    #end def
+
+    def add(self, item):
+        self._raiseError()
+        self.buffer.append(item)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        #end if
+    #end def
+
+    # Hands the buffered items to the writer without waiting for the write
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.queue.put(self.buffer)
+            self.buffer = []
+        #end if
+    #end def
+
+    # Flushes, waits for every pending write and stops the writer thread.
+    # Raises the first error of a write
+    def close(self):
+        if self.thread.is_alive():
+            self.flush()
+            self.queue.put(_STOP)
+            self.thread.join()
+        #end if
+        self._raiseError()
+    #end def
+
+    def __enter__(self):
+        return self
+    #end def
+
+    # Items added before an error in the with-block are still written, so
+    # an interrupted ingest keeps everything it fetched
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except BaseException:
+            if exc_type is None:
+                raise
+            #end if
+        #end try
+        return False
+    #end def
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Checks batching, back-pressure and error handling of BufferedWriter
+"""
+
+import threading
+import pytest
+from BufferedWriter import BufferedWriter
+
+def test_batches_are_written_in_order():
+    batches = []
+    with BufferedWriter(batches.append, batch_size=3) as writer:
+        for i in range(8):
+            writer.add(i)
+    assert batches == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert writer.items == 8 and writer.batches == 3
+
+def test_producer_blocks_when_writer_falls_behind():
+    release = threading.Event()
+    written = []
+    def write(batch):
+        release.wait()
+        written.append(batch)
+    writer = BufferedWriter(write, batch_size=1, max_pending=2)
+    # One batch being written plus two queued; the next add must block
+    for i in range(3):
+        writer.add(i)
+    blocked = threading.Thread(target=writer.add, args=(3,))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join()
+    writer.close()
+    assert written == [[0], [1], [2], [3]]
+
+def test_write_errors_reach_the_producer():
+    def write(batch):
+        raise IOError('disk full')
+    writer = BufferedWriter(write, batch_size=1)
+    with pytest.raises(IOError):
+        for i in range(100):
+            writer.add(i)
+        writer.close()
+
+def test_items_added_before_a_failure_are_kept():
+    batches = []
+    with pytest.raises(KeyboardInterrupt):
+        with BufferedWriter(batches.append, batch_size=10) as writer:
+            writer.add('a')
+            writer.add('b')
+            raise KeyboardInterrupt
+    assert batches == [['a', 'b']]
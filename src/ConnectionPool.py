@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Shared, thread-safe Postgres connection pool configured from database.ini.
+
+One pool is kept per configuration file per process, so every SchemaUtils
+instance (and every thread using one) borrows from the same set of open
+connections instead of connecting and disconnecting for each statement.
+"""
+
+import configparser
+import os
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2 import pool
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'database.ini')
+
+# Reads the [postgresql] section (passed straight to psycopg2.connect) and
+# the optional [pool] and [storage] sections
+def readDatabaseConfig(path=DEFAULT_CONFIG):
+    parser = configparser.ConfigParser()
+    if not parser.read(path):
+        raise FileNotFoundError('Database configuration not found: '+path)
+    config = {'postgresql': dict(parser.items('postgresql')),
+              'pool': {'minconn': 1, 'maxconn': 8},
+              'storage': {'layout': 'wide'}}
+    if parser.has_section('pool'):
+        config['pool'] = {key: int(value) for key, value in parser.items('pool')}
+    if parser.has_section('storage'):
+        config['storage'].update(parser.items('storage'))
+    return config
+
+class ConnectionPool:
+
+    # ThreadedConnectionPool raises as soon as maxconn connections are out;
+    # the semaphore makes extra callers wait for a free connection instead
+    def __init__(self, minconn, maxconn, **connect_kwargs):
+        self.pool = pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.lock = threading.Lock()
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.errors = 0
+
+    # Borrow a connection for the duration of a with-block. The transaction
+    # is committed on success and rolled back on error before the connection
+    # goes back to the pool; broken connections are discarded.
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        if not self.slots.acquire(blocking=False):
+            self.slots.acquire()
+            with self.lock:
+                self.waits += 1
+                self.wait_time += time.perf_counter() - start
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    # Counters for sizing the pool: if waits is high and peak_in_use sits at
+    # maxconn, parallel callers are queueing for connections
+    def getStats(self):
+        with self.lock:
+            return {'minconn': self.minconn, 'maxconn': self.maxconn,
+                    'checkouts': self.checkouts, 'in_use': self.in_use,
+                    'peak_in_use': self.peak_in_use, 'waits': self.waits,
+                    'wait_time': self.wait_time, 'errors': self.errors}
+
+    def closeAll(self):
+        self.pool.closeall()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Returns the process-wide pool for the given configuration file, creating it
+# on first use
+def getPool(path=DEFAULT_CONFIG):
+    path = os.path.abspath(path)
+    with _pools_lock:
+        if path not in _pools:
+            config = readDatabaseConfig(path)
+            _pools[path] = ConnectionPool(config['pool']['minconn'], config['pool']['maxconn'],
+                                          **config['postgresql'])
+        return _pools[path]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the pool bookkeeping with a stand-in for psycopg2's pool
+"""
+
+import threading
+import time
+import ConnectionPool
+
+class FakeConnection:
+    closed = 0
+    def commit(self):
+        pass
+    def rollback(self):
+        pass
+
+class FakeThreadedPool:
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.free = [FakeConnection() for i in range(maxconn)]
+        self.lock = threading.Lock()
+    def getconn(self):
+        with self.lock:
+            return self.free.pop()
+    def putconn(self, conn, close=False):
+        with self.lock:
+            self.free.append(conn)
+
+def test_read_config(tmp_path):
+    path = tmp_path / 'database.ini'
+    path.write_text('[postgresql]\nhost=localhost\ndatabase=postgres\n\n[pool]\nminconn=2\nmaxconn=3\n')
+    config = ConnectionPool.readDatabaseConfig(str(path))
+    assert config['postgresql'] == {'host': 'localhost', 'database': 'postgres'}
+    assert config['pool'] == {'minconn': 2, 'maxconn': 3}
+    assert config['storage']['layout'] == 'wide'
+
+def test_concurrent_callers_wait_for_a_connection(monkeypatch):
+    monkeypatch.setattr(ConnectionPool.pool, 'ThreadedConnectionPool', FakeThreadedPool)
+    pool = ConnectionPool.ConnectionPool(1, 2)
+    def work():
+        with pool.connection():
+            time.sleep(0.05)
+    threads = [threading.Thread(target=work) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = pool.getStats()
+    assert stats['checkouts'] == 6
+    assert stats['in_use'] == 0
+    assert stats['peak_in_use'] == 2
+    assert stats['waits'] > 0
@@ -9,24 +9,72 @@ package_names = [
     'pandas',
     'numpy'
 ]
+import numpy as np
 import pandas as pd
-import requests
-import json
 import time
 import datetime
-from td.credentials import TdCredentials
-from td.client import TdAmeritradeClient
-from td.exceptions import NotFndError, NotNulError
-from TDA.config import CONSUMER_KEY, REDIRECT_URI, JSON_PATH
+import sys
+from TDA.config import CONSUMER_KEY, REDIRECT_URI, JSON_PATH, REQUESTS_PER_SECOND
 from SchemaUtils import SchemaUtils
-schema = SchemaUtils()
+from FetchUtils import ConcurrentFetcher, RetryPolicy, chunked
+from BufferedWriter import BufferedWriter
+from Metrics import metrics
+from PriceCache import PriceCache
+from UpdateJournal import UpdateJournal
+from PanelUtils import PanelUtils
+from PricePanel import PricePanel, epochToDayNumbers, toDateStrings
+
+# Symbols per fundamentals request. The instruments endpoint takes a
+# comma-separated list, so 100 symbols cost one request (and one token of
+# the rate limit) instead of 100
+FUNDAMENTALS_BATCH = 100
+
+# Fundamentals older than this many days are refetched by an incremental
+# update; younger ones are kept
+FUNDAMENTALS_MAX_AGE_DAYS = 7
+
+# Failures worth retrying: the connection, timeouts, the rate limit and
+# server-side errors. Anything else (e.g. an expired token) stops the job,
+# which the journal lets the next run resume. The td client and requests
+# are imported on first use, so importing this module stays cheap
+def getTransientErrors():
+    import requests
+    from td.exceptions import ExdLmtError, ServerError
+    return (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+            ExdLmtError, ServerError)
+#end def
 
 class DBUpdateScript:
 
-    def __init__(self):
+    # Inputs
+    #    max_workers : number of API requests kept in flight at once. All
+    #                  workers share one token bucket set to the TD quota, so
+    #                  max_workers=1 reproduces the old one-at-a-time behaviour
+    #    journal     : started UpdateJournal to record progress in and skip
+    #                  completed work from, or None
+    #    retry       : RetryPolicy for transient API failures (default: 4
+    #                  attempts with exponential backoff on getTransientErrors(),
+    #                  resolved on the first failure)
+    #    schema      : SchemaUtils to write to; created on first use if None
+    def __init__(self, max_workers=4, journal=None, retry=None, schema=None):
         self.data = []
+        self.journal = journal
+        self.schema = schema
+        self.panel = PanelUtils()
+        if retry is None:
+            retry = RetryPolicy(retry_on=getTransientErrors)
+        self.fetcher = ConcurrentFetcher(rate=REQUESTS_PER_SECOND, max_workers=max_workers, retry=retry)
     
+    def getSchema(self):
+        if self.schema is None:
+            self.schema = SchemaUtils()
+        #end if
+        return self.schema
+    #end def
+
     def login(self):
+        from td.credentials import TdCredentials
+        from td.client import TdAmeritradeClient
         td_credentials = TdCredentials(client_id=CONSUMER_KEY, redirect_uri=REDIRECT_URI,credential_file=JSON_PATH)
         td_client = TdAmeritradeClient(credentials=td_credentials)
         return td_client
@@ -37,15 +85,26 @@ class DBUpdateScript:
         return time.strftime('%Y-%m-%d', time.localtime(epoch_time/1000))
     #end def
 
-    def get_latest_date(self, df, date):
+    # Converts 'YYYY-MM-DD' to 'milliseconds since epoch'. If date is not
+    # given, the latest date in the index of df is used
+    def get_latest_date(self, df, date=None):
+        if date is None:
+            date = max(df.index)
         epoch_time = datetime.datetime.strptime(date,'%Y-%m-%d').timestamp()*1000
         return int(epoch_time)
 
     # Subsets the historical price data returned from API calls
-    def slice_price_data(self,symbol,data):
+    # Inputs
+    #    as_panel : return a one-symbol PricePanel instead of a DataFrame
+    #               indexed by 'YYYY-MM-DD'
+    def slice_price_data(self,symbol,data,as_panel=False):
         data = data['candles']
+        if as_panel:
+            return PricePanel.fromCandles(symbol, data)
+        #end if
         df = pd.DataFrame(data)[['close','datetime']]
-        df['datetime'] = df['datetime'].apply(self.epoch_to_datetime)
+        # One vectorized conversion instead of epoch_to_datetime per row
+        df['datetime'] = toDateStrings(epochToDayNumbers(df['datetime'].to_numpy()))
         df = df.rename(columns={'close':symbol,'datetime':'date'})
         df = df.set_index('date')
         return df
@@ -53,19 +112,29 @@ class DBUpdateScript:
 
     # Make GET requests to the TD Ameritrade API for fundamental data
     # Inputs
-    #    symbol : symbol of the stock whose data you want, e.g. "GOOG"
+    #    symbol : symbol of the stock whose data you want, e.g. "GOOG", or a
+    #             list of symbols to request in one call
     #    access_token: OAuth2 access token for API authentication
     # Outputs
-    #    JSON object containing fundamental data for the stock
+    #    JSON object containing fundamental data, keyed by symbol
     def get_fundamentals(self,symbol,td_client):
-        
-        print("Getting fundamental data for "+symbol+"...")
-        try:
-            instruments = td_client.instruments()
-            response = instruments.search_instruments(symbol=symbol,projection='fundamental')
-        except requests.exceptions.ConnectionError:
-            print("WARNING: Connection failure")
-            response = {"keys":""}
+        if not isinstance(symbol, str):
+            print("Getting fundamental data for "+str(len(symbol))+" symbols ("+symbol[0]+" to "+symbol[-1]+")...")
+            symbol = ','.join(symbol)
+        else:
+            print("Getting fundamental data for "+symbol+"...")
+        #end if
+        with metrics.timer('api_request', endpoint='fundamentals') as request:
+            request['symbols'] = symbol.count(',') + 1
+            try:
+                instruments = td_client.instruments()
+                response = instruments.search_instruments(symbol=symbol,projection='fundamental')
+            except getTransientErrors() as e:
+                # Raised for the fetcher to retry
+                print("WARNING: " + type(e).__name__ + " getting fundamental data")
+                request['outcome'] = type(e).__name__
+                raise
+        #end with
 
         return response
     #end def
@@ -77,6 +146,8 @@ class DBUpdateScript:
     # IMPORTANT: If you change the frequency to something other than "daily", you
     # must also change the calculation of the risk free return in the "Calculate
     # returns" section below to match.
+    # start_date and end_date are in milliseconds since epoch. When start_date
+    # is given the API ignores the period, so it is not sent.
     def get_prices(self,
                    symbol,
                    td_client,                
@@ -84,137 +155,408 @@ class DBUpdateScript:
                    period = 1,
                    frequencyType = "daily",
                    frequency = 1,
-                   end_date = None
+                   end_date = None,
+                   start_date = None
                    ):
     
+        from td.exceptions import NotFndError, NotNulError
         print("Getting price data for "+symbol+"...")
-        try:
-            prices = td_client.price_history()
-            response=prices.get_price_history(symbol=symbol,
-                                         period_type=periodType,
-                                         period=period,
-                                         frequency_type=frequencyType,
-                                         frequency=frequency,
-                                         end_date=end_date
-                                        )
-            print(response)
-        except NotFndError:
-            print("Price data not found... continue")
-            return
-        except requests.exceptions.ConnectionError:
-            print("WARNING: Connection failure")
-            return
-        except NotNulError:
-            print("None found")
+        if start_date is not None:
+            period = None
+        with metrics.timer('api_request', endpoint='price_history') as request:
+            try:
+                prices = td_client.price_history()
+                response=prices.get_price_history(symbol=symbol,
+                                             period_type=periodType,
+                                             period=period,
+                                             frequency_type=frequencyType,
+                                             frequency=frequency,
+                                             start_date=start_date,
+                                             end_date=end_date
+                                            )
+                print(response)
+            except NotFndError:
+                print("Price data not found... continue")
+                request['outcome'] = 'not_found'
+                return
+            except getTransientErrors() as e:
+                # Raised for the fetcher to retry
+                print("WARNING: " + type(e).__name__ + " getting price data for " + symbol)
+                request['outcome'] = type(e).__name__
+                raise
+            except NotNulError:
+                print("None found")
+                request['outcome'] = 'none_found'
+                return
+        #end with
         return response
     #end def    
     
-    def getFundamentalsData(self,sector_list,tickers,td_client):
+    # Fundamental data for every symbol of the sectors in sector_list
+    # Inputs
+    #    batch_size   : symbols per request; 1 sends one request per symbol.
+    #                   Batches are pipelined through the rate-limited
+    #                   fetcher either way. A batch that fails after its
+    #                   retries or comes back with none of its symbols is
+    #                   retried one symbol at a time
+    #    max_age_days : only request symbols whose stored fundamentals are
+    #                   older than this (None requests every symbol)
+    # Outputs
+    #    DataFrame with one row per symbol found: symbol, marketCap,
+    #    bookValuePerShare, sharesOutstanding, equity, bookToMarket and
+    #    updated_at (epoch seconds of the request)
+    def getFundamentalsData(self,sector_list,tickers,td_client,batch_size=FUNDAMENTALS_BATCH,max_age_days=None):
         keys_to_keep=["symbol","marketCap","bookValuePerShare","sharesOutstanding"]        
         
-        # Initialize the data frame to hold fundamental data
-        fundamentals = pd.DataFrame()
+        symbol_list=tickers[tickers['Sector'].isin(sector_list)]['Symbol'].tolist()
+        if max_age_days is not None:
+            symbol_list = self.getStaleSymbols(symbol_list,max_age_days)
+            print(str(len(symbol_list))+' symbols have fundamentals older than '+str(max_age_days)+' days')
+        #end if
+        if self.journal is not None:
+            quarantined = self.journal.getQuarantined('fundamentals')
+            symbol_list = [sym for sym in symbol_list if sym not in quarantined]
+        #end if
 
-        for sector in sector_list:
-            symbol_list=tickers[tickers['Sector'] == sector]['Symbol'].tolist()
-            for sym in symbol_list:
-                # Call get_fundamentals and convert JSON to dictionary
-                temp = self.get_fundamentals(sym, td_client)
-                if sym in temp.keys():
-                    dictionary = eval(json.dumps(temp))[sym]['fundamental']
-                    
-                    # Subset to only keep data specified in keys_to_keep
-                    dictionary = {key: dictionary[key] for key in keys_to_keep}
-                    
-                    # Append dictionary to the data frame
-                    fundamentals = fundamentals.append([dictionary])
-                else:
-                    print("WARNING: " + sym + " is an invalid stock ticker symbol!")
+        # Accumulate columns in plain lists and build the frame once
+        columns = {key: [] for key in keys_to_keep}
+        def collect(batch, response):
+            if isinstance(response, Exception):
+                return 0
+            #end if
+            found = 0
+            for sym in batch:
+                if sym in response:
+                    dictionary = response[sym]['fundamental']
+                    for key in keys_to_keep:
+                        columns[key].append(dictionary[key])
+                    #end for
+                    found += 1
                 #end if
-    
-                # TD has a limit of 2 API calls per second, so throttle back the speed
-                time.sleep(0.3)
             #end for
+            return found
+        #end def
+
+        retry = []
+        batches = chunked(symbol_list, batch_size)
+        responses = self.fetcher.iterFetch(batches, lambda batch: self.get_fundamentals(batch, td_client),
+                                           return_errors=True)
+        for batch, response in zip(batches, responses):
+            if collect(batch, response) == 0 and len(batch) > 1:
+                retry.extend(batch)
+            #end if
+        #end for
+        responses = self.fetcher.iterFetch(retry, lambda sym: self.get_fundamentals(sym, td_client),
+                                           return_errors=True)
+        for sym, response in zip(retry, responses):
+            if isinstance(response, Exception):
+                self.recordFailure('fundamentals', sym, response)
+            else:
+                collect([sym], response)
+            #end if
+        #end for
+
+        fundamentals = pd.DataFrame(columns, columns=keys_to_keep)
+        for sym in sorted(set(symbol_list) - set(fundamentals['symbol']) - set(retry)):
+            print("WARNING: " + sym + " is an invalid stock ticker symbol!")
         #end for
 
         # Calculate book-to-market ratio
         fundamentals['equity'] = fundamentals['bookValuePerShare'] * \
                                     fundamentals['sharesOutstanding']
         fundamentals['bookToMarket']=fundamentals['equity'] / fundamentals['marketCap']
+        fundamentals['updated_at'] = float(int(time.time()))
         
         return fundamentals                
     
-    def updateFundamentalsTable(self,fundamentals):    
+    # Symbols of symbol_list with no stored fundamentals, or fundamentals
+    # older than max_age_days. Every symbol is stale if the table predates
+    # the updated_at column
+    def getStaleSymbols(self,symbol_list,max_age_days):
+        stored = self.getSchema().getTableColumns('fundamentals')
+        if 'updated_at' not in stored:
+            return list(symbol_list)
+        #end if
+        updated = self.getSchema().executeSelectStatement('fundamentals','symbol',columns=['updated_at'])['updated_at']
+        cutoff = time.time() - max_age_days * 86400
+        fresh = set(updated.index[updated >= cutoff])
+        return [sym for sym in symbol_list if sym not in fresh]
+    #end def
+
+    # Writes fundamentals. A full refresh rebuilds the table, so symbols that
+    # left the universe go with it. An incremental refresh (see
+    # getFundamentalsData's max_age_days) is upserted into the existing
+    # table, which is only rebuilt if it does not exist yet or predates the
+    # updated_at column
+    def updateFundamentalsTable(self,fundamentals,incremental=False):
         fundamentals_columns = fundamentals.columns.tolist()
         index = fundamentals_columns.pop(0)
         fundamentals=fundamentals.set_index(index)
-        schema.executeCreateTableStatement(columns=fundamentals_columns,table_name='fundamentals',index=index)
-        schema.executeInsertStatement(df=fundamentals,table_name='fundamentals',index=index)
+        if len(fundamentals) == 0:
+            return
+        #end if
+        stored = self.getSchema().getTableColumns('fundamentals')
+        if incremental and 'updated_at' in stored:
+            self.getSchema().executeUpsertStatement(df=fundamentals,table_name='fundamentals',index=index)
+        else:
+            self.getSchema().executeCreateTableStatement(columns=fundamentals_columns,table_name='fundamentals',index=index)
+            self.getSchema().executeInsertStatement(df=fundamentals,table_name='fundamentals',index=index)
+        #end if
+        if self.journal is not None:
+            self.journal.markDone('fundamentals',fundamentals.index.tolist())
+        #end if
+    #end def
+
+    # Records a symbol that failed after its retries in the journal
+    def recordFailure(self,stage,symbol,error):
+        print("WARNING: giving up on " + symbol + " for now: " + repr(error))
+        if self.journal is not None and self.journal.markFailed(stage,symbol,error):
+            print("WARNING: " + symbol + " keeps failing and is quarantined")
+        #end if
+    #end def
 
-    def updatePricesTables(self,sector_list,tickers,td_client):
+    # Price histories of symbol_list as they arrive, as one-symbol
+    # PricePanels named by the matching entry of columns. Symbols with no
+    # data are reported and skipped, and failures are recorded against
+    # stage in the journal
+    def iterPricePanels(self,symbol_list,columns,td_client,stage='prices'):
+        results = self.fetcher.iterFetch(symbol_list, lambda sym: self.get_prices(symbol=sym,td_client=td_client),
+                                         return_errors=True)
+        for sym, col, result in zip(symbol_list, columns, results):
+            if isinstance(result, Exception):
+                self.recordFailure(stage,col,result)
+            elif result is None:
+                print("WARNING: " + sym + " is an invalid stock ticker symbol!")
+            elif result['empty']:
+                print("WARNING: dataframe is empty")
+            else:
+                yield self.slice_price_data(col,result,as_panel=True)
+            #end if
+        #end for
+    #end def
+
+    # Rebuilds the sector tables from full price histories. Each symbol is
+    # written shortly after it arrives: panels flow from the fetcher into a
+    # BufferedWriter, which COPYs them into the sector's stage in batches of
+    # batch_size symbols on its own thread while the next ones are fetched.
+    # The stage is merged into the table with one upsert at the end of the
+    # sector (see SchemaUtils.executeStageStatement). Memory is bounded by a
+    # few batches however large the sector, and a failure part way through
+    # keeps what was already staged.
+    # The NaN limit counts the dates a symbol is missing from the sector's
+    # calendar, which is only complete at the end of the sector, so symbols
+    # over the limit are dropped from the table then.
+    # With a journal, each written batch is recorded, and a sector that was
+    # interrupted is resumed instead of rebuilt: its table and stage are kept
+    # and only the symbols not yet written are fetched
+    def updatePricesTables(self,sector_list,tickers,td_client,batch_size=50):
         # Maximum number of NaNs allowed in price history
         nan_limit = 10
 
-        # Get the historical stock prices for symbols in symbol_list
-        firstPrices = True
         for sector in sector_list:
-            firstPrice = True
+            stage = 'prices:'+sector
             symbol_list=tickers[tickers['Sector'] == sector]['Symbol'].tolist()
-            for sym in symbol_list:
-                result = self.get_prices(symbol=sym,td_client=td_client)
-                if result is not None:
-                    if not result['empty']:
-                        df = self.slice_price_data(sym,result)
-                        if firstPrice:
-                            price = df
-                            firstPrice = False
-                        else:
-                            price = pd.merge(price, df, how='outer',left_index=True,
-                                         right_index=True)
-                    else:
-                        print("WARNING: dataframe is empty")
+            columns=self.getSchema().removeKeywordsFromSymbols(list(symbol_list))
+            done = {}
+            skip = set()
+            if self.journal is not None:
+                if self.journal.isDone(stage):
+                    continue
+                #end if
+                done = self.journal.getRows(stage)
+                skip = set(done) | self.journal.getQuarantined(stage)
+            #end if
+            if len(done) == 0:
+                self.getSchema().executeCreateTableStatement(columns=columns,table_name=sector,index='Date')
+                self.getSchema().executeDropStageStatement(sector)
+            else:
+                print(sector+': resuming, '+str(len(done))+' symbols already written')
+            #end if
+            fetch = [(sym, col) for sym, col in zip(symbol_list, columns) if col not in skip]
+
+            def write(panels, sector=sector, stage=stage):
+                self.getSchema().executeStageStatement(PricePanel.concat(panels).toFrame(),sector,'Date')
+                if self.journal is not None:
+                    self.journal.markDone(stage,[p.symbols[0] for p in panels],
+                                          [str(toDateStrings(p.dates[-1:])[0]) for p in panels],
+                                          [int(np.count_nonzero(~np.isnan(p.values))) for p in panels])
+                #end if
+            #end def
+
+            calendar = np.empty(0, dtype=np.int32)
+            written = list(done)
+            observed = list(done.values())
+            with BufferedWriter(write, batch_size=batch_size) as writer:
+                for price in self.iterPricePanels([f[0] for f in fetch],[f[1] for f in fetch],td_client,stage):
+                    calendar = np.union1d(calendar, price.dates)
+                    written.append(price.symbols[0])
+                    observed.append(int(np.count_nonzero(~np.isnan(price.values))))
+                    writer.add(price)
+                #end for
+            #end with
+            self.getSchema().executeMergeStageStatement(sector,'Date')
+
+            # Drop any column with too much missing data, and the columns of
+            # symbols that returned nothing. Symbols written before a resume
+            # only left their row counts, so the calendar is at least as long
+            # as the longest of those
+            observed = np.array(observed, dtype=np.int64)
+            missing = max(len(calendar), observed.max(initial=0)) - observed
+            for col in np.array(written, dtype=object)[missing > nan_limit]:
+                print("WARNING: NaN limit exceeded! Dropping " + col + ".")
+            #end for
+            keep = set(np.array(written, dtype=object)[missing <= nan_limit])
+            self.getSchema().executeAlterTableStatement(sector,[],[col for col in columns if col not in keep])
+            if self.journal is not None:
+                self.journal.markDone(stage)
+            #end if
+        #end for        
+        PriceCache().invalidate()
+    #end def
+        
+    # Brings existing sector tables up to date instead of rebuilding them.
+    # For each symbol only the dates after its last stored price are
+    # requested; new symbols get a full history and symbols that left the
+    # universe are dropped. Sectors without a table fall back to
+    # updatePricesTables.
+    def updatePricesTablesIncremental(self,sector_list,tickers,td_client):
+        nan_limit = 10
+        one_day = 86400000
+        now = int(time.time()*1000)
+
+        for sector in sector_list:
+            stage = 'prices:'+sector
+            quarantined = set()
+            if self.journal is not None:
+                if self.journal.isDone(stage):
+                    continue
+                #end if
+                quarantined = self.journal.getQuarantined(stage)
+            #end if
+            stored = self.getSchema().getTableColumns(sector)
+            if len(stored) == 0:
+                self.updatePricesTables([sector],tickers,td_client)
+                continue
+            #end if
+            index = stored[0]
+            stored = stored[1:]
+
+            symbol_list = tickers[tickers['Sector'] == sector]['Symbol'].tolist()
+            columns = [col.lower() for col in self.getSchema().removeKeywordsFromSymbols(list(symbol_list))]
+            retired = [col for col in stored if col not in columns]
+            latest = self.getSchema().getLatestDates(sector,index,[col for col in stored if col in columns])
+
+            # Work out the missing range for each symbol
+            requests_list = []
+            for sym, col in zip(symbol_list, columns):
+                if col in quarantined:
+                    continue
+                #end if
+                start_date = None
+                if latest.get(col) is not None:
+                    start_date = self.get_latest_date(None, latest[col]) + one_day
+                    if start_date > now:
+                        continue
                     #end if
-                else:
-                    print("WARNING: " + sym + " is an invalid stock ticker symbol!")
                 #end if
-                time.sleep(0.3) # As before, can't make too many API requests per second
+                requests_list.append((sym, col, start_date))
             #end for
-    
-            # Drop any column with too much missing data
-            for col in price.columns:
-                if price[col].isna().sum() > nan_limit:
+            print(sector+': '+str(len(requests_list))+' symbols to refresh, '+
+                  str(len(retired))+' to retire')
+
+            results = self.fetcher.iterFetch(requests_list, lambda req: self.get_prices(
+                symbol=req[0], td_client=td_client, start_date=req[2],
+                end_date=now if req[2] is not None else None), return_errors=True)
+            frames = []
+            for (sym, col, start_date), result in zip(requests_list, results):
+                if isinstance(result, Exception):
+                    self.recordFailure(stage,col,result)
+                    continue
+                #end if
+                if result is None or result['empty']:
+                    continue
+                #end if
+                df = self.slice_price_data(col, result)
+                # Only brand new symbols are held to the NaN limit; a short
+                # delta for an existing symbol is expected to be sparse
+                if start_date is None and df[col].isna().sum() > nan_limit:
                     print("WARNING: NaN limit exceeded! Dropping " + col + ".")
-                    price = price.drop(columns=[col])
+                    continue
                 #end if
-            #end for    
-    
-            price_columns=schema.removeKeywordsFromSymbols(price.columns.tolist())
-            price.columns = price_columns
-            schema.executeCreateTableStatement(columns=price_columns,table_name=sector,index='Date')
-            schema.executeInsertStatement(df=price,table_name=sector,index='Date')
-    
-            if firstPrices:
-                prices = price
-                firstPrices = False
-            else:
-                prices = pd.merge(prices, price, how='outer',left_index=True,
-                                  right_index=True)        
+                frames.append(df[~df.index.duplicated()])
+            #end for
+
+            added = [df.columns[0] for df in frames if df.columns[0] not in stored]
+            self.getSchema().executeAlterTableStatement(sector,added,retired)
+            if len(frames) > 0:
+                self.getSchema().executeUpsertStatement(self.panel.alignFrames(frames),sector,index)
             #end if
-        #end for        
+            # The incremental path picks up where stored data ends, so a
+            # resumed sector needs no symbol list; the symbols written are
+            # recorded so their failure counts start over
+            if self.journal is not None:
+                self.journal.markDone(stage,[df.columns[0] for df in frames],[df.index[-1] for df in frames],
+                                      [int(df.iloc[:, 0].notna().sum()) for df in frames])
+                self.journal.markDone(stage)
+            #end if
+        #end for
+        PriceCache().invalidate()
     #end def
-        
+
     def main(self):
         print("Hello World!")
+    #end def
 
-    if __name__ == "__main__":
-        from DBUpdateScript import DBUpdateScript
-        update = DBUpdateScript()
-        td_client = update.login()        
-        tickers = schema.getTickers()
-        sector_list = schema.getSectorList()
+# Runs an update job. An interrupted job with the same targets and mode is
+# resumed from the journal; restart abandons it and starts over. Interrupted
+# jobs with other targets are left for a matching run to resume
+# Inputs
+#    targets     : tables to update, any of 'fundamentals' and 'prices'
+#    incremental : only refetch stale fundamentals and prices after the last
+#                  stored date
+#    restart     : abandon an interrupted job instead of resuming it
+#    max_workers : API requests kept in flight at once
+# Outputs
+#    the journal's per-stage summary of the job
+def runUpdate(targets=('fundamentals', 'prices'), incremental=False, restart=False, max_workers=4,
+              journal=None, schema=None, td_client=None):
+    journal = journal or UpdateJournal()
+    if restart:
+        journal.start(targets, incremental)
+        journal.finish()
+    #end if
+    job, resumed = journal.start(targets, incremental)
+    print(('Resuming' if resumed else 'Starting')+' update job '+str(job))
+    for other, other_targets, other_incremental in journal.getUnfinished():
+        print('Update job '+str(other)+' ('+' '.join(other_targets or ['all'])+
+              (', incremental' if other_incremental else '')+') is unfinished and resumes when run again')
+    #end for
+    update = DBUpdateScript(max_workers=max_workers, journal=journal, schema=schema)
+    td_client = td_client or update.login()
+    tickers = update.getSchema().getTickers()
+    sector_list = update.getSchema().getSectorList()
 
-        fundamentals = update.getFundamentalsData(sector_list,tickers,td_client)
-        update.updateFundamentalsTable(fundamentals)
-        update.updatePricesTables(sector_list,tickers,td_client)
-        
-        
\ No newline at end of file
+    if 'fundamentals' in targets and not journal.isDone('fundamentals'):
+        fundamentals = update.getFundamentalsData(sector_list,tickers,td_client,
+                                                  max_age_days=FUNDAMENTALS_MAX_AGE_DAYS if incremental else None)
+        update.updateFundamentalsTable(fundamentals,incremental=incremental)
+        journal.markDone('fundamentals')
+    #end if
+    if 'prices' in targets:
+        if incremental:
+            update.updatePricesTablesIncremental(sector_list,tickers,td_client)
+        else:
+            update.updatePricesTables(sector_list,tickers,td_client)
+        #end if
+    #end if
+    journal.finish()
+    summary = journal.getSummary()
+    for stage, (done, failed, quarantined) in sorted(summary.items()):
+        print(stage+': '+str(done)+' done, '+str(failed)+' failed, '+str(quarantined)+' quarantined')
+    #end for
+    return summary
+#end def
+
+if __name__ == "__main__":
+    runUpdate(incremental='--incremental' in sys.argv, restart='--restart' in sys.argv)
+#end if
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the updater's fundamentals and price paths against the offline stub
+client and an in-memory stand-in for the database
+"""
+
+import time
+import pandas as pd
+import pytest
+import DBUpdateScript
+from DBUpdateScript import DBUpdateScript as Updater
+from FetchUtils import ConcurrentFetcher, RetryPolicy
+from SchemaUtils import SchemaUtils
+from TDA.stub_client import StubTdClient
+from UpdateJournal import UpdateJournal
+
+class FakeSchema(SchemaUtils):
+    # Tables as DataFrames indexed by their key column
+    def __init__(self):
+        SchemaUtils.__init__(self, storage='wide')
+        self.tables = {}
+        self.stages = {}
+        self.created = []
+
+    def getTableColumns(self, table_name):
+        if table_name not in self.tables:
+            return []
+        df = self.tables[table_name]
+        return [df.index.name] + list(df.columns)
+
+    def executeCreateTableStatement(self, columns, table_name, index):
+        self.tables[table_name] = pd.DataFrame(columns=list(columns), index=pd.Index([], name=index), dtype=float)
+        self.created.append(table_name)
+
+    def executeInsertStatement(self, df, table_name, index):
+        self.tables[table_name] = pd.concat([self.tables[table_name], df.rename_axis(index)])
+
+    def executeUpsertStatement(self, df, table_name, index):
+        self.tables[table_name] = df.rename_axis(index).combine_first(self.tables[table_name])
+
+    def executeStageStatement(self, df, table_name, index):
+        self.stages.setdefault(table_name, []).append(df.rename_axis(index))
+
+    def executeMergeStageStatement(self, table_name, index):
+        for df in self.stages.pop(table_name, []):
+            self.executeUpsertStatement(df, table_name, index)
+
+    def executeDropStageStatement(self, table_name):
+        self.stages.pop(table_name, None)
+
+    def executeSelectStatement(self, table_name, index, columns=None, **filters):
+        df = self.tables[table_name]
+        return df.copy() if columns is None else df[list(columns)].copy()
+
+    def executeAlterTableStatement(self, table_name, add_columns, drop_columns):
+        df = self.tables[table_name].drop(columns=list(drop_columns))
+        self.tables[table_name] = df.reindex(columns=list(df.columns) + list(add_columns))
+
+class _PickyInstruments:
+    def __init__(self, client):
+        self.instruments = StubTdClient.instruments(client)
+    def search_instruments(self, symbol, projection='fundamental'):
+        response = self.instruments.search_instruments(symbol, projection)
+        # Like the API, one unknown symbol empties the whole response
+        return {} if 'ZZZ' in response else response
+
+class PickyClient(StubTdClient):
+    def instruments(self):
+        return _PickyInstruments(self)
+
+def make_updater(schema, journal=None):
+    update = Updater(max_workers=1, journal=journal, schema=schema)
+    # Without the TD quota, and giving up on the first failure
+    update.fetcher = ConcurrentFetcher(rate=1000, max_workers=1, retry=RetryPolicy(attempts=1))
+    return update
+
+def test_fundamentals_are_batched_retried_and_refreshed_when_stale():
+    schema = FakeSchema()
+    update = make_updater(schema)
+    symbols = ['S'+str(i) for i in range(250)] + ['ZZZ']
+    tickers = pd.DataFrame({'Symbol': symbols + ['X'], 'Sector': ['tech'] * 251 + ['energy']})
+
+    # Three batches; the one holding ZZZ comes back empty and is retried
+    # one symbol at a time
+    client = PickyClient()
+    fundamentals = update.getFundamentalsData(['tech'], tickers, client, batch_size=100)
+    assert [call[2].count(',') + 1 for call in client.calls[:3]] == [100, 100, 51]
+    assert len(client.calls) == 3 + 51
+    assert sorted(fundamentals['symbol']) == sorted(symbols[:250])
+    update.updateFundamentalsTable(fundamentals)
+    assert len(schema.tables['fundamentals']) == 250
+
+    # Only symbols with old or no fundamentals are requested again, and the
+    # refresh is upserted
+    stored = schema.tables['fundamentals']
+    stored.loc[['S0', 'S1'], 'updated_at'] = time.time() - 30 * 86400
+    assert update.getStaleSymbols(symbols, 7) == ['S0', 'S1', 'ZZZ']
+    client = PickyClient()
+    refresh = update.getFundamentalsData(['tech'], tickers, client, max_age_days=7)
+    assert len(client.calls) == 1 + 3
+    update.updateFundamentalsTable(refresh, incremental=True)
+    assert schema.created == ['fundamentals'] and len(schema.tables['fundamentals']) == 250
+    assert (schema.tables['fundamentals']['updated_at'] > time.time() - 86400).all()
+
+    # A full run rebuilds the table, so symbols that were delisted go
+    update.updateFundamentalsTable(update.getFundamentalsData(['tech'], tickers[tickers['Symbol'] != 'S5'],
+                                                              PickyClient()))
+    assert schema.created == ['fundamentals'] * 2
+    assert 'S5' not in schema.tables['fundamentals'].index and len(schema.tables['fundamentals']) == 249
+
+class NoPriceCache:
+    def invalidate(self):
+        pass
+
+def test_interrupted_sector_is_resumed_and_quarantined_symbols_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(DBUpdateScript, 'PriceCache', NoPriceCache)
+    journal = UpdateJournal(str(tmp_path / 'journal.sqlite'), quarantine_after=1)
+    journal.start()
+    journal.markFailed('prices:tech', 's3', 'ServerError')
+    journal.finish()
+    symbols = ['s'+str(i) for i in range(7)]
+    tickers = pd.DataFrame({'Symbol': symbols, 'Sector': 'tech'})
+
+    # The connection drops while the second batch is written
+    schema = FakeSchema()
+    stage = schema.executeStageStatement
+    def flaky_stage(df, table_name, index):
+        if table_name in schema.stages:
+            raise ConnectionError('server closed the connection')
+        stage(df, table_name, index)
+    schema.executeStageStatement = flaky_stage
+    journal.start()
+    client = StubTdClient(days=30)
+    with pytest.raises(ConnectionError):
+        make_updater(schema, journal).updatePricesTables(['tech'], tickers, client, batch_size=2)
+    assert 's3' not in [call[2] for call in client.calls]
+    assert sorted(journal.getDone('prices:tech')) == ['s0', 's1']
+    assert sorted(schema.stages['tech'][0].columns) == ['s0', 's1'] and schema.tables['tech'].empty
+
+    # The next run resumes the job: the table and the staged batch are kept
+    # and only the symbols not written yet are fetched
+    schema.executeStageStatement = stage
+    assert journal.start()[1]
+    client = StubTdClient(days=30)
+    make_updater(schema, journal).updatePricesTables(['tech'], tickers, client, batch_size=2)
+    assert schema.created == ['tech']
+    assert [call[2] for call in client.calls] == ['s2', 's4', 's5', 's6']
+    table = schema.tables['tech']
+    assert sorted(table.columns) == ['s0', 's1', 's2', 's4', 's5', 's6']
+    assert table.notna().all().all() and len(table) > 20
+    assert schema.stages == {}
+    assert journal.isDone('prices:tech')
+
+def test_interrupted_job_waits_for_a_run_with_its_targets(tmp_path, monkeypatch):
+    monkeypatch.setattr(DBUpdateScript, 'PriceCache', NoPriceCache)
+    monkeypatch.setattr(DBUpdateScript, 'REQUESTS_PER_SECOND', 1000)
+    journal = UpdateJournal(str(tmp_path / 'journal.sqlite'))
+    tickers = pd.DataFrame({'Symbol': ['s'+str(i) for i in range(4)], 'Sector': 'tech'})
+    schema = FakeSchema()
+    schema.getTickers = lambda: tickers
+    schema.getSectorList = lambda: ['tech']
+    stage = schema.executeStageStatement
+    def broken_stage(df, table_name, index):
+        raise ConnectionError('server closed the connection')
+    schema.executeStageStatement = broken_stage
+    with pytest.raises(ConnectionError):
+        DBUpdateScript.runUpdate(['fundamentals', 'prices'], journal=journal, schema=schema,
+                                 td_client=StubTdClient(days=30))
+
+    # Updating fundamentals alone does not close the interrupted job...
+    schema.executeStageStatement = stage
+    client = StubTdClient(days=30)
+    DBUpdateScript.runUpdate(['fundamentals'], journal=journal, schema=schema, td_client=client)
+    assert [call[1] for call in client.calls] == ['instruments']
+
+    # ...so the next full update still finishes its prices
+    client = StubTdClient(days=30)
+    summary = DBUpdateScript.runUpdate(['fundamentals', 'prices'], journal=journal, schema=schema,
+                                       td_client=client)
+    assert [call[1] for call in client.calls] == ['price_history'] * 4
+    assert summary['prices:tech'] == (4, 0, 0)
+    assert sorted(schema.tables['tech'].columns) == ['s0', 's1', 's2', 's3']
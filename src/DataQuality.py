@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Data-quality checks of a price panel, per symbol.
+
+One pass over the dates x symbols price matrix measures, for every symbol
+at once:
+    missing        dates without a price
+    longest_gap    longest run of consecutive missing dates
+    longest_stale  longest run of days the price did not change
+    outliers       daily returns larger than outlier_return in magnitude
+    volatility     annualized volatility of the daily returns
+
+and the rules (DEFAULT_RULES, overridable per run) decide which symbols are
+quarantined. A symbol is either kept whole or excluded whole, with the
+rules it broke listed in the report, so a bad symbol can no longer shorten
+the sample of every other symbol.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RULES = {
+    # Most dates a symbol may be missing in the window (the NaN limit of
+    # the database update)
+    'max_missing': 10,
+    # Longest run of missing dates that is interpolated over
+    'max_gap': 5,
+    # Longest run of unchanged prices, e.g. a halted or delisted symbol
+    'max_stale': 10,
+    # Daily returns beyond this magnitude are outliers ...
+    'outlier_return': 0.5,
+    # ... and a symbol may have at most this many
+    'max_outliers': 2,
+    # Highest annualized volatility, or None for no limit
+    'max_volatility': None,
+}
+
+# Measure each rule limits, in report order
+RULES = [('missing', 'max_missing'), ('longest_gap', 'max_gap'), ('longest_stale', 'max_stale'),
+         ('outliers', 'max_outliers'), ('volatility', 'max_volatility')]
+
+# Length of the longest run of True in each column of a 2-D boolean array
+def longestRun(flags):
+    if flags.shape[0] == 0:
+        return np.zeros(flags.shape[1], dtype=np.int32)
+    #end if
+    position = np.arange(1, flags.shape[0] + 1, dtype=np.int32)[:, None]
+    # Position of the last False at or before each row; a run of True ends
+    # position - start long
+    start = np.where(flags, 0, position)
+    np.maximum.accumulate(start, axis=0, out=start)
+    return (position - start).max(axis=0)
+#end def
+
+class DataQuality:
+
+    # Inputs
+    #    rules : dict overriding DEFAULT_RULES; KeyError for unknown rules
+    def __init__(self, rules=None):
+        self.rules = dict(DEFAULT_RULES)
+        rules = rules or {}
+        unknown = [k for k in rules if k not in self.rules]
+        if len(unknown) > 0:
+            raise KeyError('Unknown data-quality rules: '+', '.join(unknown))
+        #end if
+        self.rules.update(rules)
+    #end def
+
+    # Quality measures of every column of a dates x symbols price matrix
+    # Inputs
+    #    values : T x M array of prices, NaN where missing
+    # Outputs
+    #    dict of length-M arrays, keyed by the measure names in RULES
+    def measure(self, values, periods_per_year=252):
+        values = np.asarray(values)
+        missing = np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = values[1:] / values[:-1] - 1
+        #end with
+        observed = ~np.isnan(returns)
+        # Missing returns as zeros, so the sums below need no NaN handling
+        filled = np.where(observed, returns, 0.0)
+        n = observed.sum(axis=0)
+        total = filled.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = (np.einsum('ij,ij->j', filled, filled) - total * total / n) / (n - 1)
+        #end with
+        var[n < 2] = np.nan
+        return {'missing': missing.sum(axis=0),
+                'longest_gap': longestRun(missing),
+                'longest_stale': longestRun(returns == 0),
+                'outliers': (np.abs(filled) > self.rules['outlier_return']).sum(axis=0),
+                'volatility': np.sqrt(var) * periods_per_year ** 0.5}
+    #end def
+
+    # Measures and verdict of every symbol of a PricePanel
+    # Outputs
+    #    DataFrame indexed by symbol with the measures and 'reason', the
+    #    rules the symbol broke ('' if it is kept)
+    def check(self, panel):
+        measures = self.measure(panel.values)
+        failed = np.zeros((len(panel.symbols), len(RULES)), dtype=bool)
+        for i, (name, rule) in enumerate(RULES):
+            limit = self.rules[rule]
+            if limit is not None:
+                # A symbol without returns has no volatility and fails
+                failed[:, i] = ~(measures[name] <= limit)
+            #end if
+        #end for
+        report = pd.DataFrame(measures, index=pd.Index(panel.symbols, name='symbol'))
+        reason = np.full(len(report), '', dtype=object)
+        rule_names = np.array([rule for name, rule in RULES], dtype=object)
+        for row in np.flatnonzero(failed.any(axis=1)):
+            reason[row] = ','.join(rule_names[failed[row]])
+        #end for
+        report['reason'] = reason
+        return report
+    #end def
+
+    # Symbols a report keeps
+    def getKept(self, report):
+        return list(report.index[report['reason'] == ''])
+    #end def
+
+    # The quarantined symbols of a report, and why
+    def getQuarantined(self, report):
+        return report[report['reason'] != '']
+    #end def
+
+    def printReport(self, report):
+        quarantined = self.getQuarantined(report)
+        print(str(len(quarantined))+' of '+str(len(report))+' symbols quarantined')
+        for rule, count in quarantined['reason'].str.split(',').explode().value_counts().items():
+            print('    '+rule+': '+str(count))
+        #end for
+        if len(quarantined) > 0:
+            print(quarantined.to_string())
+        #end if
+    #end def
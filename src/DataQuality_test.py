@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the per-symbol data-quality rules on a panel with one symbol per
+kind of problem
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from DataQuality import DataQuality, longestRun
+from PricePanel import PricePanel
+
+def make_panel():
+    rng = np.random.default_rng(0)
+    T = 100
+    values = 100 * np.cumprod(1 + 0.01 * rng.standard_normal((T, 6)), axis=0)
+    values[10:13, 1] = np.nan          # short gap: kept
+    values[20:40, 2] = np.nan          # too much missing, one long gap
+    values[50:70, 3] = values[49, 3]   # stale for 20 days
+    values[60, 4] *= 3                 # one spike: two outlier returns
+    values[80, 4] *= 3
+    values[:, 5] = np.nan              # no data at all
+    dates = pd.bdate_range('2021-01-04', periods=T).strftime('%Y-%m-%d')
+    return PricePanel.fromFrame(pd.DataFrame(values, index=dates, columns=['ok', 'gap', 'hole', 'stale', 'spiky', 'empty']))
+
+def test_longest_run_per_column():
+    flags = np.array([[0, 1, 1], [1, 1, 0], [1, 0, 1], [1, 1, 1]], dtype=bool)
+    assert list(longestRun(flags)) == [3, 2, 2]
+    assert list(longestRun(np.zeros((0, 2), dtype=bool))) == [0, 0]
+
+def test_rules_are_applied_per_symbol():
+    report = DataQuality().check(make_panel())
+    assert report.loc['gap', 'missing'] == 3 and report.loc['gap', 'longest_gap'] == 3
+    assert report.loc['stale', 'longest_stale'] == 20
+    assert report.loc['spiky', 'outliers'] == 4
+    assert dict(report['reason']) == {'ok': '', 'gap': '', 'hole': 'max_missing,max_gap',
+                                      'stale': 'max_stale', 'spiky': 'max_outliers',
+                                      'empty': 'max_missing,max_gap'}
+    assert DataQuality().getKept(report) == ['ok', 'gap']
+
+def test_rules_can_be_overridden():
+    quality = DataQuality({'max_outliers': 4, 'max_volatility': 0.01})
+    report = quality.check(make_panel())
+    assert 'max_outliers' not in report.loc['spiky', 'reason']
+    assert quality.getKept(report) == []
+    with pytest.raises(KeyError):
+        DataQuality({'max_nans': 3})
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Fama-French SMB/HML factor construction from a returns panel.
+
+The six size/value portfolios are a sparse 6 x N weight matrix over the
+symbol universe, weighted by market capitalization from the fundamentals
+table. Between rebalance dates the weights drift with each stock's price
+(buy and hold), which is what a value-weighted portfolio actually does, so
+portfolio returns for a whole holding period come from one sparse matrix
+product with the returns panel.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Row order of the weight matrix
+PORTFOLIOS = ['sg', 'sn', 'sv', 'bg', 'bn', 'bv']
+
+class FactorUtils:
+
+    def __init__(self):
+        self.data = []
+    #end def
+
+    # Splits the universe the same way fama_french.py always has: bottom 10%
+    # / top 10% by market cap for small / big, and 30% / 40% / 30% by
+    # book-to-market for growth / neutral / value. Symbols with a zero book-
+    # to-market or market cap are left out.
+    # Inputs
+    #    fundamentals : DataFrame with 'symbol', 'marketcap', 'booktomarket'
+    # Outputs
+    #    DataFrame indexed by symbol with 'marketcap', 'size' ('s', 'b' or '')
+    #    and 'value' ('g', 'n' or 'v') columns
+    def assignPortfolios(self, fundamentals):
+        sub = fundamentals[(fundamentals['booktomarket'].abs() > 0.00001) &
+                           (fundamentals['marketcap'] > 0.0001)]
+        n = sub.shape[0]
+        pc10 = n // 10
+        pc30, pc70, pc90 = pc10 * 3, pc10 * 7, pc10 * 9
+
+        bm_rank = np.empty(n, dtype=np.int64)
+        bm_rank[np.argsort(sub['booktomarket'].to_numpy(), kind='stable')] = np.arange(n)
+        mc_rank = np.empty(n, dtype=np.int64)
+        mc_rank[np.argsort(sub['marketcap'].to_numpy(), kind='stable')] = np.arange(n)
+
+        value = np.where(bm_rank < pc30, 'g', np.where(bm_rank < pc70, 'n', 'v'))
+        size = np.where(mc_rank < pc10, 's', np.where(mc_rank >= pc90, 'b', ''))
+        return pd.DataFrame({'marketcap': sub['marketcap'].to_numpy(), 'size': size, 'value': value},
+                            index=pd.Index(sub['symbol'].to_numpy(), name='symbol'))
+    #end def
+
+    # Market-cap weights of the six portfolios over the given symbols
+    # Inputs
+    #    fundamentals : snapshot used for membership and weights
+    #    symbols      : column order of the returns panel the weights apply to.
+    #                   Members missing from it are ignored and the remaining
+    #                   weights renormalized
+    # Outputs
+    #    6 x len(symbols) scipy.sparse CSR matrix, rows in PORTFOLIOS order
+    def buildWeights(self, fundamentals, symbols):
+        members = self.assignPortfolios(fundamentals)
+        position = pd.Index(symbols).get_indexer(members.index)
+        labels = members['size'].to_numpy() + members['value'].to_numpy()
+        row = pd.Index(PORTFOLIOS).get_indexer(labels)
+        keep = (position >= 0) & (row >= 0)
+        caps = members['marketcap'].to_numpy()[keep]
+        W = sparse.csr_matrix((caps, (row[keep], position[keep])), shape=(len(PORTFOLIOS), len(symbols)))
+        totals = np.asarray(W.sum(axis=1)).ravel()
+        totals[totals == 0] = 1.0
+        return sparse.diags(1.0 / totals) @ W
+    #end def
+
+    # Buy-and-hold returns of weighted portfolios over one holding period
+    # Inputs
+    #    R : T x N array of simple returns for the period (NaN where missing)
+    #    W : P x N weights at the start of the period
+    # Outputs
+    #    T x P array of portfolio returns. Each day a stock's weight is its
+    #    starting weight grown by its own return since the start of the period;
+    #    stocks without a return that day are left out and the rest rescaled
+    def holdingPeriodReturns(self, R, W):
+        R = np.asarray(R, dtype=np.float64)
+        mask = ~np.isnan(R)
+        R0 = np.where(mask, R, 0.0)
+        growth = np.cumprod(1.0 + R0, axis=0)
+        prior = np.vstack([np.ones((1, R.shape[1])), growth[:-1]])
+        numerator = (W @ (R0 * prior).T).T
+        denominator = (W @ (mask * prior).T).T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(denominator > 0, numerator / denominator, np.nan)
+        #end with
+    #end def
+
+    # First trading day of each period in index
+    # Inputs
+    #    index : date index of the returns panel ('YYYY-MM-DD' or datetimes)
+    #    freq  : pandas period alias, e.g. 'M', 'Q' or 'Y'
+    def rebalanceDates(self, index, freq='Q'):
+        periods = pd.to_datetime(pd.Index(index)).to_period(freq)
+        first = np.r_[True, periods[1:] != periods[:-1]]
+        return list(pd.Index(index)[first])
+    #end def
+
+    # Portfolio and factor returns over the whole panel with periodic
+    # rebalancing
+    # Inputs
+    #    returns         : DataFrame of simple returns, dates x symbols
+    #    fundamentals    : one snapshot DataFrame, or {date: snapshot}. Each
+    #                      holding period uses the latest snapshot dated on or
+    #                      before its first day (the earliest one if none is)
+    #    rebalance_dates : dates at which membership and weights are reset. The
+    #                      first date of returns is always a rebalance date
+    # Outputs
+    #    DataFrame indexed like returns with the six portfolio returns and
+    #    'SMB' and 'HML'
+    def buildFactors(self, returns, fundamentals, rebalance_dates=None):
+        if isinstance(fundamentals, pd.DataFrame):
+            fundamentals = {returns.index[0]: fundamentals}
+        #end if
+        snapshot_dates = sorted(fundamentals.keys(), key=pd.Timestamp)
+        snapshot_times = pd.to_datetime(pd.Index(snapshot_dates))
+
+        dates = returns.index
+        starts = [0]
+        if rebalance_dates is not None:
+            starts = sorted(set([0] + [i for i in dates.get_indexer(rebalance_dates) if i >= 0]))
+        #end if
+        bounds = starts + [len(dates)]
+
+        R = returns.to_numpy(dtype=np.float64)
+        out = np.full((len(dates), len(PORTFOLIOS)), np.nan)
+        weights = {}
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            k = max(np.searchsorted(snapshot_times, pd.Timestamp(dates[start]), side='right') - 1, 0)
+            if k not in weights:
+                weights[k] = self.buildWeights(fundamentals[snapshot_dates[k]], returns.columns)
+            #end if
+            out[start:end] = self.holdingPeriodReturns(R[start:end], weights[k])
+        #end for
+
+        factors = pd.DataFrame(out, index=dates, columns=PORTFOLIOS)
+        factors['SMB'] = (1/3)*(factors['sg']+factors['sn']+factors['sv']) - \
+                         (1/3)*(factors['bg']+factors['bn']+factors['bv'])
+        factors['HML'] = (1/2)*(factors['sv']+factors['bv']) - \
+                         (1/2)*(factors['sg']+factors['bg'])
+        return factors
+    #end def
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Checks portfolio membership against the original sort/merge construction
+and the drifting value weights against an explicit holdings simulation
+"""
+
+import math
+import numpy as np
+import pandas as pd
+from FactorUtils import FactorUtils, PORTFOLIOS
+
+def make_fundamentals(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'symbol': ['s'+str(i) for i in range(n)],
+                         'marketcap': rng.lognormal(20, 2, size=n),
+                         'booktomarket': rng.normal(0.5, 0.3, size=n)})
+
+def test_membership_matches_original():
+    fundamentals = make_fundamentals()
+    members = FactorUtils().assignPortfolios(fundamentals)
+    subFund = fundamentals[abs(fundamentals.booktomarket) > 0.00001]
+    subFund = subFund[subFund.marketcap > 0.0001]
+    n = subFund.shape[0]
+    pc10 = math.floor(n/10)
+    bm = subFund.sort_values('booktomarket')
+    mc = subFund.sort_values('marketcap')
+    groups = {'g': bm.iloc[0:pc10*3], 'n': bm.iloc[pc10*3:pc10*7], 'v': bm.iloc[pc10*7:n]}
+    sizes = {'s': mc.iloc[0:pc10], 'b': mc.iloc[pc10*9:n]}
+    for name in PORTFOLIOS:
+        expected = set(pd.merge(sizes[name[0]], groups[name[1]], how='inner')['symbol'])
+        labels = members['size'] + members['value']
+        assert set(members.index[labels == name]) == expected
+
+def test_buy_and_hold_weights():
+    rng = np.random.default_rng(1)
+    R = rng.normal(0, 0.02, size=(15, 4))
+    R[3, 2] = np.nan
+    W = np.array([[0.1, 0.2, 0.3, 0.4]])
+    port = FactorUtils().holdingPeriodReturns(R, W)[:, 0]
+
+    holdings = W[0].copy()
+    for t in range(R.shape[0]):
+        present = ~np.isnan(R[t])
+        expected = np.sum(holdings[present] * R[t, present]) / np.sum(holdings[present])
+        assert np.isclose(port[t], expected)
+        holdings = holdings * (1 + np.nan_to_num(R[t]))
+
+def test_factors_with_rebalancing():
+    fundamentals = make_fundamentals(n=100)
+    fundamentals['marketcap'] = np.linspace(1, 100, 100)
+    fundamentals['booktomarket'] = np.tile([0.1, 0.5, 0.9, 0.2, 0.6, 0.8, 0.3, 0.4, 1.0, 0.7], 10)
+    dates = pd.bdate_range('2021-01-04', periods=130).strftime('%Y-%m-%d')
+    rng = np.random.default_rng(2)
+    returns = pd.DataFrame(rng.normal(0, 0.01, size=(130, 100)), index=dates,
+                           columns=fundamentals['symbol'])
+    factor = FactorUtils()
+    rebalance = factor.rebalanceDates(returns.index, 'Q')
+    assert rebalance == ['2021-01-04', '2021-04-01', '2021-07-01']
+    later = fundamentals.assign(marketcap=fundamentals['marketcap'][::-1].to_numpy())
+    factors = factor.buildFactors(returns, {'2021-01-01': fundamentals, '2021-06-30': later}, rebalance)
+    assert list(factors.columns) == PORTFOLIOS + ['SMB', 'HML']
+    assert not factors.isna().any().any()
+    # The last quarter uses the second snapshot from its first day
+    W = factor.buildWeights(later, returns.columns)
+    expected = factor.holdingPeriodReturns(returns.loc['2021-07-01':].to_numpy(), W)
+    assert np.allclose(factors.loc['2021-07-01':, PORTFOLIOS].to_numpy(), expected)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+The fama_french.py analysis as pipeline stages.
+
+    fundamentals -> portfolios
+    prices -> quality
+    prices, quality, market, risk_free, fundamentals -> returns -> design
+    design -> regressions -> objective -> shortlist -> allocation
+    design -> significance -> objective
+    design -> rolling
+
+Each stage is one cell of the original script. Changing N or inv_amount
+only reruns shortlist and allocation; the database reads, the downloads
+and the regressions come from the cache.
+"""
+
+import datetime
+import numpy as np
+import pandas as pd
+from Pipeline import Pipeline, DEFAULT_CACHE_DIR
+from FactorUtils import FactorUtils
+from RegressionUtils import RegressionUtils
+from SelectionUtils import SelectionUtils, W_FIT, W_ALPHA
+from PanelUtils import PanelUtils
+from PricePanel import PricePanel
+from DataQuality import DataQuality
+from ReferenceCache import ReferenceCache, YahooFetcher, NasdaqDataLinkFetcher
+
+DEFAULT_PARAMS = {
+    # Amount of capital to invest
+    'inv_amount': 10000,
+    # Number of stocks to include in portfolio
+    'N': 10,
+    # Rebalance the Fama-French portfolios at the start of every period of
+    # this length ('M', 'Q' or 'Y'); None holds the initial portfolios
+    'rebalance_freq': None,
+    # Window lengths (trading days) for rolling factor loadings
+    'rolling_windows': [],
+    # Date range (inclusive) of the market index and T-bill series
+    'start': '2021-01-07',
+    'end': '2022-01-07',
+    # Weights for optimization
+    'w_fit': W_FIT,
+    'w_alpha': W_ALPHA,
+    # Only rank symbols whose alpha has at least this Newey-West t-statistic;
+    # None ranks every symbol
+    'min_alpha_t': None,
+    # Settings of SignificanceUtils.testParams, e.g. {'lags': 5, 'draws':
+    # 2000, 'seed': 1, 'max_workers': 4}; draws > 0 adds block-bootstrap
+    # intervals
+    'significance': {},
+    # Data-quality rules overriding DataQuality.DEFAULT_RULES, e.g.
+    # {'max_missing': 5, 'max_volatility': 1.0}
+    'quality': {},
+    # Index funds and factor portfolios that are never selected
+    'not_in': ['market','QQQ','ONEQ','DIA','bg','bn','bv','sg','sn','sv'],
+}
+
+# Output names of the design's coefficients
+COEFFICIENT_NAMES = {'const': 'alpha', 'excess_return': 'beta_market', 'SMB': 'beta_smb', 'HML': 'beta_hml'}
+
+# Get daily risk-free rate of return
+def yearly_to_daily(yearly_rate):
+    return (1 + yearly_rate) ** (1/360) - 1
+#end def
+
+class FamaFrenchPipeline:
+
+    # Inputs
+    #    schema    : SchemaUtils to read from; created on first use if None
+    #    cache_dir : where stage results are persisted
+    #    reference : ReferenceCache for the market and T-bill series; created
+    #                on first use if None
+    def __init__(self, schema=None, cache_dir=DEFAULT_CACHE_DIR, reference=None):
+        self.schema = schema
+        self.reference = reference
+        self.pipeline = Pipeline(cache_dir)
+        self.factor = FactorUtils()
+        p = self.pipeline
+        p.addStage('fundamentals', self.getFundamentals,
+                   fingerprint=lambda params: self.getSchema().getTableVersion('fundamentals', 'symbol'))
+        p.addStage('portfolios', self.getPortfolios, inputs=['fundamentals'])
+        # PriceCache already keeps the panel on disk, memory-mapped. Only the
+        # analysis window is read from the database
+        p.addStage('prices', self.getPrices, params=['start', 'end'], persist=False,
+                   fingerprint=lambda params: self.getPriceKey(params['start'], params['end']))
+        # The reference series are looked up again (mostly from their own
+        # cache) once a day, when recent dates may have been added
+        p.addStage('market', self.getMarket, params=['start', 'end'],
+                   fingerprint=lambda params: str(datetime.date.today()))
+        p.addStage('risk_free', self.getRiskFree, params=['start', 'end'],
+                   fingerprint=lambda params: str(datetime.date.today()))
+        p.addStage('quality', self.getQuality, inputs=['prices'], params=['quality'])
+        p.addStage('returns', self.getReturns, inputs=['prices', 'quality', 'market', 'fundamentals', 'risk_free'],
+                   params=['rebalance_freq'])
+        p.addStage('design', self.getDesign, inputs=['prices', 'market', 'returns'], params=['quality'])
+        p.addStage('regressions', self.getRegressions, inputs=['design'], params=['not_in'])
+        p.addStage('rolling', self.getRolling, inputs=['design'], params=['rolling_windows'])
+        p.addStage('significance', self.getSignificance, inputs=['design'], params=['significance'])
+        p.addStage('objective', self.getObjective, inputs=['regressions', 'significance'],
+                   params=['w_fit', 'w_alpha', 'min_alpha_t'])
+        p.addStage('shortlist', self.getShortlist, inputs=['objective'], params=['N'])
+        # Reads the latest prices of the shortlist only, so a cached
+        # shortlist is allocated without loading the price panel
+        p.addStage('allocation', self.getAllocation, inputs=['shortlist', 'market'],
+                   params=['inv_amount'], fingerprint=lambda params: self.getPriceKey())
+    #end def
+
+    def getSchema(self):
+        if self.schema is None:
+            from SchemaUtils import SchemaUtils
+            self.schema = SchemaUtils()
+        #end if
+        return self.schema
+    #end def
+
+    # Reference series (market indexes, T-bill rates) come from a local
+    # cache that only downloads dates it does not have yet
+    def getReference(self):
+        if self.reference is None:
+            from TDA.config import QUANDL_TOKEN
+            self.reference = ReferenceCache({
+                'yahoo': YahooFetcher(),
+                'treasury': NasdaqDataLinkFetcher('52 Wk Bank Discount Rate', QUANDL_TOKEN)})
+        #end if
+        return self.reference
+    #end def
+
+    # Version of the price tables, and of the [start, end] window read
+    # from them if given
+    def getPriceKey(self, start=None, end=None):
+        from PriceCache import PriceCache
+        schema = self.getSchema()
+        bounds = (start, end) if start is not None or end is not None else None
+        return PriceCache().getSourceKey(schema, schema.getSectorList(), bounds=bounds)
+    #end def
+
+    # Parameters for run/explain: DEFAULT_PARAMS updated with overrides
+    def getParams(self, **overrides):
+        params = dict(DEFAULT_PARAMS)
+        unknown = [k for k in overrides if k not in params]
+        if len(unknown) > 0:
+            raise KeyError('Unknown parameters: '+', '.join(unknown))
+        #end if
+        params.update(overrides)
+        return params
+    #end def
+
+    def run(self, targets, **overrides):
+        return self.pipeline.run(targets, self.getParams(**overrides))
+    #end def
+
+    def explain(self, targets, **overrides):
+        return self.pipeline.explain(targets, self.getParams(**overrides))
+    #end def
+
+    def printExplain(self, targets, **overrides):
+        self.pipeline.printExplain(targets, self.getParams(**overrides))
+    #end def
+
+    # Which symbols the data-quality rules quarantine, and why
+    def printQuality(self, **overrides):
+        DataQuality().printReport(self.run('quality', **overrides))
+    #end def
+
+    # Saves this run's regression results, objective and allocation to a
+    # ResultsStore as one run, computing whatever is not cached yet
+    # Inputs
+    #    store     : ResultsStore, created on this pipeline's schema if None
+    #    residuals : also store the date x symbol residual matrix
+    # Outputs
+    #    the run_id
+    def saveResults(self, store=None, residuals=False, **overrides):
+        from ResultsStore import ResultsStore
+        if store is None:
+            store = ResultsStore(self.getSchema())
+        #end if
+        params = self.getParams(**overrides)
+        out = self.pipeline.run(['regressions', 'objective', 'allocation'], params)
+        results = out['regressions'].merge(out['objective'][['symbol', 'std_from_mean', 'objective']],
+                                           on='symbol', how='left')
+        resid = None
+        if residuals:
+            design = self.pipeline.run('design', params)
+            symbols = list(results['symbol'])
+            with np.errstate(all='ignore'):
+                fit = RegressionUtils().fitOLS(design['returns'][symbols].to_numpy(), design['X'].to_numpy(),
+                                               resid=True)
+            #end with
+            resid = pd.DataFrame(fit['resid'], index=design['returns'].index, columns=symbols)
+        #end if
+        return store.saveRun(results, params, out['allocation'], resid)
+    #end def
+
+    # Shortlists and allocation costs of every combination of a grid of
+    # selection parameters (see ParameterSweep), from one set of
+    # regressions. Only the prices of shortlisted symbols are read
+    # Inputs
+    #    grid : {parameter: list of values} over w_fit, w_alpha,
+    #           outlier_sigma, min_alpha_t, max_volatility, N and inv_amount.
+    #           Parameters it leaves out take the pipeline's value (w_alpha
+    #           stays 1 - w_fit when only w_fit is swept)
+    # Outputs
+    #    DataFrame with one row per configuration
+    def sweep(self, grid, **overrides):
+        from ParameterSweep import ParameterSweep, GRID_DEFAULTS
+        params = self.getParams(**overrides)
+        grid = dict(grid)
+        for name in GRID_DEFAULTS:
+            if name not in grid and name in params and not (name == 'w_alpha' and 'w_fit' in grid):
+                grid[name] = params[name]
+            #end if
+        #end for
+        min_alpha_t = grid['min_alpha_t']
+        if not isinstance(min_alpha_t, (list, tuple, np.ndarray)):
+            min_alpha_t = [min_alpha_t]
+        #end if
+        targets = ['regressions', 'quality', 'market']
+        if any(t is not None for t in min_alpha_t):
+            targets.append('significance')
+        #end if
+        out = self.pipeline.run(targets, params)
+        regressions = out['regressions']
+        if 'significance' in out:
+            regressions = regressions.merge(out['significance'], on='symbol', how='left')
+        #end if
+        sweep = ParameterSweep(regressions, out['quality']['volatility'])
+        return sweep.run(grid, lambda symbols: self.getCurrentPrices(symbols, out['market']))
+    #end def
+
+    ########################### Stages ###################################
+
+    def getFundamentals(self):
+        schema = self.getSchema()
+        fundamentals = schema.executeSelectStatement('fundamentals',None)
+        fundamentals['symbol'] = [x.lower() for x in schema.removeKeywordsFromSymbols(fundamentals['symbol'].tolist())]
+        return fundamentals
+    #end def
+
+    # Membership of the six size/value portfolios (small/big x growth/
+    # neutral/value)
+    def getPortfolios(self, fundamentals):
+        return self.factor.assignPortfolios(fundamentals)
+    #end def
+
+    # The wide price panel of every sector between start and end
+    # (inclusive), from PriceCache when the tables have not changed since it
+    # was stored
+    def getPrices(self, start, end):
+        from PriceCache import PriceCache
+        schema = self.getSchema()
+        sector_list = schema.getSectorList()
+        price_cache = PriceCache()
+        cache_key = price_cache.getSourceKey(schema, sector_list, bounds=(start, end))
+        prices = price_cache.load(cache_key)
+        if prices is None:
+            sector_prices = []
+            for sector in sector_list:
+                price = schema.executeSelectStatement(sector,'date',start_date=start,end_date=end)
+                if not price.empty:
+                    sector_prices.append(price)
+                else:
+                    print('Dataset price_data.'+sector+' is empty. Rerun the DBUpdateScript to get this data.')
+                #end if
+            #end for
+            prices = PanelUtils().alignFrames(sector_prices)
+            price_cache.store(cache_key, prices)
+        #end if
+        return prices
+    #end def
+
+    # Get the market portfolio price (NASDAQ + NYSE + XMI)
+    def getMarket(self, start, end):
+        reference = self.getReference()
+        market = [reference.getSeries('yahoo', ticker, start, end).rename(name)
+                  for ticker, name in [('^NDX', 'NDX'), ('^NYA', 'NYA'), ('^XMI', 'XMI')]]
+        market = PanelUtils().alignFrames(market)
+        market['market'] = market['NDX'] + market['NYA'] + market['XMI']
+        return market
+    #end def
+
+    # Get the daily risk-free rate of return
+    def getRiskFree(self, start, end):
+        rate = self.getReference().getSeries('treasury', 'USTREASURY/BILLRATES', start, end)
+        tbill = rate.to_frame('riskFreeRate')
+        # TODO: Do we need to divide by 100 here???
+        tbill['riskFreeRate'] = (tbill['riskFreeRate']).apply(yearly_to_daily)
+        return tbill
+    #end def
+
+    # Missing data, gaps, stale prices, outliers and volatility of every
+    # symbol, and which symbols the rules quarantine (see DataQuality)
+    def getQuality(self, prices, quality):
+        return DataQuality(quality).check(PricePanel.fromFrame(prices))
+    #end def
+
+    # Daily returns of every symbol that passed the quality checks and of the
+    # market, the Fama-French factor returns and the excess return of the
+    # market
+    def getReturns(self, prices, quality, market, fundamentals, risk_free, rebalance_freq):
+        prices = prices[DataQuality().getKept(quality)]
+        prices = pd.merge(prices, market, how='outer', left_index=True, right_index=True)
+        returns = PricePanel.fromFrame(prices).returns().toFrame()
+
+        rebalance_dates = None
+        if rebalance_freq is not None:
+            rebalance_dates = self.factor.rebalanceDates(returns.index, rebalance_freq)
+        #end if
+        returns = returns.join(self.factor.buildFactors(returns, fundamentals, rebalance_dates))
+
+        returns = pd.merge(returns, risk_free, how='outer', left_index=True, right_index=True)
+        returns['excess_return'] = returns['market'] - returns['riskFreeRate']
+        return returns
+    #end def
+
+    # Gap-filled returns, the design matrix [const, excess_return, SMB, HML]
+    # and the symbols to regress. Gaps of the kept symbols are at most
+    # max_gap prices (max_gap + 1 returns) long and are interpolated over.
+    # Only dates without factor returns are dropped; a symbol's remaining
+    # missing dates (e.g. before it was listed) are left out of its own
+    # regression only
+    def getDesign(self, prices, market, returns, quality):
+        # Use linear interpolation to fill missing data
+        limit = DataQuality(quality).rules['max_gap'] + 1
+        returns = returns.interpolate(method='linear',limit_direction='forward',axis=0,limit=limit)
+        returns = returns.dropna(subset=['excess_return', 'SMB', 'HML'])
+
+        X = returns[['excess_return', 'SMB', 'HML']].copy()
+        X.insert(0, 'const', 1.0)
+
+        #Get rid of date
+        prices_columns = list(prices.columns[1:]) + list(market.columns)
+        returns_columns = set(returns.columns[1:])
+        symbols = [sym for sym in prices_columns if sym in returns_columns]
+        return {'returns': returns, 'X': X, 'symbols': symbols}
+    #end def
+
+    # Factor loadings, R-squared and standard errors of every symbol
+    def getRegressions(self, design, not_in):
+        with np.errstate(all='ignore'):
+            params = RegressionUtils().fitParams(design['returns'], design['X'], design['symbols'])
+        #end with
+        names = dict(COEFFICIENT_NAMES)
+        names.update({'se_'+k: 'se_'+v for k, v in COEFFICIENT_NAMES.items()})
+        params = params.rename(columns=names)
+        return params[~params['symbol'].isin(not_in)]
+    #end def
+
+    # Newey-West t-statistics (and, with draws, block-bootstrap intervals)
+    # of every symbol's alpha and betas, e.g. 'hac_t_alpha'
+    def getSignificance(self, design, significance):
+        from SignificanceUtils import SignificanceUtils
+        settings = dict(significance)
+        significance = SignificanceUtils(max_workers=settings.pop('max_workers', 1))
+        table = significance.testParams(design['returns'], design['X'], design['symbols'], **settings)
+        return table.rename(columns={prefix+k: prefix+v for k, v in COEFFICIENT_NAMES.items()
+                                     for prefix in ('hac_se_', 'hac_t_', 'boot_se_', 'boot_lower_', 'boot_upper_')})
+    #end def
+
+    # {window: date x symbol x coefficient array}, coefficients in the
+    # design's column order (const, excess_return, SMB, HML)
+    def getRolling(self, design, rolling_windows):
+        returns = design['returns'][design['symbols']].to_numpy()
+        X = design['X'].to_numpy()
+        regression = RegressionUtils()
+        return {window: regression.fitRolling(returns, X, window, dtype=np.float32)
+                for window in rolling_windows}
+    #end def
+
+    def getObjective(self, regressions, significance, w_fit, w_alpha, min_alpha_t):
+        params = regressions.merge(significance, on='symbol', how='left')
+        return SelectionUtils(w_fit, w_alpha, min_alpha_t=min_alpha_t).computeObjective(params)
+    #end def
+
+    # Minimize objective function to maximize combination of alpha and rsquared
+    def getShortlist(self, objective, N):
+        return SelectionUtils().selectTop(objective, N)
+    #end def
+
+    # Whole shares of each shortlisted symbol at its latest price (the index
+    # series can be shortlisted too, so their latest levels are included)
+    def getAllocation(self, shortlist, market, inv_amount):
+        current_prices = self.getCurrentPrices(shortlist['symbol'], market)
+        return SelectionUtils().allocate(shortlist, current_prices, inv_amount)
+    #end def
+
+    def getCurrentPrices(self, symbols, market):
+        symbols = [sym for sym in symbols if sym not in market.columns]
+        return pd.concat([self.getSchema().getLastPrices(symbols), market.iloc[-1]])
+    #end def
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Rate-limited concurrent fetching for the TD Ameritrade API.
+
+A single TokenBucket is shared by every worker thread, so requests are
+issued as fast as the provider's quota allows while network latency of
+in-flight requests overlaps with the wait for the next token. Transient
+failures can be retried with exponential backoff (see RetryPolicy); every
+retry takes a token like any other request.
+"""
+
+import collections
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Metrics import metrics
+
+class TokenBucket:
+
+    # Inputs
+    #    rate     : tokens added per second (the provider's request quota)
+    #    capacity : maximum burst size. The default of 1 spaces requests
+    #               exactly 1/rate seconds apart, so no one-second window ever
+    #               sees more than `rate` requests
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self.lock = threading.Lock()
+    #end def
+
+    # Block until a token is available. Callers reserve their token under the
+    # lock (the balance may go negative) and then sleep outside it, so waiting
+    # threads never hold each other up beyond their place in the queue.
+    # Returns the number of seconds spent waiting.
+    def acquire(self):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        #end with
+        if wait > 0:
+            self.sleep(wait)
+        #end if
+        return wait
+    #end def
+
+class RetryPolicy:
+
+    # Inputs
+    #    attempts   : tries per key, including the first
+    #    base_delay : backoff before the first retry in seconds, doubled for
+    #                 each further retry
+    #    max_delay  : cap on the backoff
+    #    retry_on   : exception types treated as transient, or a function
+    #                 returning them. A function is called on the first
+    #                 failure, so the modules defining the types need not be
+    #                 imported up front. The default covers connection errors
+    #                 and timeouts (requests' exceptions derive from OSError)
+    #    seed       : seed of the jitter, for reproducible tests
+    def __init__(self, attempts=4, base_delay=1.0, max_delay=30.0, retry_on=(OSError,),
+                 seed=None, sleep=time.sleep):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on if callable(retry_on) else tuple(retry_on)
+        self.rng = random.Random(seed)
+        self.sleep = sleep
+        self.lock = threading.Lock()
+    #end def
+
+    # Whether error is one of the retry_on types
+    def isTransient(self, error):
+        with self.lock:
+            if callable(self.retry_on):
+                self.retry_on = tuple(self.retry_on())
+            #end if
+            retry_on = self.retry_on
+        #end with
+        return isinstance(error, retry_on)
+    #end def
+
+    # Backoff before retry number attempt (0 for the first retry). "Full
+    # jitter": uniform between 0 and the exponential bound, so workers that
+    # failed together do not all come back at the same moment
+    def getDelay(self, attempt):
+        bound = min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self.lock:
+            return self.rng.uniform(0, bound)
+        #end with
+    #end def
+
+# Splits items into consecutive lists of at most size items, for endpoints
+# that take several keys per request
+def chunked(items, size):
+    items = list(items)
+    return [items[i:i+size] for i in range(0, len(items), size)]
+#end def
+
+class ConcurrentFetcher:
+
+    # Inputs
+    #    rate        : requests per second shared by all workers
+    #    max_workers : number of requests allowed in flight at once. This only
+    #                  needs to cover rate * latency; extra threads just wait
+    #                  on the bucket
+    #    retry       : RetryPolicy for transient failures, or None to fail on
+    #                  the first error
+    def __init__(self, rate, max_workers=4, bucket=None, retry=None):
+        self.bucket = bucket if bucket is not None else TokenBucket(rate)
+        self.max_workers = max_workers
+        self.retry = retry
+        self.throttle_wait = 0.0
+        self.retries = 0
+        self.lock = threading.Lock()
+    #end def
+
+    def _call(self, fn, key, return_errors=False):
+        attempt = 0
+        while True:
+            wait = self.bucket.acquire()
+            with self.lock:
+                self.throttle_wait += wait
+            #end with
+            metrics.observe('fetch_throttle_wait_seconds', wait)
+            try:
+                return fn(key)
+            except Exception as e:
+                transient = self.retry is not None and self.retry.isTransient(e)
+                if transient and attempt + 1 < self.retry.attempts:
+                    with self.lock:
+                        self.retries += 1
+                    #end with
+                    metrics.inc('api_retries_total')
+                    self.retry.sleep(self.retry.getDelay(attempt))
+                    attempt += 1
+                    continue
+                #end if
+                metrics.inc('api_failures_total')
+                if return_errors:
+                    return e
+                #end if
+                raise
+            #end try
+        #end while
+    #end def
+
+    # Calls fn(key) for every key, rate limited, and returns the results in
+    # the same order as keys
+    def fetchAll(self, keys, fn, return_errors=False):
+        return list(self.iterFetch(keys, fn, return_errors))
+    #end def
+
+    # Like fetchAll, but yields results in order as they become available so
+    # callers can start processing before the last request returns.
+    # At most window requests (default 2 * max_workers) are submitted ahead
+    # of the consumer, so a slow consumer does not leave every result of a
+    # large key list waiting in memory.
+    # With return_errors, a key whose call still fails after its retries
+    # yields the exception instead of ending the iteration
+    def iterFetch(self, keys, fn, return_errors=False, window=None):
+        window = window or 2 * self.max_workers
+        keys = iter(keys)
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                for key in itertools.islice(keys, window):
+                    pending.append(pool.submit(self._call, fn, key, return_errors))
+                #end for
+                while pending:
+                    result = pending.popleft().result()
+                    for key in itertools.islice(keys, 1):
+                        pending.append(pool.submit(self._call, fn, key, return_errors))
+                    #end for
+                    yield result
+                #end while
+            finally:
+                for future in pending:
+                    future.cancel()
+                #end for
+            #end try
+        #end with
+    #end def
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the shared token bucket against the offline stub client
+"""
+
+import time
+from FetchUtils import TokenBucket, ConcurrentFetcher, RetryPolicy, chunked
+from TDA.stub_client import StubTdClient
+
+def test_bucket_spacing():
+    t = [0.0]
+    slept = []
+    def sleep(s):
+        slept.append(s)
+    bucket = TokenBucket(rate=2, clock=lambda: t[0], sleep=sleep)
+    waits = [bucket.acquire() for i in range(4)]
+    assert waits == [0.0, 0.5, 1.0, 1.5]
+
+def test_fetcher_saturates_without_exceeding_quota():
+    rate = 40
+    client = StubTdClient(latency=0.1, days=5)
+    fetcher = ConcurrentFetcher(rate=rate, max_workers=8)
+    symbols = ['S'+str(i) for i in range(40)]
+    start = time.monotonic()
+    results = fetcher.fetchAll(symbols, lambda sym: client.price_history().get_price_history(symbol=sym))
+    elapsed = time.monotonic() - start
+    assert [r['symbol'] for r in results] == symbols
+
+    stamps = sorted(c[0] for c in client.calls)
+    gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+    assert min(gaps) > 1.0 / rate * 0.5
+    # 40 requests at 40/s plus one request of latency, well under the
+    # 40 * (0.1 + 1/rate) a sequential loop would need
+    assert elapsed < 40.0 / rate + 0.5
+
+def test_batched_fundamentals_requests():
+    client = StubTdClient()
+    symbols = ['S'+str(i) for i in range(250)]
+    batches = chunked(symbols, 100)
+    assert [len(b) for b in batches] == [100, 100, 50]
+    fetcher = ConcurrentFetcher(rate=1000)
+    responses = fetcher.fetchAll(batches, lambda batch: client.instruments().search_instruments(','.join(batch)))
+    assert len(client.calls) == 3
+    assert [sym for response in responses for sym in response] == symbols
+
+def test_transient_failures_are_retried_with_backoff():
+    slept = []
+    policy = RetryPolicy(attempts=3, base_delay=1.0, max_delay=1.5, retry_on=(ConnectionError,),
+                         seed=0, sleep=slept.append)
+    fetcher = ConcurrentFetcher(rate=1000, max_workers=1, retry=policy)
+    calls = {}
+    def fn(key):
+        calls[key] = calls.get(key, 0) + 1
+        if key == 'flaky' and calls[key] < 3:
+            raise ConnectionError('reset')
+        if key == 'down':
+            raise ConnectionError('refused')
+        if key == 'bad':
+            raise KeyError(key)
+        return key.upper()
+    results = fetcher.fetchAll(['ok', 'flaky', 'down', 'bad'], fn, return_errors=True)
+    assert results[:2] == ['OK', 'FLAKY']
+    assert isinstance(results[2], ConnectionError) and isinstance(results[3], KeyError)
+    # Non-transient errors are not retried
+    assert calls == {'ok': 1, 'flaky': 3, 'down': 3, 'bad': 1}
+    assert fetcher.retries == 4
+    # Full jitter below the doubling bound, capped at max_delay
+    assert all(0 <= s <= bound for s, bound in zip(slept, [1.0, 1.5, 1.0, 1.5]))
+
+def test_requests_run_at_most_a_window_ahead_of_the_consumer():
+    started = []
+    fetcher = ConcurrentFetcher(rate=1000, max_workers=2)
+    results = fetcher.iterFetch(range(100), lambda key: started.append(key) or key)
+    assert next(results) == 0
+    time.sleep(0.1)
+    # The window of 4 was refilled once when the first result was taken
+    assert len(started) == 5
+    assert list(results) == list(range(1, 100)) and len(started) == 100
+
+def test_retry_types_can_be_resolved_on_the_first_failure():
+    resolved = []
+    def transient():
+        resolved.append(1)
+        return (ConnectionError,)
+    policy = RetryPolicy(attempts=2, retry_on=transient, sleep=lambda s: None)
+    fetcher = ConcurrentFetcher(rate=1000, max_workers=1, retry=policy)
+    assert fetcher.fetchAll(['a', 'b'], str.upper) == ['A', 'B'] and resolved == []
+    calls = []
+    def fn(key):
+        calls.append(key)
+        if len(calls) == 1:
+            raise ConnectionError('reset')
+        return key
+    assert fetcher.fetchAll(['a', 'b'], fn) == ['a', 'b']
+    assert calls == ['a', 'a', 'b'] and resolved == [1]
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Narrow price storage: one row per (symbol, date) in price_data.prices.
+
+This is the backend behind SchemaUtils(storage='long'). Sectors become rows
+of price_data.symbols instead of separate wide tables, dates are real DATE
+values, and the (symbol, date) primary key turns symbol-subset and date-range
+reads into index scans. Frames going in and coming out keep the wide layout
+(one column per symbol, 'YYYY-MM-DD' index) that the rest of the code uses.
+Symbols are stored in lower case, the way Postgres folds the unquoted column
+names of the wide tables, so both layouts name a symbol the same way.
+"""
+
+import numpy as np
+import pandas as pd
+from psycopg2 import extras
+
+# Symbols as the store keeps them
+def foldSymbols(symbols):
+    return [str(symbol).lower() for symbol in symbols]
+#end def
+
+class LongPriceStore:
+
+    # Inputs
+    #    schema          : SchemaUtils instance used to open connections
+    #    partition_years : optional list of years; the prices table is then
+    #                      range partitioned by date with one partition per
+    #                      year plus a default partition
+    def __init__(self, schema, partition_years=None):
+        self.schema = schema
+        self.partition_years = partition_years
+    #end def
+
+    def writeCreateTableStatement(self):
+        create_statement = ('CREATE TABLE IF NOT EXISTS price_data.symbols ('
+                            'symbol VARCHAR(32) PRIMARY KEY, sector VARCHAR(255));'
+                            'CREATE INDEX IF NOT EXISTS symbols_sector_idx ON price_data.symbols (sector);'
+                            'CREATE TABLE IF NOT EXISTS price_data.prices ('
+                            'symbol VARCHAR(32) NOT NULL, date DATE NOT NULL, close double precision, '
+                            'PRIMARY KEY (symbol, date))')
+        if self.partition_years:
+            create_statement += ' PARTITION BY RANGE (date);'
+            for year in self.partition_years:
+                create_statement += ('CREATE TABLE IF NOT EXISTS price_data.prices_'+str(year)+
+                                     ' PARTITION OF price_data.prices FOR VALUES FROM '
+                                     "('"+str(year)+"-01-01') TO ('"+str(year+1)+"-01-01');")
+            #end for
+            create_statement += ('CREATE TABLE IF NOT EXISTS price_data.prices_default '
+                                 'PARTITION OF price_data.prices DEFAULT;')
+        else:
+            create_statement += ';'
+        #end if
+        create_statement += 'CREATE INDEX IF NOT EXISTS prices_date_idx ON price_data.prices (date);'
+        return create_statement
+    #end def
+
+    # Equivalent of rebuilding a wide sector table: make sure the store exists
+    # and make the sector's symbol list exactly `columns`. Prices of symbols
+    # that left the sector are removed.
+    def executeCreateTableStatement(self,columns,table_name,index):
+        columns = foldSymbols(columns)
+        with self.schema.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(self.writeCreateTableStatement())
+            cursor.execute('DELETE FROM price_data.prices WHERE symbol IN '
+                           '(SELECT symbol FROM price_data.symbols WHERE sector = %s AND NOT symbol = ANY(%s))',
+                           (table_name, list(columns)))
+            cursor.execute('DELETE FROM price_data.symbols WHERE sector = %s AND NOT symbol = ANY(%s)',
+                           (table_name, list(columns)))
+            self._registerSymbols(cursor, columns, table_name)
+        #end with
+    #end def
+
+    def _registerSymbols(self, cursor, columns, table_name):
+        extras.execute_values(cursor,
+            'INSERT INTO price_data.symbols (symbol, sector) VALUES %s '
+            'ON CONFLICT (symbol) DO UPDATE SET sector = EXCLUDED.sector',
+            [(column, table_name) for column in foldSymbols(columns)])
+    #end def
+
+    # Flattens a wide frame to (symbol, date, close) rows, skipping missing
+    # prices. Returns three aligned numpy arrays.
+    def meltFrame(self, df):
+        values = df.to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        rows, cols = np.nonzero(present)
+        symbols = np.asarray(foldSymbols(df.columns), dtype=object)[cols]
+        dates = np.asarray(df.index, dtype=object)[rows]
+        return symbols, dates, values[rows, cols]
+    #end def
+
+    # Inverse of meltFrame: one pass over the rows into a preallocated matrix
+    def pivotLong(self, symbols, dates, closes, index='date'):
+        date_codes, date_values = pd.factorize(np.asarray(dates), sort=True)
+        symbol_codes, symbol_values = pd.factorize(np.asarray(symbols), sort=True)
+        matrix = np.full((len(date_values), len(symbol_values)), np.nan)
+        matrix[date_codes, symbol_codes] = np.asarray(closes, dtype=np.float64)
+        return pd.DataFrame(matrix, index=pd.Index(date_values, name=index),
+                            columns=list(symbol_values))
+    #end def
+
+    # Writes a wide frame; rows that already exist are overwritten.
+    # method='copy' melts and streams chunk_size wide rows at a time through
+    # COPY into a temporary staging table, then merges it in one statement.
+    # method='values' sends the rows through execute_values.
+    def executeInsertStatement(self,df,table_name,index,method='copy',chunk_size=50):
+        with self.schema.connection() as conn, conn.cursor() as cursor:
+            self._registerSymbols(cursor, df.columns, table_name)
+            if method == 'copy':
+                from SchemaUtils import CopyChunkReader
+                cursor.execute('CREATE TEMP TABLE prices_stage (symbol VARCHAR(32), date DATE, '
+                               'close double precision) ON COMMIT DROP')
+                cursor.copy_expert('COPY prices_stage (symbol, date, close) FROM STDIN WITH (FORMAT csv)',
+                                   CopyChunkReader(self.iterCsvChunks(df, chunk_size)), size=1 << 20)
+                cursor.execute('INSERT INTO price_data.prices (symbol, date, close) '
+                               'SELECT symbol, date, close FROM prices_stage '
+                               'ON CONFLICT (symbol, date) DO UPDATE SET close = EXCLUDED.close')
+            else:
+                symbols, dates, closes = self.meltFrame(df)
+                extras.execute_values(cursor,
+                    'INSERT INTO price_data.prices (symbol, date, close) VALUES %s '
+                    'ON CONFLICT (symbol, date) DO UPDATE SET close = EXCLUDED.close',
+                    zip(symbols, dates, closes.tolist()), page_size=10000)
+            #end if
+        #end with
+    #end def
+
+    # Melted (symbol, date, close) CSV for chunk_size wide rows at a time
+    def iterCsvChunks(self, df, chunk_size):
+        for start in range(0, len(df), chunk_size):
+            symbols, dates, closes = self.meltFrame(df.iloc[start:start+chunk_size])
+            yield pd.DataFrame({'symbol': symbols, 'date': dates, 'close': closes}).to_csv(
+                index=False, header=False)
+        #end for
+    #end def
+
+    # Rows never conflict in a way that loses data in the narrow layout, so an
+    # upsert is just an insert
+    def executeUpsertStatement(self,df,table_name,index):
+        self.executeInsertStatement(df,table_name,index)
+    #end def
+
+    # Reads a sector (or every sector when table_name is None) back into the
+    # wide layout. symbols, start_date, end_date and last (the last n dates)
+    # are pushed into the WHERE clause so only the matching index ranges are
+    # scanned. Rows come through a server-side cursor chunk_size at a time.
+    def executeSelectStatement(self,table_name,index,symbols=None,start_date=None,end_date=None,
+                               last=None,chunk_size=20000):
+        conditions = []
+        args = []
+        if table_name is not None:
+            conditions.append('s.sector = %s')
+            args.append(table_name)
+        if symbols is not None:
+            conditions.append('p.symbol = ANY(%s)')
+            args.append(foldSymbols(symbols))
+        if start_date is not None:
+            conditions.append('p.date >= %s')
+            args.append(start_date)
+        if end_date is not None:
+            conditions.append('p.date <= %s')
+            args.append(end_date)
+        if last is not None:
+            # The last n distinct dates of the matching rows
+            where = ' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''
+            conditions.append('p.date >= (SELECT min(date) FROM (SELECT DISTINCT p.date FROM price_data.prices p '
+                              'JOIN price_data.symbols s ON s.symbol = p.symbol'+where+
+                              ' ORDER BY p.date DESC LIMIT %s) d)')
+            args = args + args + [int(last)]
+        select_statement = ('SELECT p.symbol, p.date, p.close FROM price_data.prices p '
+                            'JOIN price_data.symbols s ON s.symbol = p.symbol')
+        if len(conditions) > 0:
+            select_statement += ' WHERE ' + ' AND '.join(conditions)
+        rows = []
+        with self.schema.connection() as conn:
+            cursor = conn.cursor(name='select_long')
+            try:
+                cursor.execute(select_statement, args)
+                chunk = cursor.fetchmany(chunk_size)
+                while len(chunk) > 0:
+                    rows.extend(chunk)
+                    chunk = cursor.fetchmany(chunk_size)
+                #end while
+            finally:
+                cursor.close()
+            #end try
+        #end with
+
+        if len(rows) == 0:
+            return pd.DataFrame(index=pd.Index([], name=index if index is not None else 'date'))
+        symbols, dates, closes = zip(*rows)
+        dates = np.array(dates, dtype='datetime64[D]').astype(str)
+        df = self.pivotLong(symbols, dates, closes, index=index if index is not None else 'date')
+        if index is None:
+            df = df.reset_index()
+        return df
+    #end def
+
+    def getTableVersion(self,table_name,index):
+        with self.schema.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('price_data.prices') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return (None, 0, 0)
+            cursor.execute('SELECT max(p.date), count(*), count(DISTINCT p.symbol) FROM price_data.prices p '
+                           'JOIN price_data.symbols s ON s.symbol = p.symbol WHERE s.sector = %s',
+                           (table_name,))
+            latest, nrows, ncols = cursor.fetchone()
+        #end with
+        return (latest.strftime('%Y-%m-%d') if latest is not None else None, nrows, ncols)
+    #end def
+
+    def getTableColumns(self,table_name):
+        with self.schema.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('price_data.prices') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                columns = []
+            else:
+                cursor.execute('SELECT symbol FROM price_data.symbols WHERE sector = %s ORDER BY symbol',
+                               (table_name,))
+                columns = ['date'] + [row[0] for row in cursor.fetchall()]
+        #end with
+        # A sector with no symbols yet still needs a full build
+        return columns if len(columns) > 1 else []
+    #end def
+
+    # Uses the (symbol, date) primary key: one index probe per symbol
+    def getLatestDates(self,table_name,index,columns):
+        with self.schema.connection() as conn, conn.cursor() as cursor:
+            cursor.execute('SELECT symbol, max(date) FROM price_data.prices '
+                           "WHERE symbol = ANY(%s) AND close <> 'NaN' GROUP BY symbol", (foldSymbols(columns),))
+            latest = {symbol: date.strftime('%Y-%m-%d') for symbol, date in cursor.fetchall()}
+        #end with
+        return {column: latest.get(str(column).lower()) for column in columns}
+    #end def
+
+    def executeAlterTableStatement(self,table_name,add_columns,drop_columns):
+        drop_columns = foldSymbols(drop_columns)
+        with self.schema.connection() as conn, conn.cursor() as cursor:
+            if len(add_columns) > 0:
+                self._registerSymbols(cursor, add_columns, table_name)
+            if len(drop_columns) > 0:
+                cursor.execute('DELETE FROM price_data.prices WHERE symbol = ANY(%s)', (list(drop_columns),))
+                cursor.execute('DELETE FROM price_data.symbols WHERE symbol = ANY(%s)', (list(drop_columns),))
+        #end with
+    #end def
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the long <-> wide conversion used by the narrow price store, and
+an update of the store through an in-memory stand-in for its tables
+"""
+
+import csv
+import datetime
+import io
+import numpy as np
+import pandas as pd
+from psycopg2 import extras
+import DBUpdateScript
+from FetchUtils import RetryPolicy
+from LongPriceStore import LongPriceStore
+from SchemaUtils import SchemaUtils
+from TDA.stub_client import StubTdClient
+
+def test_melt_pivot_roundtrip():
+    store = LongPriceStore(None)
+    df = pd.DataFrame({'aa': [1.0, np.nan, 3.0], 'ach': [4.0, 5.0, np.nan]},
+                      index=pd.Index(['2021-10-18', '2021-10-19', '2021-10-20'], name='date'))
+    symbols, dates, closes = store.meltFrame(df)
+    assert len(closes) == 4
+    wide = store.pivotLong(symbols, dates, closes)
+    pd.testing.assert_frame_equal(wide, df)
+
+def test_partitioned_create_statement():
+    statement = LongPriceStore(None, partition_years=[2021]).writeCreateTableStatement()
+    assert 'PRIMARY KEY (symbol, date)) PARTITION BY RANGE (date);' in statement
+    assert "PARTITION OF price_data.prices FOR VALUES FROM ('2021-01-01') TO ('2022-01-01')" in statement
+
+class FakeLongDatabase:
+    # The two long-store tables, as {symbol: sector} and {(symbol, date): close}
+    def __init__(self):
+        self.symbols = {}
+        self.prices = {}
+        self.stage = []
+
+    def connection(self):
+        return FakeConnection(self)
+
+    def executeValues(self, cursor, statement, rows, page_size=None):
+        for row in rows:
+            if statement.startswith('INSERT INTO price_data.symbols'):
+                self.symbols[row[0]] = row[1]
+            else:
+                self.prices[(row[0], datetime.date.fromisoformat(str(row[1])))] = row[2]
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def cursor(self, name=None):
+        return FakeCursor(self.db)
+
+class FakeCursor:
+    # Answers the statements LongPriceStore sends
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def close(self):
+        pass
+
+    def execute(self, statement, args=()):
+        db = self.db
+        if statement.startswith('CREATE TEMP TABLE'):
+            db.stage = []
+        elif statement.startswith('CREATE'):
+            pass
+        elif 'to_regclass' in statement:
+            self.rows = [(True,)]
+        elif statement.startswith('DELETE FROM price_data.prices WHERE symbol IN'):
+            gone = {s for s, sector in db.symbols.items() if sector == args[0] and s not in args[1]}
+            db.prices = {k: v for k, v in db.prices.items() if k[0] not in gone}
+        elif statement.startswith('DELETE FROM price_data.symbols WHERE sector'):
+            db.symbols = {s: sector for s, sector in db.symbols.items() if sector != args[0] or s in args[1]}
+        elif statement.startswith('DELETE FROM price_data.prices WHERE symbol = ANY'):
+            db.prices = {k: v for k, v in db.prices.items() if k[0] not in args[0]}
+        elif statement.startswith('DELETE FROM price_data.symbols WHERE symbol = ANY'):
+            db.symbols = {s: sector for s, sector in db.symbols.items() if s not in args[0]}
+        elif 'FROM prices_stage' in statement:
+            db.executeValues(self, 'INSERT INTO price_data.prices', db.stage)
+        elif statement.startswith('SELECT symbol FROM price_data.symbols'):
+            self.rows = sorted((s,) for s, sector in db.symbols.items() if sector == args[0])
+        elif statement.startswith('SELECT symbol, max(date)'):
+            latest = {}
+            for (s, date), close in db.prices.items():
+                if s in args[0] and not np.isnan(close):
+                    latest[s] = max(latest.get(s, date), date)
+            self.rows = list(latest.items())
+        elif statement.startswith('SELECT p.symbol') and len(args) == 1 and 's.sector' in statement:
+            self.rows = [(s, date, close) for (s, date), close in db.prices.items()
+                         if db.symbols.get(s) == args[0]]
+        else:
+            raise NotImplementedError(statement)
+
+    def copy_expert(self, statement, reader, size=None):
+        for symbol, date, close in csv.reader(io.StringIO(reader.read())):
+            self.db.stage.append((symbol, date, float(close)))
+
+    def fetchone(self):
+        return self.rows[0]
+    def fetchall(self):
+        return self.rows
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+class NoPriceCache:
+    def invalidate(self):
+        pass
+
+def test_incremental_refresh_keeps_the_symbols_of_a_full_build(monkeypatch):
+    db = FakeLongDatabase()
+    monkeypatch.setattr(extras, 'execute_values', db.executeValues)
+    monkeypatch.setattr(DBUpdateScript, 'PriceCache', NoPriceCache)
+    schema = SchemaUtils(storage='long')
+    schema.connection = db.connection
+    update = DBUpdateScript.DBUpdateScript(max_workers=1, retry=RetryPolicy(attempts=1), schema=schema)
+    tickers = pd.DataFrame({'Symbol': ['AAPL', 'MSFT', 'ALL'], 'Sector': 'tech'})
+
+    update.updatePricesTables(['tech'], tickers, StubTdClient(days=30))
+    assert db.symbols == {'aapl': 'tech', 'msft': 'tech', '_all_': 'tech'}
+    first = schema.executeSelectStatement('tech', 'date')
+    assert list(first.columns) == ['_all_', 'aapl', 'msft'] and len(first) > 20
+
+    # A day later, with one symbol joining the sector: the stored symbols
+    # keep their history and only get the new dates
+    tickers.loc[3] = ['NVDA', 'tech']
+    client = StubTdClient(days=30)
+    update.updatePricesTablesIncremental(['tech'], tickers, client)
+    assert db.symbols == {'aapl': 'tech', 'msft': 'tech', '_all_': 'tech', 'nvda': 'tech'}
+    refreshed = schema.executeSelectStatement('tech', 'date')
+    pd.testing.assert_frame_equal(refreshed.loc[first.index, first.columns], first)
+    assert refreshed.index[-1] > first.index[-1]
+    assert refreshed['nvda'].notna().sum() > 20
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Timing, memory and call-count instrumentation.
+
+One process-wide Metrics object (metrics) collects:
+    histograms  durations, e.g. api_request_seconds{endpoint="price_history"}
+    counters    totals, e.g. query_rows_total{kind="select",table="energy"}
+    gauges      last values, e.g. stage_peak_bytes{stage="regressions"}
+and can write every timed operation as one JSON line as it finishes, and
+the aggregates as a Prometheus text file (for the node exporter's textfile
+collector) at exit.
+
+Instrumentation is off unless configured, either in code with
+metrics.configure(...) or through the environment:
+    FAMA_METRICS_JSONL=<path>    append JSON lines to path
+    FAMA_METRICS_PROM=<path>     write Prometheus text to path at exit
+    FAMA_METRICS_MEMORY=1        trace peak Python memory per stage
+When off, each instrumented call costs one attribute test.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+    #end def
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+            #end if
+        #end for
+        self.count += 1
+        self.sum += value
+    #end def
+
+    # Cumulative counts per bucket bound, as Prometheus expects
+    def getCumulative(self):
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        #end for
+        return cumulative
+    #end def
+
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self.memory = False
+        self.reset()
+        self._registered = False
+    #end def
+
+    # Clears every collected value (configuration is kept)
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+        #end with
+    #end def
+
+    # Turns instrumentation on
+    # Inputs
+    #    jsonl      : path to append one JSON line per timed operation, or None
+    #    prometheus : path to write the Prometheus text file to at exit (and
+    #                 on writePrometheus()), or None
+    #    memory     : trace peak Python memory of each stage with tracemalloc
+    #                 (adds noticeable overhead to allocation-heavy code)
+    def configure(self, jsonl=None, prometheus=None, memory=False):
+        self.jsonl_path = jsonl
+        self.prometheus_path = prometheus
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        #end if
+        if prometheus is not None and not self._registered:
+            atexit.register(self._writeAtExit)
+            self._registered = True
+        #end if
+        self.enabled = True
+    #end def
+
+    # Configures from FAMA_METRICS_* environment variables, if any are set
+    def configureFromEnvironment(self, environ=os.environ):
+        jsonl = environ.get('FAMA_METRICS_JSONL')
+        prometheus = environ.get('FAMA_METRICS_PROM')
+        memory = environ.get('FAMA_METRICS_MEMORY', '') not in ('', '0')
+        if jsonl or prometheus or memory:
+            self.configure(jsonl or None, prometheus or None, memory)
+        #end if
+    #end def
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        #end if
+        self.memory = False
+    #end def
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+    #end def
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        #end if
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        #end with
+    #end def
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        #end if
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            #end if
+            self.histograms[key].observe(value)
+        #end with
+    #end def
+
+    def setGauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        #end if
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+        #end with
+    #end def
+
+    # Writes one JSON line (when a JSON lines file is configured)
+    def event(self, kind, /, **fields):
+        if not self.enabled or self.jsonl_path is None:
+            return
+        #end if
+        line = json.dumps(dict({'ts': time.time(), 'event': kind}, **fields), default=str)
+        with self.lock:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(line + '\n')
+            #end with
+        #end with
+    #end def
+
+    # Times a with-block
+    # Inputs
+    #    name   : metric prefix. The block's duration goes to the
+    #             <name>_seconds histogram and it is counted in <name>_total
+    #             with an 'outcome' label
+    #    labels : labels of both metrics
+    # Outputs
+    #    a dictionary the block may fill in: 'outcome' (default 'ok', or
+    #    'error' if the block raises without setting one) and numeric totals such as 'rows' or
+    #    'bytes', added to <name>_<key>_total counters
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return nullcontext({})
+        #end if
+        return self._timer(name, labels, False)
+    #end def
+
+    # Times a pipeline stage; as timer, plus the peak traced memory of the
+    # stage when memory tracing is on. Stages are assumed not to nest
+    def stage(self, name):
+        if not self.enabled:
+            return nullcontext({})
+        #end if
+        return self._timer('stage', {'stage': name}, self.memory)
+    #end def
+
+    @contextmanager
+    def _timer(self, name, labels, memory):
+        record = {}
+        if memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        #end if
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.setdefault('outcome', 'error')
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            outcome = record.pop('outcome', 'ok')
+            self.observe(name+'_seconds', seconds, **labels)
+            self.inc(name+'_total', outcome=outcome, **labels)
+            for key, value in record.items():
+                if isinstance(value, (int, float)):
+                    self.inc(name+'_'+key+'_total', value, **labels)
+                #end if
+            #end for
+            if memory:
+                record['peak_bytes'] = max(tracemalloc.get_traced_memory()[1] - base, 0)
+                self.setGauge(name+'_peak_bytes', record['peak_bytes'], **labels)
+            #end if
+            self.event(name, seconds=seconds, outcome=outcome, **dict(labels, **record))
+        #end try
+    #end def
+
+    # Aggregates as Prometheus text exposition format
+    def getPrometheusText(self):
+        def render(labels, extra=()):
+            items = list(labels) + list(extra)
+            if len(items) == 0:
+                return ''
+            #end if
+            return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in items) + '}'
+        #end def
+        lines = []
+        with self.lock:
+            for kind, table in [('counter', self.counters), ('gauge', self.gauges)]:
+                for name in sorted(set(key[0] for key in table)):
+                    lines.append('# TYPE %s %s' % (name, kind))
+                    for (metric, labels), value in sorted(table.items()):
+                        if metric == name:
+                            lines.append('%s%s %s' % (name, render(labels), value))
+                        #end if
+                    #end for
+                #end for
+            #end for
+            for name in sorted(set(key[0] for key in self.histograms)):
+                lines.append('# TYPE %s histogram' % name)
+                for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    #end if
+                    for bound, count in histogram.getCumulative():
+                        lines.append('%s_bucket%s %d' % (name, render(labels, [('le', repr(bound))]), count))
+                    #end for
+                    lines.append('%s_bucket%s %d' % (name, render(labels, [('le', '+Inf')]), histogram.count))
+                    lines.append('%s_sum%s %r' % (name, render(labels), histogram.sum))
+                    lines.append('%s_count%s %d' % (name, render(labels), histogram.count))
+                #end for
+            #end for
+        #end with
+        return '\n'.join(lines) + '\n'
+    #end def
+
+    # Writes the Prometheus text file atomically (a scraper never sees a
+    # half-written file)
+    def writePrometheus(self, path=None):
+        path = path or self.prometheus_path
+        if path is None:
+            return
+        #end if
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.getPrometheusText())
+        #end with
+        os.replace(temp, path)
+    #end def
+
+    def _writeAtExit(self):
+        if self.enabled and self.prometheus_path is not None:
+            self.writePrometheus()
+        #end if
+    #end def
+
+metrics = Metrics()
+metrics.configureFromEnvironment()
+
+# Decorator for SchemaUtils methods: times the call as a 'query' with the
+# method's table_name, and counts the rows and in-memory bytes of the frame
+# returned (selects) or passed in (inserts)
+def instrumentQuery(kind):
+    def decorate(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return method(*args, **kwargs)
+            #end if
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with metrics.timer('query', kind=kind, table=arguments.get('table_name')) as record:
+                result = method(*args, **kwargs)
+                frame = result if hasattr(result, 'memory_usage') else arguments.get('df')
+                if frame is not None:
+                    record['rows'] = len(frame)
+                    record['bytes'] = int(frame.memory_usage(index=True).sum())
+                #end if
+            #end with
+            return result
+        #end def
+        return wrapper
+    #end def
+    return decorate
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the timers, counters and exports of Metrics
+"""
+
+import json
+import pandas as pd
+import pytest
+from Metrics import Metrics, metrics, instrumentQuery
+
+def test_disabled_records_nothing():
+    m = Metrics()
+    with m.timer('api_request', endpoint='price_history') as record:
+        record['rows'] = 5
+    #end with
+    with m.stage('regressions'):
+        pass
+    #end with
+    m.inc('pipeline_cache_hits_total')
+    m.observe('fetch_throttle_wait_seconds', 0.2)
+    assert m.histograms == {} and m.counters == {} and m.gauges == {}
+
+def test_timer_and_stage_write_json_lines_and_prometheus(tmp_path):
+    jsonl = str(tmp_path / 'metrics.jsonl')
+    prom = str(tmp_path / 'metrics.prom')
+    m = Metrics()
+    m.configure(jsonl=jsonl, prometheus=prom, memory=True)
+    try:
+        with m.timer('api_request', endpoint='price_history') as record:
+            record['outcome'] = 'not_found'
+        #end with
+        with pytest.raises(RuntimeError):
+            with m.timer('api_request', endpoint='fundamentals'):
+                raise RuntimeError('boom')
+            #end with
+        #end with
+        with m.stage('design') as record:
+            block = bytearray(1 << 20)
+        #end with
+        del block
+        m.writePrometheus()
+    finally:
+        m.disable()
+    #end try
+
+    with open(jsonl) as f:
+        events = [json.loads(line) for line in f]
+    #end with
+    assert [e['event'] for e in events] == ['api_request', 'api_request', 'stage']
+    assert events[0]['outcome'] == 'not_found' and events[1]['outcome'] == 'error'
+    assert events[2]['stage'] == 'design' and events[2]['peak_bytes'] >= 1 << 20
+
+    with open(prom) as f:
+        text = f.read()
+    #end with
+    assert '# TYPE api_request_seconds histogram' in text
+    assert 'api_request_seconds_bucket{endpoint="price_history",le="+Inf"} 1' in text
+    assert 'api_request_total{endpoint="fundamentals",outcome="error"} 1' in text
+    assert 'stage_peak_bytes{stage="design"}' in text
+
+class FakeSchema:
+
+    @instrumentQuery('select')
+    def executeSelectStatement(self, table_name, index):
+        return pd.DataFrame({'a': [1.0, 2.0, 3.0]})
+
+    @instrumentQuery('insert')
+    def executeInsertStatement(self, df, table_name, index):
+        return None
+
+def test_instrument_query_counts_rows_and_bytes():
+    metrics.configure()
+    metrics.reset()
+    try:
+        schema = FakeSchema()
+        schema.executeSelectStatement('energy', 'date')
+        schema.executeInsertStatement(pd.DataFrame({'a': [1.0, 2.0]}), table_name='finance', index='date')
+        counters = dict(metrics.counters)
+    finally:
+        metrics.disable()
+        metrics.reset()
+    #end try
+    assert counters[('query_rows_total', (('kind', 'select'), ('table', 'energy')))] == 3
+    assert counters[('query_rows_total', (('kind', 'insert'), ('table', 'finance')))] == 2
+    assert counters[('query_bytes_total', (('kind', 'select'), ('table', 'energy')))] > 0
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Assembly of wide price frames from per-symbol or per-sector pieces.
+
+Chaining pd.merge(how='outer') copies the growing frame once per piece,
+which is quadratic in the number of columns. alignFrames computes the union
+date index once and fills one preallocated matrix, so assembly is linear and
+needs roughly one copy of the data.
+"""
+
+import numpy as np
+import pandas as pd
+
+class PanelUtils:
+
+    def __init__(self):
+        self.data = []
+    #end def
+
+    # Outer-aligns frames on their index in a single pass
+    # Inputs
+    #    frames : list of DataFrames (or Series) indexed by date. Columns are
+    #             expected to be unique across frames; a repeated column keeps
+    #             its first occurrence
+    # Outputs
+    #    DataFrame over the sorted union of all indexes, with every frame's
+    #    columns in order and NaN where a frame has no row for a date
+    def alignFrames(self, frames):
+        frames = [f.to_frame() if isinstance(f, pd.Series) else f for f in frames]
+        frames = [f for f in frames if f.shape[1] > 0]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        #end if
+        index_name = frames[0].index.name
+        union = np.unique(np.concatenate([np.asarray(f.index) for f in frames]))
+
+        columns = []
+        seen = set()
+        pieces = []
+        for f in frames:
+            if f.index.has_duplicates:
+                f = f[~f.index.duplicated()]
+            #end if
+            keep = [c not in seen for c in f.columns]
+            if not all(keep):
+                print('WARNING: duplicate columns dropped: '+', '.join(str(c) for c, k in zip(f.columns, keep) if not k))
+                f = f.loc[:, keep]
+            #end if
+            seen.update(f.columns)
+            columns.extend(f.columns)
+            pieces.append(f)
+        #end for
+
+        matrix = np.full((len(union), len(columns)), np.nan)
+        start = 0
+        for f in pieces:
+            rows = np.searchsorted(union, np.asarray(f.index))
+            matrix[rows, start:start+f.shape[1]] = f.to_numpy(dtype=np.float64)
+            start += f.shape[1]
+        #end for
+        return pd.DataFrame(matrix, index=pd.Index(union, name=index_name), columns=columns, copy=False)
+    #end def
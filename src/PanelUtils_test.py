@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the single-pass aligner matches chained outer merges
+"""
+
+import numpy as np
+import pandas as pd
+from PanelUtils import PanelUtils
+
+def test_matches_outer_merge():
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2021-01-07', periods=30).strftime('%Y-%m-%d')
+    frames = []
+    for k in range(5):
+        keep = np.sort(rng.choice(len(dates), size=20, replace=False))
+        frames.append(pd.DataFrame(rng.normal(size=(20, 3)),
+                                   index=pd.Index(dates[keep], name='date'),
+                                   columns=['s'+str(k)+str(j) for j in range(3)]))
+    merged = frames[0]
+    for f in frames[1:]:
+        merged = pd.merge(merged, f, how='outer', left_index=True, right_index=True)
+    aligned = PanelUtils().alignFrames(frames)
+    pd.testing.assert_frame_equal(aligned, merged, check_index_type=False)
+
+def test_series_and_empty_input():
+    panel = PanelUtils()
+    assert panel.alignFrames([]).empty
+    s = pd.Series([1.0, 2.0], index=pd.Index(['2021-10-19', '2021-10-18'], name='date'), name='aa')
+    aligned = panel.alignFrames([s])
+    assert list(aligned.index) == ['2021-10-18', '2021-10-19']
+    assert list(aligned['aa']) == [2.0, 1.0]
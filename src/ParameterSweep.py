@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Selection and allocation over a grid of parameters from one regression.
+
+SelectionUtils scores symbols with
+    objective = w_fit*(rsquared - max rsquared)^2 + w_alpha*(alpha - max alpha)^2
+over the symbols within outlier_sigma std of the mean alpha (and, with
+min_alpha_t, whose alpha has at least that Newey-West t-statistic), takes
+the N best and splits inv_amount over them. The two squared distances do not
+depend on the parameters, so for a grid of configurations the objectives
+are one (configurations x symbols) product, the shortlists come from
+np.argpartition instead of a sort per configuration, and every N and
+inv_amount is allocated from the same ranked prefix. The result is one row
+per configuration: its shortlist, cost and the mean alpha and R-squared of
+the picks.
+
+Shortlists match SelectionUtils.computeObjective + selectTop (up to the
+order of exact ties), and allocations match SelectionUtils.allocate.
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+from SelectionUtils import W_FIT, W_ALPHA, OUTLIER_SIGMA
+
+# Grid parameters and their defaults. OBJECTIVE_PARAMS change the ranking;
+# N and inv_amount only how much of a ranking is bought, and for how much
+GRID_DEFAULTS = {'w_fit': W_FIT, 'w_alpha': W_ALPHA, 'outlier_sigma': OUTLIER_SIGMA,
+                 'min_alpha_t': None, 'max_volatility': None, 'N': 10, 'inv_amount': 10000}
+OBJECTIVE_PARAMS = ['w_fit', 'w_alpha', 'outlier_sigma', 'min_alpha_t', 'max_volatility']
+
+# Objective configurations scored at once; bounds the (rows x symbols) block
+CHUNK_ROWS = 256
+
+class ParameterSweep:
+
+    # Inputs
+    #    params     : regression results with 'symbol', 'alpha' and
+    #                 'rsquared' columns (the 'regressions' stage), and
+    #                 'hac_t_alpha' (the 'significance' stage) for min_alpha_t
+    #    volatility : optional Series of annualized volatility by symbol
+    #                 (DataQuality's report), needed for max_volatility
+    def __init__(self, params, volatility=None):
+        self.symbols = np.asarray(params['symbol'], dtype=object)
+        alpha = params['alpha'].to_numpy(dtype=np.float64)
+        rsquared = params['rsquared'].to_numpy(dtype=np.float64)
+        self.alpha = alpha
+        self.rsquared = rsquared
+        # As in computeObjective, the maxima, mean and std are over every
+        # symbol, before the outlier cut
+        self.fit_distance = (rsquared - np.nanmax(rsquared)) ** 2
+        self.alpha_distance = (alpha - np.nanmax(alpha)) ** 2
+        self.std_from_mean = np.round(np.abs(alpha - np.nanmean(alpha)) / np.nanstd(alpha, ddof=1), 2)
+        self.alpha_t = None
+        if 'hac_t_alpha' in params:
+            self.alpha_t = params['hac_t_alpha'].to_numpy(dtype=np.float64)
+        #end if
+        self.volatility = None
+        if volatility is not None:
+            self.volatility = pd.Series(volatility, dtype=np.float64).reindex(self.symbols).to_numpy()
+        #end if
+    #end def
+
+    # Every combination of the grid's values
+    # Inputs
+    #    grid : {parameter: value or list of values}, parameters from
+    #           GRID_DEFAULTS. Without w_alpha, w_alpha = 1 - w_fit
+    # Outputs
+    #    DataFrame with one row per configuration and the GRID_DEFAULTS
+    #    columns
+    def expandGrid(self, grid):
+        unknown = [k for k in grid if k not in GRID_DEFAULTS]
+        if len(unknown) > 0:
+            raise KeyError('Unknown sweep parameters: '+', '.join(unknown))
+        #end if
+        values = {}
+        for name, default in GRID_DEFAULTS.items():
+            value = grid.get(name, default)
+            values[name] = list(value) if isinstance(value, (list, tuple, np.ndarray)) else [value]
+        #end for
+        if 'w_alpha' not in grid and 'w_fit' in grid:
+            values['w_alpha'] = [None]
+        #end if
+        configs = pd.DataFrame(list(itertools.product(*values.values())), columns=list(values))
+        if 'w_alpha' not in grid and 'w_fit' in grid:
+            configs['w_alpha'] = 1 - configs['w_fit']
+        #end if
+        return configs
+    #end def
+
+    # Ranked shortlists of the objective configurations
+    # Inputs
+    #    objectives : DataFrame of OBJECTIVE_PARAMS, one row per configuration,
+    #                 min_alpha_t -inf and max_volatility inf for no limit
+    #    N          : length of the shortlists
+    # Outputs
+    #    int array (configurations x N) of positions in self.symbols, best
+    #    first, -1 past the last eligible symbol
+    def rankTop(self, objectives, N):
+        M = len(self.symbols)
+        N = min(N, M)
+        top = np.full((len(objectives), N), -1, dtype=np.int64)
+        if N == 0:
+            return top
+        #end if
+        w_fit = objectives['w_fit'].to_numpy(dtype=np.float64)[:, None]
+        w_alpha = objectives['w_alpha'].to_numpy(dtype=np.float64)[:, None]
+        sigma = objectives['outlier_sigma'].to_numpy(dtype=np.float64)[:, None]
+        min_t = objectives['min_alpha_t'].to_numpy(dtype=np.float64)[:, None]
+        cap = objectives['max_volatility'].to_numpy(dtype=np.float64)[:, None]
+        if self.alpha_t is None and np.isfinite(min_t).any():
+            raise ValueError('min_alpha_t needs the alphas\' t-statistics (hac_t_alpha)')
+        #end if
+        if self.volatility is None and np.isfinite(cap).any():
+            raise ValueError('max_volatility needs the symbols\' volatility')
+        #end if
+        rows = np.arange(N)
+        for a in range(0, len(objectives), CHUNK_ROWS):
+            b = min(a + CHUNK_ROWS, len(objectives))
+            with np.errstate(invalid='ignore'):
+                score = w_fit[a:b] * self.fit_distance + w_alpha[a:b] * self.alpha_distance
+                eligible = self.std_from_mean < sigma[a:b]
+                if self.alpha_t is not None:
+                    # A NaN t-statistic fails any minimum, as in computeObjective
+                    eligible &= (self.alpha_t >= min_t[a:b]) | np.isneginf(min_t[a:b])
+                #end if
+                if self.volatility is not None:
+                    # Symbols without a volatility only pass without a cap
+                    eligible &= (self.volatility <= cap[a:b]) | np.isinf(cap[a:b])
+                #end if
+            #end with
+            # sort_values puts NaN objectives last; ineligible symbols
+            # (NaN here) sort after those and are cut below
+            score[np.isnan(score)] = np.inf
+            score[~eligible] = np.nan
+            best = np.argpartition(score, N - 1, axis=1)[:, :N] if N < M else np.tile(np.arange(M), (b - a, 1))
+            order = np.argsort(np.take_along_axis(score, best, axis=1), axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            count = eligible.sum(axis=1)[:, None]
+            top[a:b] = np.where(rows < count, best, -1)
+        #end for
+        return top
+    #end def
+
+    # Shortlists and allocations of every configuration of a grid
+    # Inputs
+    #    grid           : see expandGrid
+    #    current_prices : Series of latest prices by symbol, or a function
+    #                     returning it for a list of symbols (called once,
+    #                     with every symbol any shortlist contains)
+    # Outputs
+    #    DataFrame, one row per configuration: the grid parameters, the
+    #    shortlist (space-separated, best first), its size, the cost of the
+    #    whole-share allocation, the cash left over, and the mean alpha and
+    #    rsquared of the shortlist
+    def run(self, grid, current_prices):
+        configs = self.expandGrid(grid)
+        N = configs['N'].to_numpy(dtype=np.int64)
+        inv_amount = configs['inv_amount'].to_numpy(dtype=np.float64)
+
+        # Rank each distinct objective configuration once, to the largest N
+        keys = configs[OBJECTIVE_PARAMS].copy()
+        keys['min_alpha_t'] = keys['min_alpha_t'].astype(object).fillna(-np.inf).astype(np.float64)
+        keys['max_volatility'] = keys['max_volatility'].astype(object).fillna(np.inf).astype(np.float64)
+        codes = keys.groupby(OBJECTIVE_PARAMS, sort=False).ngroup().to_numpy()
+        top = self.rankTop(keys.drop_duplicates(), int(N.max()))[codes]
+        top = np.where(np.arange(top.shape[1]) < N[:, None], top, -1)
+        picked = top >= 0
+
+        used = np.unique(top[picked])
+        if callable(current_prices):
+            current_prices = current_prices(list(self.symbols[used]))
+        #end if
+        price = np.full(len(self.symbols), np.nan)
+        price[used] = pd.Series(current_prices, dtype=np.float64).reindex(self.symbols[used]).to_numpy()
+
+        # SelectionUtils.allocate: inv_amount split equally, whole shares
+        position = np.where(picked, top, 0)
+        count = picked.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            target = inv_amount / count
+            shares = np.round(target[:, None] / price[position])
+            subtotal = np.where(picked, shares * price[position], np.nan)
+            mean_alpha = np.nansum(np.where(picked, self.alpha[position], np.nan), axis=1) / count
+            mean_rsquared = np.nansum(np.where(picked, self.rsquared[position], np.nan), axis=1) / count
+        #end with
+        cost = np.nansum(subtotal, axis=1)
+
+        names = self.symbols[position]
+        configs['shortlist'] = [' '.join(row[mask]) for row, mask in zip(names, picked)]
+        configs['n_selected'] = count
+        configs['cost'] = cost
+        configs['cash_left'] = inv_amount - cost
+        configs['mean_alpha'] = mean_alpha
+        configs['mean_rsquared'] = mean_rsquared
+        return configs
+    #end def
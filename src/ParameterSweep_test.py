@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the sweep's shortlists and allocations against SelectionUtils
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from ParameterSweep import ParameterSweep
+from SelectionUtils import SelectionUtils
+
+def make_inputs(M=300):
+    rng = np.random.default_rng(3)
+    symbols = ['s'+str(i) for i in range(M)]
+    params = pd.DataFrame({'symbol': symbols, 'alpha': 1e-3 * rng.standard_normal(M),
+                           'rsquared': rng.uniform(0, 1, M), 'hac_t_alpha': 2 * rng.standard_normal(M)})
+    params.loc[2, 'hac_t_alpha'] = np.nan  # fails any minimum
+    params.loc[0, 'alpha'] = 0.05       # outlier at most cuts
+    params.loc[1, 'rsquared'] = np.nan  # ranked last
+    volatility = pd.Series(rng.uniform(0.1, 0.6, M), index=symbols)
+    prices = pd.Series(rng.uniform(5, 500, M), index=symbols)
+    return params, volatility, prices
+
+def test_sweep_matches_selection_utils():
+    params, volatility, prices = make_inputs()
+    grid = {'w_fit': [0.0008, 0.05, 0.5], 'outlier_sigma': [3, 6], 'min_alpha_t': [None, 1.0],
+            'N': [1, 5, 12], 'inv_amount': [1000, 50000]}
+    table = ParameterSweep(params, volatility).run(grid, prices)
+    assert len(table) == 72 and np.allclose(table['w_fit'] + table['w_alpha'], 1)
+    for row in table.itertuples():
+        min_alpha_t = None if pd.isna(row.min_alpha_t) else row.min_alpha_t
+        selection = SelectionUtils(row.w_fit, row.w_alpha, row.outlier_sigma, min_alpha_t)
+        shortlist = selection.selectTop(selection.computeObjective(params), row.N)
+        allocation = selection.allocate(shortlist, prices, row.inv_amount)
+        assert row.shortlist == ' '.join(shortlist['symbol'])
+        assert np.isclose(row.cost, allocation['Subtotal'].sum())
+        assert np.isclose(row.mean_alpha, shortlist['alpha'].mean())
+
+def test_volatility_cap_and_short_universes():
+    params, volatility, prices = make_inputs(M=20)
+    requested = []
+    def current_prices(symbols):
+        requested.extend(symbols)
+        return prices
+    table = ParameterSweep(params, volatility).run({'max_volatility': [None, 0.3], 'N': [50]}, current_prices)
+    calm = set(volatility.index[volatility <= 0.3])
+    assert table.loc[0, 'n_selected'] == len(SelectionUtils().computeObjective(params))
+    assert set(table.loc[1, 'shortlist'].split()) <= calm and table.loc[1, 'n_selected'] > 0
+    assert sorted(requested) == sorted(table.loc[0, 'shortlist'].split())
+
+def test_bad_grids_are_rejected():
+    params, volatility, prices = make_inputs(M=20)
+    with pytest.raises(KeyError):
+        ParameterSweep(params).run({'top_n': [5]}, prices)
+    with pytest.raises(ValueError):
+        ParameterSweep(params).run({'max_volatility': [0.3]}, prices)
+    with pytest.raises(ValueError):
+        ParameterSweep(params.drop(columns='hac_t_alpha')).run({'min_alpha_t': [2.0]}, prices)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Staged, memoized computation with a persistent content-addressed cache.
+
+A pipeline is a set of named stages. Each stage is a function of the
+outputs of the stages it depends on and of named parameters. Its cache key
+is a hash of the stage name and version, the values of its parameters and
+the keys of its inputs, so a key identifies the content of the result:
+changing a parameter changes the key of the stage that reads it and of
+every stage downstream, and nothing else. Stages that read external data
+(the database, web downloads) also hash a fingerprint of that data, e.g.
+the versions of the tables they read.
+
+Results are kept in memory for the life of the Pipeline object and pickled
+to the cache directory, so a new process reuses them too.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from Metrics import metrics
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'pipeline')
+
+class Stage:
+
+    # Inputs
+    #    name        : stage name, also the keyword its output is passed as
+    #    fn          : called as fn(**inputs, **params)
+    #    inputs      : names of the stages whose outputs fn takes
+    #    params      : names of the pipeline parameters fn takes
+    #    fingerprint : optional fn(params) -> JSON-able value identifying the
+    #                  external data the stage reads
+    #    version     : bump when fn changes, so old results are not reused
+    #    persist     : pickle results to disk (False keeps them in memory only,
+    #                  for stages that already have their own on-disk cache)
+    def __init__(self, name, fn, inputs=(), params=(), fingerprint=None, version=1, persist=True):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.params = list(params)
+        self.fingerprint = fingerprint
+        self.version = version
+        self.persist = persist
+    #end def
+
+class Pipeline:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self.memo = {}
+    #end def
+
+    # Registers a stage; see Stage for the arguments
+    def addStage(self, name, fn, **kwargs):
+        stage = Stage(name, fn, **kwargs)
+        for name_in in stage.inputs:
+            if name_in not in self.stages:
+                raise ValueError('Stage '+name+' depends on unknown stage '+name_in)
+            #end if
+        #end for
+        self.stages[name] = stage
+        return stage
+    #end def
+
+    # Stages needed for targets, dependencies first
+    def getOrder(self, targets):
+        order = []
+        def visit(name):
+            if name not in order:
+                for name_in in self.stages[name].inputs:
+                    visit(name_in)
+                #end for
+                order.append(name)
+            #end if
+        #end def
+        for name in targets:
+            visit(name)
+        #end for
+        return order
+    #end def
+
+    # Cache key of every stage needed for targets. Keys depend on input keys,
+    # not input values, so they are known before anything is computed
+    def getKeys(self, targets, params):
+        keys = {}
+        for name in self.getOrder(targets):
+            stage = self.stages[name]
+            missing = [p for p in stage.params if p not in params]
+            if len(missing) > 0:
+                raise KeyError('Stage '+name+' needs parameters: '+', '.join(missing))
+            #end if
+            content = {'stage': name,
+                       'version': stage.version,
+                       'params': {p: params[p] for p in stage.params},
+                       'inputs': [keys[name_in] for name_in in stage.inputs]}
+            if stage.fingerprint is not None:
+                content['fingerprint'] = stage.fingerprint(params)
+            #end if
+            encoded = json.dumps(content, sort_keys=True, default=str).encode('utf-8')
+            keys[name] = hashlib.sha1(encoded).hexdigest()
+        #end for
+        return keys
+    #end def
+
+    def _path(self, name, key):
+        return os.path.join(self.cache_dir, name+'-'+key+'.pkl')
+    #end def
+
+    # 'memory', 'disk' or None for where a result with this key is cached
+    def getStatus(self, name, key):
+        if self.memo.get(name, (None,))[0] == key:
+            return 'memory'
+        #end if
+        if self.stages[name].persist and os.path.exists(self._path(name, key)):
+            return 'disk'
+        #end if
+        return None
+    #end def
+
+    # Dry run: what run would do for targets, without computing anything
+    # Outputs
+    #    list of (stage, key, status) in execution order, where status is
+    #    'memory' or 'disk' for a cache hit and 'compute' otherwise. A stage
+    #    whose result is cached is not recomputed even if stages it depends
+    #    on would be, and those are then skipped ('skip')
+    def explain(self, targets, params):
+        keys = self.getKeys(targets, params)
+        needed = set()
+        status = {}
+        for name in reversed(self.getOrder(targets)):
+            if name in targets or name in needed:
+                status[name] = self.getStatus(name, keys[name]) or 'compute'
+                if status[name] == 'compute':
+                    needed.update(self.stages[name].inputs)
+                #end if
+            else:
+                status[name] = 'skip'
+            #end if
+        #end for
+        return [(name, keys[name], status[name]) for name in self.getOrder(targets)]
+    #end def
+
+    # Prints explain as a table
+    def printExplain(self, targets, params):
+        for name, key, status in self.explain(targets, params):
+            print(name.ljust(16) + key[:12] + '  ' + status)
+        #end for
+    #end def
+
+    # Computes (or loads) the targets
+    # Inputs
+    #    targets : stage name or list of stage names
+    #    params  : dictionary of parameter values
+    # Outputs
+    #    the target's output, or {name: output} for a list of targets
+    def run(self, targets, params):
+        single = isinstance(targets, str)
+        if single:
+            targets = [targets]
+        #end if
+        keys = self.getKeys(targets, params)
+        results = {name: self._get(name, keys, params) for name in targets}
+        return results[targets[0]] if single else results
+    #end def
+
+    def _get(self, name, keys, params):
+        stage = self.stages[name]
+        key = keys[name]
+        status = self.getStatus(name, key)
+        if status is not None:
+            metrics.inc('pipeline_cache_hits_total', stage=name, where=status)
+        #end if
+        if status == 'memory':
+            return self.memo[name][1]
+        #end if
+        if status == 'disk':
+            with open(self._path(name, key), 'rb') as f:
+                value = pickle.load(f)
+            #end with
+        else:
+            kwargs = {name_in: self._get(name_in, keys, params) for name_in in stage.inputs}
+            kwargs.update({p: params[p] for p in stage.params})
+            with metrics.stage(name):
+                value = stage.fn(**kwargs)
+            #end with
+            if stage.persist:
+                self._store(name, key, value)
+            #end if
+        #end if
+        self.memo[name] = (key, value)
+        return value
+    #end def
+
+    # Writes a result, replacing the stage's older results. The pickle is
+    # written under a temporary name first so a crash never leaves a
+    # truncated entry under a valid key
+    def _store(self, name, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(name+'-') and entry.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_dir, entry))
+            #end if
+        #end for
+        temp = self._path(name, key) + '.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        #end with
+        os.replace(temp, self._path(name, key))
+    #end def
+
+    # Drops every cached result, in memory and on disk
+    def clear(self):
+        self.memo = {}
+        if os.path.isdir(self.cache_dir):
+            for entry in os.listdir(self.cache_dir):
+                os.remove(os.path.join(self.cache_dir, entry))
+            #end for
+        #end if
+    #end def
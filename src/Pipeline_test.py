@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Checks which stages the memoized pipeline reruns, and the Fama-French
+stages on offline data
+"""
+
+import numpy as np
+import pandas as pd
+from Pipeline import Pipeline
+from FamaFrenchPipeline import FamaFrenchPipeline
+from ReferenceCache import ReferenceCache
+
+def make_pipeline(cache_dir, calls):
+    def source(scale):
+        calls.append('source')
+        return np.arange(5) * scale
+    def total(source):
+        calls.append('total')
+        return source.sum()
+    def report(total, label):
+        calls.append('report')
+        return label + str(total)
+    p = Pipeline(str(cache_dir))
+    p.addStage('source', source, params=['scale'])
+    p.addStage('total', total, inputs=['source'])
+    p.addStage('report', report, inputs=['total'], params=['label'])
+    return p
+
+def test_only_downstream_stages_rerun_and_results_persist(tmp_path):
+    calls = []
+    p = make_pipeline(tmp_path, calls)
+    assert p.run('report', {'scale': 2, 'label': 'a'}) == 'a20'
+    assert calls == ['source', 'total', 'report']
+
+    calls.clear()
+    assert [s for n, k, s in p.explain(['report'], {'scale': 2, 'label': 'b'})] == ['skip', 'memory', 'compute']
+    assert p.run('report', {'scale': 2, 'label': 'b'}) == 'b20'
+    assert calls == ['report']
+
+    # A new process (new Pipeline) finds the results on disk
+    calls.clear()
+    q = make_pipeline(tmp_path, calls)
+    assert [s for n, k, s in q.explain(['report'], {'scale': 2, 'label': 'b'})] == ['skip', 'skip', 'disk']
+    assert q.run(['total', 'report'], {'scale': 2, 'label': 'b'}) == {'total': 20, 'report': 'b20'}
+    assert calls == []
+    assert [s for n, k, s in q.explain(['report'], {'scale': 3, 'label': 'b'})] == ['compute'] * 3
+
+class FakeSchema:
+    def __init__(self, prices):
+        self.prices = prices
+        self.versions = {'fundamentals': ('zzz', 40, 4), 'Capital_Goods': ('2022-01-07', 120, 41)}
+    def getSectorList(self):
+        return ['Capital_Goods']
+    def getTableVersion(self, table_name, index):
+        return self.versions[table_name]
+    def getLastPrices(self, symbols):
+        return self.prices.ffill().iloc[-1].reindex(symbols).dropna()
+
+class OfflinePipeline(FamaFrenchPipeline):
+    def __init__(self, cache_dir, prices, market, fundamentals):
+        self.data = (prices, fundamentals)
+        def index(series_id, start, end):
+            return market[series_id.strip('^')].loc[start:end]
+        def tbill(series_id, start, end):
+            return pd.Series(0.03, index=market.index).loc[start:end]
+        reference = ReferenceCache({'yahoo': index, 'treasury': tbill}, cache_dir=cache_dir+'/reference')
+        super().__init__(FakeSchema(prices), cache_dir, reference)
+    def getFundamentals(self):
+        return self.data[1]
+    def getPrices(self, start, end):
+        return self.data[0].loc[start:end]
+
+def test_fama_french_stages_offline(tmp_path):
+    rng = np.random.default_rng(0)
+    T, M = 120, 40
+    dates = pd.Index(pd.bdate_range('2021-01-04', periods=T).strftime('%Y-%m-%d'), name='date')
+    symbols = ['s'+str(i) for i in range(M)]
+    prices = pd.DataFrame(100 * np.cumprod(1 + 0.001 * rng.standard_normal((T, M)), axis=0),
+                          index=dates, columns=symbols)
+    level = 1000 * np.cumprod(1 + 0.001 * rng.standard_normal(T))
+    market = pd.DataFrame({'NDX': level, 'NYA': level, 'XMI': level, 'market': 3 * level}, index=dates)
+    fundamentals = pd.DataFrame({'symbol': symbols,
+                                 'marketcap': np.linspace(1, 100, M),
+                                 'booktomarket': np.tile([0.1, 0.5, 0.9, 0.3], M // 4)})
+    # A symbol listed part way through is quarantined without shortening
+    # everyone else's sample
+    prices.iloc[:60, 0] = np.nan
+
+    ff = OfflinePipeline(str(tmp_path), prices, market, fundamentals)
+    allocation = ff.run('allocation', N=5, start=dates[0], end=dates[-1])
+    quality = ff.run('quality', start=dates[0], end=dates[-1])
+    assert quality.loc['s0', 'reason'] == 'max_missing,max_gap'
+    design = ff.run('design', start=dates[0], end=dates[-1])
+    assert len(design['returns']) == T - 1 and 's0' not in design['symbols']
+    assert len(allocation) == 5
+    assert np.allclose(allocation['Current Price'], prices.join(market).iloc[-1][allocation.index])
+
+    sweep = ff.sweep({'N': [3, 5], 'inv_amount': [500, 10000]}, start=dates[0], end=dates[-1])
+    assert len(sweep) == 4 and sweep.loc[3, 'shortlist'] == ' '.join(allocation.index)
+    assert np.isclose(sweep.loc[3, 'cost'], allocation['Subtotal'].sum())
+
+    explain = ff.explain(['allocation'], N=5, inv_amount=500, start=dates[0], end=dates[-1])
+    status = dict((n, s) for n, k, s in explain)
+    assert status['allocation'] == 'compute' and status['shortlist'] == 'memory'
+    assert status['regressions'] == 'skip'
+
+    class FakeStore:
+        def saveRun(self, results, params, allocation, residuals):
+            self.saved = (results, params, allocation, residuals)
+            return 1
+    store = FakeStore()
+    assert ff.saveResults(store, residuals=True, N=5, start=dates[0], end=dates[-1]) == 1
+    results, params, saved_allocation, residuals = store.saved
+    assert params['N'] == 5 and saved_allocation.equals(allocation)
+    assert results['objective'].notna().sum() > 0 and len(results) == residuals.shape[1]
+
+    smaller = ff.run('allocation', N=5, inv_amount=500, start=dates[0], end=dates[-1])
+    assert (smaller['Number of Shares'] <= allocation['Number of Shares']).all()
+
+    significance = ff.run('significance', start=dates[0], end=dates[-1])
+    assert significance['hac_t_alpha'].notna().all()
+    significant = ff.run('shortlist', N=40, min_alpha_t=1.0, start=dates[0], end=dates[-1])
+    assert (significant['hac_t_alpha'] >= 1.0).all()
+    sweep = ff.sweep({'N': [40]}, min_alpha_t=1.0, start=dates[0], end=dates[-1])
+    assert set(sweep.loc[0, 'shortlist'].split()) == set(significant['symbol']) and 0 < len(significant) < 40
+
+    # A write to a price table changes its version, and with it every stage
+    # computed from the prices
+    explain = ff.explain(['shortlist'], N=40, min_alpha_t=1.0, start=dates[0], end=dates[-1])
+    assert dict((n, s) for n, k, s in explain)['shortlist'] == 'memory'
+    ff.schema.versions['Capital_Goods'] = ('2022-01-10', 121, 41)
+    explain = ff.explain(['shortlist', 'allocation'], N=40, min_alpha_t=1.0, start=dates[0], end=dates[-1])
+    status = dict((n, s) for n, k, s in explain)
+    for name in ['prices', 'quality', 'returns', 'design', 'regressions', 'significance', 'objective',
+                 'shortlist', 'allocation']:
+        assert status[name] == 'compute', name
+    assert status['fundamentals'] != 'compute' and status['market'] != 'compute'
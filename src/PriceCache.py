@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the assembled wide price panel.
+
+Entries are keyed by the sector tables they were built from and each table's
+version (latest date, row and column counts), so a panel is reused until the
+updater writes new data. Values are stored symbol-major in a .npy file that
+is memory mapped on load: opening an entry costs almost nothing, and reading
+a handful of symbols only touches their rows of the file.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'prices')
+
+class PriceCache:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+    #end def
+
+    # Key for the panel assembled from the given tables in their current state
+    # Inputs
+    #    schema     : SchemaUtils used to look up table versions
+    #    table_list : source tables (sectors), in the order they are merged
+    #    bounds     : (start, end) dates the panel was read for, if it is not
+    #                 the whole tables
+    def getSourceKey(self, schema, table_list, index='date', bounds=None):
+        versions = [[table] + [str(v) for v in schema.getTableVersion(table, index)] for table in table_list]
+        if bounds is not None:
+            versions.append([str(b) for b in bounds])
+        return hashlib.sha1(json.dumps(versions).encode('utf-8')).hexdigest()
+    #end def
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+    #end def
+
+    def contains(self, key):
+        return os.path.exists(os.path.join(self._entry(key), 'meta.json'))
+    #end def
+
+    # Writes the panel for key, replacing any older entries (a new key means
+    # the source tables changed). The values file is written before
+    # meta.json, so a crash part way through never leaves an entry that
+    # looks complete.
+    def store(self, key, df):
+        self.invalidate()
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        values = np.ascontiguousarray(df.to_numpy(dtype=np.float64).T)
+        np.save(os.path.join(entry, 'values.npy'), values)
+        meta = {'columns': [str(c) for c in df.columns],
+                'index': [str(i) for i in df.index],
+                'index_name': df.index.name}
+        with open(os.path.join(entry, 'meta.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(entry, 'meta.tmp'), os.path.join(entry, 'meta.json'))
+    #end def
+
+    # Returns the cached panel for key, or None if there is no entry.
+    # Inputs
+    #    columns : optional list of symbols to load; only their rows of the
+    #              values file are read. Unknown symbols are skipped
+    #    mmap    : when True and all columns are requested, the frame is a
+    #              read-only view onto the memory-mapped file (zero copy)
+    def load(self, key, columns=None, mmap=True):
+        if not self.contains(key):
+            return None
+        entry = self._entry(key)
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+        values = np.load(os.path.join(entry, 'values.npy'), mmap_mode='r' if mmap else None)
+        all_columns = meta['columns']
+        if columns is not None:
+            position = {c: i for i, c in enumerate(all_columns)}
+            rows = [position[c] for c in columns if c in position]
+            all_columns = [all_columns[i] for i in rows]
+            values = np.asarray(values[rows])
+        #end if
+        index = pd.Index(meta['index'], name=meta['index_name'])
+        return pd.DataFrame(values.T, index=index, columns=all_columns, copy=False)
+    #end def
+
+    # Removes every entry; the updater calls this after writing prices so a
+    # stale panel is never served even if a table's version did not change
+    def invalidate(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        #end if
+    #end def
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that cached price panels round-trip and support column subsets
+"""
+
+import numpy as np
+import pandas as pd
+from PriceCache import PriceCache
+
+class FakeSchema:
+    def __init__(self, versions):
+        self.versions = versions
+    def getTableVersion(self, table_name, index):
+        return self.versions[table_name]
+
+def make_prices():
+    return pd.DataFrame({'aa': [1.0, np.nan, 3.0], 'ach': [4.0, 5.0, 6.0], 'ades': [7.0, 8.0, 9.0]},
+                        index=pd.Index(['2021-10-18', '2021-10-19', '2021-10-20'], name='date'))
+
+def test_roundtrip_and_subset(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    prices = make_prices()
+    key = cache.getSourceKey(FakeSchema({'energy': ('2021-10-20', 3, 4)}), ['energy'])
+    assert cache.load(key) is None
+    cache.store(key, prices)
+    pd.testing.assert_frame_equal(cache.load(key), prices)
+    pd.testing.assert_frame_equal(cache.load(key, columns=['ades', 'aa', 'zz']), prices[['ades', 'aa']])
+
+def test_key_changes_with_new_data(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    before = cache.getSourceKey(FakeSchema({'energy': ('2021-10-20', 3, 4)}), ['energy'])
+    after = cache.getSourceKey(FakeSchema({'energy': ('2021-10-21', 4, 4)}), ['energy'])
+    assert before != after
+    cache.store(before, make_prices())
+    cache.invalidate()
+    assert cache.load(before) is None
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory price panel.
+
+Prices are one contiguous dates x symbols NumPy array (float32 or float64),
+dates are int32 day numbers (days since 1970-01-01) and symbols live in a
+single registry mapping each symbol to its column. Compared with a
+DataFrame indexed by 'YYYY-MM-DD' strings this needs a fraction of the
+memory, aligns panels by integer search instead of string comparison, and
+returns, volatility and subsets come straight from array views.
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+
+MS_PER_DAY = 86400000
+
+# Day numbers from TD Ameritrade 'milliseconds since epoch' timestamps.
+# Candles are stamped at midnight US Central time, which is early morning
+# UTC, so flooring to the UTC day gives the trading date.
+def epochToDayNumbers(epoch_ms):
+    return (np.asarray(epoch_ms, dtype=np.int64) // MS_PER_DAY).astype(np.int32)
+#end def
+
+# Day numbers from 'YYYY-MM-DD' strings, datetimes or datetime64 values
+def toDayNumbers(dates):
+    days = np.asarray(dates)
+    if days.dtype.kind != 'M':
+        days = np.asarray(pd.to_datetime(pd.Index(dates)).values)
+    #end if
+    return days.astype('datetime64[D]').astype(np.int32)
+#end def
+
+# 'YYYY-MM-DD' strings for day numbers, the format of the date column in the
+# price tables
+def toDateStrings(days):
+    return np.asarray(days, dtype=np.int32).astype('datetime64[D]').astype(str)
+#end def
+
+class SymbolRegistry:
+
+    __slots__ = ('symbols', 'positions')
+
+    def __init__(self, symbols):
+        self.symbols = [sys.intern(str(s)) for s in symbols]
+        self.positions = {s: i for i, s in enumerate(self.symbols)}
+        if len(self.positions) != len(self.symbols):
+            raise ValueError('Duplicate symbols in registry')
+        #end if
+    #end def
+
+    def __len__(self):
+        return len(self.symbols)
+    #end def
+
+    def __contains__(self, symbol):
+        return symbol in self.positions
+    #end def
+
+    def __iter__(self):
+        return iter(self.symbols)
+    #end def
+
+    # Column of a single symbol; KeyError if it is not registered
+    def getIndex(self, symbol):
+        return self.positions[symbol]
+    #end def
+
+    # Columns of several symbols, -1 for any that are not registered
+    def getIndexer(self, symbols):
+        return np.array([self.positions.get(s, -1) for s in symbols], dtype=np.int64)
+    #end def
+
+class PricePanel:
+
+    __slots__ = ('values', 'dates', 'registry')
+
+    # Inputs
+    #    values  : T x M array of prices, NaN where missing
+    #    dates   : T increasing int32 day numbers
+    #    symbols : M symbols, or a SymbolRegistry to share
+    def __init__(self, values, dates, symbols):
+        self.values = values
+        self.dates = np.asarray(dates, dtype=np.int32)
+        self.registry = symbols if isinstance(symbols, SymbolRegistry) else SymbolRegistry(symbols)
+        if values.shape != (len(self.dates), len(self.registry)):
+            raise ValueError('Panel shape '+str(values.shape)+' does not match '+
+                             str(len(self.dates))+' dates x '+str(len(self.registry))+' symbols')
+        #end if
+    #end def
+
+    # Panel from a wide DataFrame indexed by date (as read from the price
+    # tables or PriceCache)
+    @classmethod
+    def fromFrame(cls, df, dtype=np.float64):
+        values = np.ascontiguousarray(df.to_numpy(dtype=dtype))
+        return cls(values, toDayNumbers(df.index), df.columns)
+    #end def
+
+    # One-symbol panel from the 'candles' list of a price history response
+    @classmethod
+    def fromCandles(cls, symbol, candles, dtype=np.float64):
+        close = np.fromiter((c['close'] for c in candles), dtype=dtype, count=len(candles))
+        epoch = np.fromiter((c['datetime'] for c in candles), dtype=np.int64, count=len(candles))
+        days = epochToDayNumbers(epoch)
+        days, first = np.unique(days, return_index=True)
+        return cls(close[first][:, None], days, [symbol])
+    #end def
+
+    # Outer-aligns panels on their dates, like PanelUtils.alignFrames. A
+    # symbol repeated across panels keeps its first occurrence
+    @classmethod
+    def concat(cls, panels, dtype=np.float64):
+        panels = [p for p in panels if len(p.registry) > 0]
+        if len(panels) == 0:
+            return cls(np.empty((0, 0), dtype=dtype), [], [])
+        #end if
+        union = np.unique(np.concatenate([p.dates for p in panels]))
+        symbols = []
+        seen = set()
+        pieces = []
+        for p in panels:
+            keep = np.array([s not in seen for s in p.registry], dtype=bool)
+            seen.update(p.registry)
+            symbols.extend(s for s, k in zip(p.registry, keep) if k)
+            pieces.append((p, keep))
+        #end for
+        values = np.full((len(union), len(symbols)), np.nan, dtype=dtype)
+        start = 0
+        for p, keep in pieces:
+            width = int(keep.sum())
+            values[np.searchsorted(union, p.dates), start:start+width] = p.values[:, keep]
+            start += width
+        #end for
+        return cls(values, union, symbols)
+    #end def
+
+    # Wide DataFrame indexed by 'YYYY-MM-DD' strings, the layout of the price
+    # tables. The frame shares the panel's values
+    def toFrame(self):
+        index = pd.Index(toDateStrings(self.dates), name='date')
+        return pd.DataFrame(self.values, index=index, columns=list(self.registry.symbols), copy=False)
+    #end def
+
+    @property
+    def symbols(self):
+        return self.registry.symbols
+    #end def
+
+    @property
+    def shape(self):
+        return self.values.shape
+    #end def
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.dates.nbytes
+    #end def
+
+    def getDates(self):
+        return self.dates.astype('datetime64[D]')
+    #end def
+
+    # Price history of one symbol (a view)
+    def getColumn(self, symbol):
+        return self.values[:, self.registry.getIndex(symbol)]
+    #end def
+
+    # Panel of the given symbols, in that order. Unknown symbols are skipped
+    def select(self, symbols):
+        columns = self.registry.getIndexer(symbols)
+        columns = columns[columns >= 0]
+        return PricePanel(self.values[:, columns], self.dates,
+                          [self.registry.symbols[i] for i in columns])
+    #end def
+
+    # Rows from start to end inclusive ('YYYY-MM-DD', datetime64 or day
+    # number; None is open-ended). The values are a view, not a copy
+    def between(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self.dates, self._day(start), side='left')
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates, self._day(end), side='right')
+        return PricePanel(self.values[lo:hi], self.dates[lo:hi], self.registry)
+    #end def
+
+    def _day(self, date):
+        if isinstance(date, (int, np.integer)):
+            return date
+        #end if
+        return toDayNumbers([date])[0]
+    #end def
+
+    # Simple returns; one row shorter than the panel (the first date has none)
+    def returns(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = self.values[1:] / self.values[:-1] - 1
+        #end with
+        return PricePanel(values, self.dates[1:], self.registry)
+    #end def
+
+    # Annualized volatility of daily returns per symbol, ignoring missing days
+    def volatility(self, periods_per_year=252):
+        returns = self.returns().values
+        n = np.sum(~np.isnan(returns), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(returns, axis=0) / n
+            var = np.nansum((returns - mean) ** 2, axis=0) / (n - 1)
+        #end with
+        var[n < 2] = np.nan
+        return np.sqrt(var) * periods_per_year ** 0.5
+    #end def
+
+    # Latest price per symbol (NaN if the last date has no price)
+    def last(self):
+        return self.values[-1] if len(self.dates) > 0 else np.full(len(self.registry), np.nan)
+    #end def
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Checks PricePanel against the DataFrame paths it replaces
+"""
+
+import numpy as np
+import pandas as pd
+from PanelUtils import PanelUtils
+from PricePanel import PricePanel, epochToDayNumbers, toDateStrings
+
+def make_frame(T=60, M=5, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2021-01-04', periods=T).strftime('%Y-%m-%d')
+    values = 100 * np.cumprod(1 + 0.01 * rng.standard_normal((T, M)), axis=0)
+    df = pd.DataFrame(values, index=pd.Index(dates, name='date'), columns=['s'+str(i) for i in range(M)])
+    df.iloc[5:9, 2] = np.nan
+    return df
+
+def test_frame_round_trip_returns_and_volatility():
+    df = make_frame()
+    panel = PricePanel.fromFrame(df, dtype=np.float32)
+    assert panel.values.dtype == np.float32 and panel.values.flags['C_CONTIGUOUS']
+    assert panel.dates.dtype == np.int32
+    pd.testing.assert_frame_equal(panel.toFrame(), df.astype(np.float32))
+
+    panel = PricePanel.fromFrame(df)
+    expected = df.pct_change(fill_method=None).iloc[1:]
+    pd.testing.assert_frame_equal(panel.returns().toFrame(), expected)
+    assert np.allclose(panel.volatility(), expected.std() * 252 ** 0.5)
+
+    sub = panel.select(['s3', 'missing', 's1']).between('2021-01-11', '2021-01-15')
+    assert sub.symbols == ['s3', 's1']
+    pd.testing.assert_frame_equal(sub.toFrame(), df.loc['2021-01-11':'2021-01-15', ['s3', 's1']])
+    assert np.shares_memory(panel.between('2021-01-11').values, panel.values)
+    assert panel.last()[4] == df['s4'].iloc[-1]
+
+def test_candles_and_concat_match_frame_path():
+    # TD candles are stamped at midnight US Central time
+    epoch = [int(pd.Timestamp(d, tz='America/Chicago').timestamp() * 1000)
+             for d in ['2021-03-12', '2021-03-15', '2021-03-16']]
+    candles = [{'close': 1.0 + i, 'datetime': e} for i, e in enumerate(epoch)]
+    panel = PricePanel.fromCandles('abc', candles)
+    assert list(toDateStrings(panel.dates)) == ['2021-03-12', '2021-03-15', '2021-03-16']
+    assert list(epochToDayNumbers(epoch)) == list(panel.dates)
+
+    df = make_frame(M=6)
+    pieces = [df.iloc[:40, :2], df.iloc[10:, 2:5], df.iloc[::2, 4:]]
+    combined = PricePanel.concat([PricePanel.fromFrame(p) for p in pieces]).toFrame()
+    pd.testing.assert_frame_equal(combined, PanelUtils().alignFrames(pieces))
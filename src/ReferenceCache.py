@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Local cache of the reference series fama_french.py downloads: the market
+indexes from Yahoo Finance and the T-bill rates from Nasdaq Data Link.
+
+Each series is stored with the date ranges that have already been fetched,
+so a request only downloads the parts of its range not yet covered and
+merges them in. Coverage of the most recent days expires after a TTL, since
+the providers revise and extend them. If the provider cannot be reached the
+cached data is returned with a warning.
+
+Fetchers are plain callables fetch(series_id, start, end) returning a
+Series indexed by date for start <= date < end ('YYYY-MM-DD' strings), so
+the web providers can be swapped for a local stand-in (CsvFetcher) in tests
+and air-gapped runs.
+"""
+
+import os
+import re
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from PricePanel import toDayNumbers, toDateStrings
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'reference')
+
+# Daily close of a Yahoo Finance ticker, e.g. '^NDX'
+class YahooFetcher:
+
+    def __call__(self, series_id, start, end):
+        import yfinance as yf
+        close = yf.download(series_id, start=start, end=end, progress=False)['Close']
+        if isinstance(close, pd.DataFrame):
+            close = close.iloc[:, 0]
+        #end if
+        return close
+    #end def
+
+# One column of a Nasdaq Data Link dataset, e.g. 'USTREASURY/BILLRATES'
+class NasdaqDataLinkFetcher:
+
+    def __init__(self, column, authtoken=None):
+        self.column = column
+        self.authtoken = authtoken
+    #end def
+
+    def __call__(self, series_id, start, end):
+        import nasdaqdatalink as ndl
+        end = str(np.datetime64(end) - np.timedelta64(1, 'D'))
+        data = ndl.get(series_id, start_date=start, end_date=end, authtoken=self.authtoken)
+        return data[self.column]
+    #end def
+
+# Reads <directory>/<series_id>.csv (first column dates, second values), for
+# runs without network access
+class CsvFetcher:
+
+    def __init__(self, directory):
+        self.directory = directory
+    #end def
+
+    def __call__(self, series_id, start, end):
+        path = os.path.join(self.directory, safeName(series_id)+'.csv')
+        series = pd.read_csv(path, index_col=0).iloc[:, 0]
+        days = toDayNumbers(series.index)
+        keep = (days >= toDayNumbers([start])[0]) & (days < toDayNumbers([end])[0])
+        return series[keep]
+    #end def
+
+def safeName(series_id):
+    return re.sub(r'[^A-Za-z0-9]+', '_', series_id).strip('_')
+#end def
+
+class ReferenceCache:
+
+    # Inputs
+    #    fetchers    : {source name: fetcher}; defaults to 'yahoo' (YahooFetcher)
+    #    cache_dir   : where series are stored
+    #    recent_days : days before today whose coverage expires
+    #    ttl         : seconds before coverage of recent days expires
+    #    clock       : returns the current time in seconds since the epoch
+    def __init__(self, fetchers=None, cache_dir=DEFAULT_CACHE_DIR, recent_days=5, ttl=12*3600,
+                 clock=time.time):
+        self.fetchers = {'yahoo': YahooFetcher()} if fetchers is None else dict(fetchers)
+        self.cache_dir = cache_dir
+        self.recent_days = recent_days
+        self.ttl = ttl
+        self.clock = clock
+        self.downloads = 0
+    #end def
+
+    def registerFetcher(self, source, fetcher):
+        self.fetchers[source] = fetcher
+    #end def
+
+    def _path(self, source, series_id):
+        return os.path.join(self.cache_dir, source, safeName(series_id)+'.npz')
+    #end def
+
+    # Stored (days, values, ranges). ranges is an n x 3 array of
+    # [first day, end day (exclusive), time fetched]
+    def _read(self, source, series_id):
+        path = self._path(source, series_id)
+        if not os.path.exists(path):
+            return np.empty(0, np.int32), np.empty(0), np.empty((0, 3))
+        #end if
+        with np.load(path) as data:
+            return data['days'], data['values'], data['ranges']
+        #end with
+    #end def
+
+    def _write(self, source, series_id, days, values, ranges):
+        path = self._path(source, series_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path[:-len('.npz')] + '.tmp.npz'
+        np.savez(temp, days=days, values=values, ranges=ranges)
+        os.replace(temp, path)
+    #end def
+
+    def _today(self):
+        return int(self.clock() // 86400)
+    #end def
+
+    # Day ranges [a, b) within [start, end) not covered by ranges. Coverage
+    # of the last recent_days days counts only if fetched within the TTL
+    def getGaps(self, ranges, start, end):
+        cutoff = self._today() - self.recent_days
+        now = self.clock()
+        covered = []
+        for a, b, fetched in ranges:
+            if now - fetched > self.ttl:
+                b = min(b, cutoff)
+            #end if
+            if b > a:
+                covered.append((int(a), int(b)))
+            #end if
+        #end for
+        gaps = []
+        position = start
+        for a, b in sorted(covered):
+            if a > position:
+                gaps.append((position, min(a, end)))
+            #end if
+            position = max(position, b)
+            if position >= end:
+                break
+            #end if
+        #end for
+        if position < end:
+            gaps.append((position, end))
+        #end if
+        return [(a, b) for a, b in gaps if b > a]
+    #end def
+
+    # Ranges after fetching [a, b) at time fetched: the new range replaces
+    # whatever it overlaps, and ranges wholly before the recent window
+    # (which never expire) are merged with their neighbours
+    def _addRange(self, ranges, a, b, fetched):
+        pieces = []
+        for ra, rb, rt in ranges:
+            if ra < a:
+                pieces.append((ra, min(rb, a), rt))
+            #end if
+            if rb > b:
+                pieces.append((max(ra, b), rb, rt))
+            #end if
+        #end for
+        pieces.append((a, b, fetched))
+        pieces.sort()
+        cutoff = self._today() - self.recent_days
+        merged = []
+        for piece in pieces:
+            if len(merged) > 0 and merged[-1][1] >= piece[0] and piece[1] <= cutoff:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], piece[1]), max(merged[-1][2], piece[2]))
+            else:
+                merged.append(piece)
+            #end if
+        #end for
+        return np.array(merged, dtype=np.float64).reshape(-1, 3)
+    #end def
+
+    # Series for start <= date <= end, downloading only what is missing
+    # Inputs
+    #    source    : name of a registered fetcher
+    #    series_id : identifier passed to the fetcher, e.g. '^NDX'
+    #    start,end : 'YYYY-MM-DD' (end inclusive; None means today)
+    # Outputs
+    #    float Series indexed by 'YYYY-MM-DD' strings, named series_id
+    def getSeries(self, source, series_id, start, end=None):
+        fetcher = self.fetchers[source]
+        first = int(toDayNumbers([start])[0])
+        stop = self._today() + 1 if end is None else min(int(toDayNumbers([end])[0]) + 1, self._today() + 1)
+        days, values, ranges = self._read(source, series_id)
+
+        gaps = self.getGaps(ranges, first, stop)
+        for a, b in gaps:
+            try:
+                fetched = fetcher(series_id, str(toDateStrings([a])[0]), str(toDateStrings([b])[0]))
+            except Exception as e:
+                if len(days) == 0:
+                    raise
+                #end if
+                print('WARNING: could not fetch '+series_id+' ('+str(e)+'); using cached data')
+                break
+            #end try
+            self.downloads += 1
+            fetched = fetched.dropna()
+            new_days = toDayNumbers(fetched.index) if len(fetched) > 0 else np.empty(0, np.int32)
+            keep = (new_days >= a) & (new_days < b)
+            old = (days < a) | (days >= b)
+            days = np.concatenate([days[old], new_days[keep]])
+            values = np.concatenate([values[old], fetched.to_numpy(dtype=np.float64)[keep]])
+            order = np.argsort(days, kind='stable')
+            days, values = days[order], values[order]
+            ranges = self._addRange(ranges, a, b, self.clock())
+            self._write(source, series_id, days, values, ranges)
+        #end for
+
+        select = (days >= first) & (days < stop)
+        index = pd.Index(toDateStrings(days[select]), name='date')
+        return pd.Series(values[select], index=index, name=series_id)
+    #end def
+
+    # Removes every stored series
+    def invalidate(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        #end if
+    #end def
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the reference cache only fetches the date ranges it is missing
+"""
+
+import numpy as np
+import pandas as pd
+from ReferenceCache import ReferenceCache, CsvFetcher
+
+DAY = 86400
+
+class FakeProvider:
+    def __init__(self):
+        self.requests = []
+        self.offline = False
+    def __call__(self, series_id, start, end):
+        if self.offline:
+            raise ConnectionError('offline')
+        self.requests.append((start, end))
+        dates = pd.bdate_range(start, end, inclusive='left')
+        return pd.Series(np.arange(len(dates), dtype=float) + dates.day, index=dates)
+
+def test_only_missing_ranges_are_fetched(tmp_path):
+    provider = FakeProvider()
+    now = [pd.Timestamp('2022-01-10').timestamp()]
+    cache = ReferenceCache({'test': provider}, cache_dir=str(tmp_path), recent_days=3, ttl=3600,
+                           clock=lambda: now[0])
+
+    first = cache.getSeries('test', '^NDX', '2021-06-01', '2021-06-30')
+    assert provider.requests == [('2021-06-01', '2021-07-01')]
+    assert first.index[0] == '2021-06-01' and first.index[-1] == '2021-06-30'
+
+    # Inside the covered range: no download. Overlapping: only the gaps
+    assert cache.getSeries('test', '^NDX', '2021-06-10', '2021-06-20').equals(first.loc['2021-06-10':'2021-06-20'])
+    cache.getSeries('test', '^NDX', '2021-05-15', '2021-07-15')
+    assert provider.requests[1:] == [('2021-05-15', '2021-06-01'), ('2021-07-01', '2021-07-16')]
+
+    # A new process sees the same coverage; recent days expire after the TTL
+    cache = ReferenceCache({'test': provider}, cache_dir=str(tmp_path), recent_days=3, ttl=3600,
+                           clock=lambda: now[0])
+    cache.getSeries('test', '^NDX', '2021-12-01')
+    assert provider.requests[-1] == ('2021-12-01', '2022-01-11')
+    cache.getSeries('test', '^NDX', '2021-12-01')
+    assert len(provider.requests) == 4
+    now[0] += 2 * 3600
+    cache.getSeries('test', '^NDX', '2021-12-01')
+    assert provider.requests[-1] == ('2022-01-07', '2022-01-11')
+
+    # Offline: cached data with a warning instead of an error
+    provider.offline = True
+    now[0] += 2 * DAY
+    series = cache.getSeries('test', '^NDX', '2021-05-15')
+    assert series.index[0] == '2021-05-17' and series.index[-1] == '2022-01-10'
+
+def test_csv_stand_in(tmp_path):
+    dates = pd.bdate_range('2021-01-04', periods=30).strftime('%Y-%m-%d')
+    pd.Series(np.arange(30.0), index=pd.Index(dates, name='date')).to_csv(tmp_path / 'USTREASURY_BILLRATES.csv')
+    cache = ReferenceCache({'treasury': CsvFetcher(str(tmp_path))}, cache_dir=str(tmp_path / 'cache'))
+    series = cache.getSeries('treasury', 'USTREASURY/BILLRATES', '2021-01-11', '2021-01-15')
+    assert list(series.index) == list(dates[5:10])
+    assert list(series) == [5.0, 6.0, 7.0, 8.0, 9.0]
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Batched ordinary least squares for the Fama-French factor regressions.
+
+Every symbol is regressed on the same design matrix [const, excess_return,
+SMB, HML], so X'X only has to be formed once and all symbols can be solved
+in a single pass over the returns matrix.
+"""
+
+import numpy as np
+import pandas as pd
+
+class RegressionUtils:
+
+    def __init__(self):
+        self.data = []
+
+    # Fit y = X*b + e for every column of Y at once
+    # Inputs
+    #    Y     : T x M array (or DataFrame) of returns, one column per symbol
+    #    X     : T x K design matrix shared by all symbols (include the constant)
+    #    mask  : optional T x M boolean array, True where Y is observed. If
+    #            omitted and Y contains NaNs, the mask is taken from ~isnan(Y)
+    #    resid : also return the T x M residual matrix (NaN where masked)
+    # Outputs
+    #    dictionary of arrays: 'params' (K x M), 'bse' (K x M), 'rsquared' (M),
+    #    'nobs' (M), and 'resid' (T x M) if requested. Symbols with too few
+    #    observations or a singular design get NaN
+    def fitOLS(self, Y, X, mask=None, resid=False):
+        Y = np.asarray(Y, dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if Y.ndim == 1:
+            Y = Y[:, None]
+        #end if
+        if mask is None and np.isnan(Y).any():
+            mask = ~np.isnan(Y)
+        #end if
+
+        if mask is None:
+            result = self._fitDense(Y, X)
+        else:
+            result = self._fitMasked(Y, X, np.asarray(mask, dtype=bool))
+        #end if
+
+        if resid:
+            e = Y - X @ np.nan_to_num(result['params'])
+            if mask is not None:
+                e[~mask] = np.nan
+            #end if
+            e[:, np.isnan(result['params']).any(axis=0)] = np.nan
+            result['resid'] = e
+        #end if
+        return result
+    #end def
+
+    # Every symbol observed on every row: one solve for all columns
+    def _fitDense(self, Y, X):
+        T, K = X.shape
+        M = Y.shape[1]
+        XtX = X.T @ X
+        XtY = X.T @ Y
+        try:
+            XtX_inv = np.linalg.inv(XtX)
+        except np.linalg.LinAlgError:
+            XtX_inv = np.full((K, K), np.nan)
+        #end try
+        params = XtX_inv @ XtY
+
+        # SSR = y'y - b'X'y avoids materializing the residual matrix
+        ssr = np.einsum('tm,tm->m', Y, Y) - np.einsum('km,km->m', params, XtY)
+        ssr = np.maximum(ssr, 0.0)
+        ybar = Y.mean(axis=0)
+        sst = np.einsum('tm,tm->m', Y, Y) - T * ybar ** 2
+        nobs = np.full(M, T, dtype=np.int64)
+        return self._finish(params, np.diag(XtX_inv)[:, None], ssr, sst, nobs, K)
+    #end def
+
+    # Symbols with gaps: each column gets its own X'X built from its mask
+    def _fitMasked(self, Y, X, mask):
+        T, K = X.shape
+        W = mask.astype(np.float64)
+        Y0 = np.where(mask, Y, 0.0)
+
+        XtX = np.einsum('ti,tj,tm->mij', X, X, W)
+        XtY = (X.T @ Y0).T
+        nobs = mask.sum(axis=0)
+
+        params = np.full((Y.shape[1], K), np.nan)
+        XtX_inv = np.full((Y.shape[1], K, K), np.nan)
+        ok = nobs > K
+        if ok.any():
+            # Singular systems are detected per symbol via the determinant so
+            # a single degenerate column does not abort the batch
+            det = np.linalg.det(XtX[ok])
+            idx = np.flatnonzero(ok)[np.abs(det) > 1e-300]
+            XtX_inv[idx] = np.linalg.inv(XtX[idx])
+            params[idx] = np.einsum('mij,mj->mi', XtX_inv[idx], XtY[idx])
+        #end if
+        params = params.T
+
+        yy = np.einsum('tm,tm->m', Y0, Y0)
+        ssr = np.maximum(yy - np.einsum('km,mk->m', params, XtY), 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ybar = Y0.sum(axis=0) / nobs
+        #end with
+        sst = yy - nobs * ybar ** 2
+        diag = np.diagonal(XtX_inv, axis1=1, axis2=2).T
+        return self._finish(params, diag, ssr, sst, nobs, K)
+    #end def
+
+    def _finish(self, params, diag, ssr, sst, nobs, K):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dof = (nobs - K).astype(np.float64)
+            dof[dof <= 0] = np.nan
+            sigma2 = ssr / dof
+            bse = np.sqrt(diag * sigma2)
+            rsquared = 1.0 - ssr / sst
+        #end with
+        rsquared[~np.isfinite(rsquared)] = np.nan
+        return {'params': params, 'bse': bse, 'rsquared': rsquared, 'nobs': nobs}
+    #end def
+
+    # Rolling (or expanding) window regressions for every symbol and date
+    # Inputs
+    #    Y, X         : as for fitOLS
+    #    window       : window length in rows; None for an expanding window
+    #    min_periods  : fewest observations needed for a fit (defaults to the
+    #                   window, or K+1 for an expanding window)
+    #    chunk_size   : dates produced per chunk
+    #    symbol_block : symbols processed together; bounds the temporary
+    #                   per-symbol X'X arrays needed when Y has gaps
+    #    dtype        : dtype of the yielded coefficient arrays
+    # Outputs
+    #    generator of (start, end, params) where params is an
+    #    (end - start) x M x K array of coefficients for rows start..end-1,
+    #    NaN where a window has too few observations
+    #
+    # X'X and X'y over each window come from differences of running sums, so
+    # every step costs O(1) regardless of the window length. Running sums are
+    # restarted every chunk (and carried forward only for expanding windows),
+    # which keeps both memory and floating-point drift bounded.
+    def iterRolling(self, Y, X, window=None, min_periods=None, chunk_size=128,
+                    symbol_block=512, dtype=np.float64):
+        Y = np.asarray(Y, dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if Y.ndim == 1:
+            Y = Y[:, None]
+        #end if
+        T, K = X.shape
+        M = Y.shape[1]
+        if min_periods is None:
+            min_periods = window if window is not None else K + 1
+        #end if
+        min_periods = max(min_periods, K + 1)
+        masked = np.isnan(Y).any()
+        blocks = [(m0, min(m0 + symbol_block, M)) for m0 in range(0, M, symbol_block)]
+        carry = {}
+
+        for a in range(0, T, chunk_size):
+            b = min(a + chunk_size, T)
+            lo = a if window is None else max(0, a - window)
+            t = np.arange(a, b)
+            out = np.full((b - a, M, K), np.nan, dtype=dtype)
+            xx_rows = np.einsum('ti,tj->tij', X[lo:b], X[lo:b])
+
+            for m0, m1 in blocks:
+                Yb = Y[lo:b, m0:m1]
+                if masked:
+                    W = ~np.isnan(Yb)
+                    Yb = np.where(W, Yb, 0.0)
+                    xx = np.einsum('tij,tm->tmij', xx_rows, W)
+                    n = W.astype(np.float64)
+                else:
+                    xx = xx_rows
+                    n = np.ones((b - lo, 1))
+                #end if
+                xy = np.einsum('ti,tm->tmi', X[lo:b], Yb)
+
+                sums = []
+                for k, rows in enumerate([xx, xy, n]):
+                    total, state = self._windowSums(rows, t, lo, window, carry.get((m0, k)))
+                    carry[(m0, k)] = state
+                    sums.append(total)
+                #end for
+                XtX, XtY, nobs = sums
+                params = np.full((b - a, m1 - m0, K), np.nan)
+                if masked:
+                    ok = (nobs >= min_periods) & (np.abs(np.linalg.det(XtX)) > 1e-300)
+                    if ok.any():
+                        params[ok] = np.linalg.solve(XtX[ok], XtY[ok][..., None])[..., 0]
+                    #end if
+                else:
+                    # One inverse per date, shared by every symbol in the block
+                    ok = (nobs[:, 0] >= min_periods) & (np.abs(np.linalg.det(XtX)) > 1e-300)
+                    if ok.any():
+                        params[ok] = np.einsum('nij,nmj->nmi', np.linalg.inv(XtX[ok]), XtY[ok])
+                    #end if
+                #end if
+                out[:, m0:m1] = params
+            #end for
+            yield a, b, out
+        #end for
+    #end def
+
+    # Sums of rows over each window ending at the dates in t
+    # Inputs
+    #    rows   : per-row contributions for rows lo..(t[-1]), along axis 0
+    #    window : window length, or None for expanding sums from row 0
+    #    carry  : expanding only, the total of all rows before lo
+    # Outputs
+    #    (window sums for each t, carry for the next chunk)
+    def _windowSums(self, rows, t, lo, window, carry):
+        prefix = np.concatenate([np.zeros_like(rows[:1]), np.cumsum(rows, axis=0)])
+        end = t + 1 - lo
+        if window is None:
+            if carry is None:
+                carry = np.zeros_like(prefix[0])
+            #end if
+            return carry + prefix[end], carry + prefix[-1]
+        #end if
+        start = np.maximum(t + 1 - window, lo) - lo
+        return prefix[end] - prefix[start], None
+    #end def
+
+    # Collects iterRolling into one date x symbol x coefficient array
+    def fitRolling(self, Y, X, window=None, **kwargs):
+        chunks = [params for a, b, params in self.iterRolling(Y, X, window, **kwargs)]
+        return np.concatenate(chunks, axis=0)
+    #end def
+
+    # Convenience wrapper returning one row per symbol, in the same layout the
+    # statsmodels loop in fama_french.py used to build
+    # Inputs
+    #    returns : DataFrame of returns indexed by date
+    #    X       : DataFrame design matrix (e.g. from sm.add_constant)
+    #    symbols : columns of returns to regress
+    # Outputs
+    #    DataFrame with one column per regressor, plus 'symbol', 'rsquared',
+    #    'nobs' and one 'se_<regressor>' column per standard error
+    def fitParams(self, returns, X, symbols):
+        result = self.fitOLS(returns[symbols].to_numpy(), X.to_numpy())
+        params = pd.DataFrame(result['params'].T, columns=X.columns)
+        params['symbol'] = list(symbols)
+        params['rsquared'] = result['rsquared']
+        params['nobs'] = result['nobs']
+        for i, name in enumerate(X.columns):
+            params['se_'+name] = result['bse'][i]
+        #end for
+        return params
+    #end def
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the batched OLS engine against statsmodels
+"""
+
+import numpy as np
+import statsmodels.api as sm
+from RegressionUtils import RegressionUtils
+
+def make_data(T=250, M=40, seed=0):
+    rng = np.random.default_rng(seed)
+    X = sm.add_constant(rng.normal(0, 0.01, size=(T, 3)))
+    b = rng.normal(0, 1, size=(4, M))
+    Y = X @ b + rng.normal(0, 0.02, size=(T, M))
+    return Y, X
+
+def test_dense_matches_statsmodels():
+    Y, X = make_data()
+    result = RegressionUtils().fitOLS(Y, X, resid=True)
+    for m in range(Y.shape[1]):
+        model = sm.OLS(Y[:, m], X).fit()
+        assert np.allclose(result['params'][:, m], model.params)
+        assert np.allclose(result['bse'][:, m], model.bse)
+        assert np.isclose(result['rsquared'][m], model.rsquared)
+        assert np.allclose(result['resid'][:, m], model.resid)
+
+def test_masked_matches_statsmodels():
+    Y, X = make_data(seed=1)
+    rng = np.random.default_rng(2)
+    Y[rng.random(Y.shape) < 0.1] = np.nan
+    Y[:, 0] = np.nan
+    Y[3:, 1] = np.nan
+    result = RegressionUtils().fitOLS(Y, X)
+    assert np.isnan(result['params'][:, 0]).all()
+    assert np.isnan(result['params'][:, 1]).all()
+    for m in range(2, Y.shape[1]):
+        keep = ~np.isnan(Y[:, m])
+        model = sm.OLS(Y[keep, m], X[keep]).fit()
+        assert result['nobs'][m] == keep.sum()
+        assert np.allclose(result['params'][:, m], model.params)
+        assert np.allclose(result['bse'][:, m], model.bse)
+        assert np.isclose(result['rsquared'][m], model.rsquared)
+
+def check_rolling(Y, X, window, **kwargs):
+    engine = RegressionUtils()
+    rolling = engine.fitRolling(Y, X, window, **kwargs)
+    assert rolling.shape == (Y.shape[0], Y.shape[1], X.shape[1])
+    for t in [0, 5, 59, 60, 61, 127, 128, 130, 199]:
+        lo = 0 if window is None else max(0, t + 1 - window)
+        expected = engine.fitOLS(Y[lo:t+1], X[lo:t+1])['params'].T
+        nobs = (~np.isnan(Y[lo:t+1])).sum(axis=0)
+        needed = window if window is not None else X.shape[1] + 1
+        expected[nobs < needed] = np.nan
+        assert np.allclose(rolling[t], expected, equal_nan=True)
+
+def test_rolling_matches_window_fits():
+    Y, X = make_data(T=200, M=30, seed=3)
+    check_rolling(Y, X, 60, chunk_size=50, symbol_block=7)
+    check_rolling(Y, X, None, chunk_size=50, symbol_block=7)
+
+def test_rolling_with_gaps():
+    Y, X = make_data(T=200, M=30, seed=4)
+    rng = np.random.default_rng(5)
+    Y[rng.random(Y.shape) < 0.05] = np.nan
+    check_rolling(Y, X, 60, chunk_size=64, min_periods=60)
+    check_rolling(Y, X, None, chunk_size=64)
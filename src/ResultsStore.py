@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Run-keyed store of regression results.
+
+Every analysis run gets a row in price_data.runs with its parameters (date
+range, N, objective weights, a fingerprint of the symbol universe and the
+full parameter set as JSON), and its per-symbol results (factor loadings,
+standard errors, fit statistics, objective and any allocation) go to
+price_data.run_results in a single COPY. Past runs stay queryable, e.g. the
+alpha of one symbol across every run (getHistory), which is served by an
+index on (symbol, run_id).
+
+Residuals are optional and kept out of the database: each run's date x
+symbol residual matrix is written as float32 .npy under residual_dir and
+memory mapped on load, so reading a few symbols touches only their rows.
+"""
+
+import hashlib
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+
+DEFAULT_RESIDUAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'results', 'residuals')
+
+# Per-symbol columns of price_data.run_results, all double precision.
+# Columns a run does not have are stored as NULL
+RESULT_COLUMNS = ['alpha', 'beta_market', 'beta_smb', 'beta_hml',
+                  'se_alpha', 'se_beta_market', 'se_beta_smb', 'se_beta_hml',
+                  'rsquared', 'nobs', 'std_from_mean', 'objective',
+                  'shares', 'current_price']
+
+# Allocation columns (SelectionUtils.allocate) and where they are stored
+ALLOCATION_COLUMNS = {'Number of Shares': 'shares', 'Current Price': 'current_price'}
+
+class ResultsStore:
+
+    # Inputs
+    #    schema       : SchemaUtils whose connection pool is used; created on
+    #                   first use if None
+    #    residual_dir : directory of the residual matrices
+    def __init__(self, schema=None, residual_dir=DEFAULT_RESIDUAL_DIR):
+        self.schema = schema
+        self.residual_dir = residual_dir
+        self.created = False
+    #end def
+
+    def getSchema(self):
+        if self.schema is None:
+            from SchemaUtils import SchemaUtils
+            self.schema = SchemaUtils()
+        #end if
+        return self.schema
+    #end def
+
+    def writeCreateTableStatement(self):
+        columns = ', '.join(column+' double precision' for column in RESULT_COLUMNS)
+        return ('CREATE TABLE IF NOT EXISTS price_data.runs ('
+                'run_id BIGSERIAL PRIMARY KEY, created_at TIMESTAMPTZ NOT NULL DEFAULT now(), '
+                'start_date VARCHAR(10), end_date VARCHAR(10), n INTEGER, '
+                'w_fit double precision, w_alpha double precision, '
+                'universe VARCHAR(40), universe_size INTEGER, params JSONB);'
+                'CREATE TABLE IF NOT EXISTS price_data.run_results ('
+                'run_id BIGINT NOT NULL REFERENCES price_data.runs ON DELETE CASCADE, '
+                'symbol VARCHAR(32) NOT NULL, '+columns+', PRIMARY KEY (run_id, symbol));'
+                'CREATE INDEX IF NOT EXISTS run_results_symbol_idx ON price_data.run_results (symbol, run_id);')
+    #end def
+
+    def createTables(self):
+        if not self.created:
+            with self.getSchema().connection() as conn, conn.cursor() as cursor:
+                cursor.execute(self.writeCreateTableStatement())
+            #end with
+            self.created = True
+        #end if
+    #end def
+
+    # Row of price_data.runs for a run
+    # Inputs
+    #    params  : the run's parameters (FamaFrenchPipeline.getParams())
+    #    symbols : the universe the run regressed
+    def describeRun(self, params, symbols):
+        universe = sorted(str(s) for s in symbols)
+        return {'start_date': params.get('start'),
+                'end_date': params.get('end'),
+                'n': params.get('N'),
+                'w_fit': params.get('w_fit'),
+                'w_alpha': params.get('w_alpha'),
+                'universe': hashlib.sha1('\n'.join(universe).encode('utf-8')).hexdigest(),
+                'universe_size': len(universe),
+                'params': json.dumps(params, sort_keys=True, default=str)}
+    #end def
+
+    # CSV for COPY into price_data.run_results: one row per symbol, columns
+    # run_id, symbol, RESULT_COLUMNS, empty fields for NULL
+    # Inputs
+    #    results    : DataFrame with a 'symbol' column and any of
+    #                 RESULT_COLUMNS
+    #    allocation : optional SelectionUtils.allocate output indexed by
+    #                 symbol
+    def renderResults(self, run_id, results, allocation=None):
+        table = results.set_index('symbol')
+        table = table[~table.index.duplicated()]
+        if allocation is not None:
+            table = table.join(allocation[list(ALLOCATION_COLUMNS)].rename(columns=ALLOCATION_COLUMNS),
+                               how='left')
+        #end if
+        table = table.reindex(columns=RESULT_COLUMNS).astype(np.float64)
+        table.insert(0, 'symbol', table.index)
+        table.insert(0, 'run_id', run_id)
+        return table.to_csv(header=False, index=False, na_rep='', float_format='%.17g')
+    #end def
+
+    # Writes one run
+    # Inputs
+    #    results    : per-symbol results (e.g. the 'objective' stage output)
+    #    params     : the run's parameters
+    #    allocation : optional allocation of the shortlist
+    #    residuals  : optional date x symbol DataFrame of residuals
+    # Outputs
+    #    the new run_id
+    def saveRun(self, results, params, allocation=None, residuals=None):
+        self.createTables()
+        run = self.describeRun(params, results['symbol'])
+        names = list(run)
+        with self.getSchema().connection() as conn, conn.cursor() as cursor:
+            cursor.execute('INSERT INTO price_data.runs ('+','.join(names)+') VALUES ('+
+                           ','.join(['%s'] * len(names))+') RETURNING run_id', [run[n] for n in names])
+            run_id = cursor.fetchone()[0]
+            cursor.copy_expert('COPY price_data.run_results (run_id, symbol, '+', '.join(RESULT_COLUMNS)+
+                               ') FROM STDIN WITH (FORMAT csv)',
+                               io.StringIO(self.renderResults(run_id, results, allocation)))
+        #end with
+        if residuals is not None:
+            self.storeResiduals(run_id, residuals)
+        #end if
+        return run_id
+    #end def
+
+    def _query(self, statement, args=()):
+        with self.getSchema().connection() as conn, conn.cursor() as cursor:
+            cursor.execute(statement, args)
+            rows = cursor.fetchall()
+            names = [d[0] for d in cursor.description]
+        #end with
+        return pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+    #end def
+
+    # Every run, newest first, without the full parameter JSON
+    def getRuns(self, limit=None):
+        statement = ('SELECT run_id, created_at, start_date, end_date, n, w_fit, w_alpha, universe, universe_size '
+                     'FROM price_data.runs ORDER BY run_id DESC')
+        args = []
+        if limit is not None:
+            statement += ' LIMIT %s'
+            args.append(int(limit))
+        #end if
+        return self._query(statement, args).set_index('run_id')
+    #end def
+
+    def getParams(self, run_id):
+        params = self._query('SELECT params FROM price_data.runs WHERE run_id = %s', [run_id])['params']
+        if len(params) == 0:
+            raise KeyError('No run '+str(run_id))
+        #end if
+        value = params.iloc[0]
+        return json.loads(value) if isinstance(value, str) else value
+    #end def
+
+    # Per-symbol results of one run, indexed by symbol
+    def getRun(self, run_id, columns=None):
+        columns = self._checkColumns(columns)
+        return self._query('SELECT symbol, '+', '.join(columns)+' FROM price_data.run_results '
+                           'WHERE run_id = %s ORDER BY symbol', [run_id]).set_index('symbol')
+    #end def
+
+    # One symbol's results across runs
+    # Outputs
+    #    DataFrame indexed by run_id with created_at, end_date and columns
+    #    (default: alpha), oldest run first
+    def getHistory(self, symbol, columns=('alpha',)):
+        columns = self._checkColumns(columns)
+        return self._query('SELECT r.run_id, r.created_at, r.end_date, '+
+                           ', '.join('x.'+c for c in columns)+' FROM price_data.run_results x '
+                           'JOIN price_data.runs r ON r.run_id = x.run_id '
+                           'WHERE x.symbol = %s ORDER BY r.run_id', [symbol]).set_index('run_id')
+    #end def
+
+    def _checkColumns(self, columns):
+        if columns is None:
+            return list(RESULT_COLUMNS)
+        #end if
+        unknown = [c for c in columns if c not in RESULT_COLUMNS]
+        if len(unknown) > 0:
+            raise ValueError('Unknown result columns: '+', '.join(unknown))
+        #end if
+        return list(columns)
+    #end def
+
+    # Removes a run and its residuals
+    def deleteRun(self, run_id):
+        with self.getSchema().connection() as conn, conn.cursor() as cursor:
+            cursor.execute('DELETE FROM price_data.runs WHERE run_id = %s', [run_id])
+        #end with
+        entry = self._entry(run_id)
+        for name in ('values.npy', 'meta.json'):
+            if os.path.exists(os.path.join(entry, name)):
+                os.remove(os.path.join(entry, name))
+            #end if
+        #end for
+    #end def
+
+    ########################### Residuals ###################################
+
+    def _entry(self, run_id):
+        return os.path.join(self.residual_dir, str(run_id))
+    #end def
+
+    # Writes a date x symbol residual matrix as symbol-major float32. As in
+    # PriceCache, meta.json is written last so a partial entry is never read
+    def storeResiduals(self, run_id, residuals):
+        entry = self._entry(run_id)
+        os.makedirs(entry, exist_ok=True)
+        values = np.ascontiguousarray(residuals.to_numpy(dtype=np.float32).T)
+        np.save(os.path.join(entry, 'values.npy'), values)
+        meta = {'columns': [str(c) for c in residuals.columns],
+                'index': [str(i) for i in residuals.index],
+                'index_name': residuals.index.name}
+        with open(os.path.join(entry, 'meta.tmp'), 'w') as f:
+            json.dump(meta, f)
+        #end with
+        os.replace(os.path.join(entry, 'meta.tmp'), os.path.join(entry, 'meta.json'))
+    #end def
+
+    # Residuals of a run (only of symbols, if given), or None if the run
+    # stored none
+    def loadResiduals(self, run_id, symbols=None):
+        entry = self._entry(run_id)
+        if not os.path.exists(os.path.join(entry, 'meta.json')):
+            return None
+        #end if
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+        #end with
+        values = np.load(os.path.join(entry, 'values.npy'), mmap_mode='r')
+        columns = meta['columns']
+        if symbols is not None:
+            position = {c: i for i, c in enumerate(columns)}
+            rows = [position[s] for s in symbols if s in position]
+            columns = [columns[i] for i in rows]
+            values = values[rows]
+        #end if
+        return pd.DataFrame(np.asarray(values).T, index=pd.Index(meta['index'], name=meta['index_name']),
+                            columns=columns)
+    #end def
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the run results rendering and the residual store. No database
+connection is needed.
+"""
+
+import csv
+import io
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from ResultsStore import ResultsStore, RESULT_COLUMNS
+
+def test_results_render_as_one_copy_stream():
+    store = ResultsStore(schema=None)
+    results = pd.DataFrame({'symbol': ['aapl', 'xom'], 'alpha': [0.001, -0.0005],
+                            'beta_market': [1.1, 0.8], 'rsquared': [0.4, 0.3], 'nobs': [250.0, 248.0],
+                            'unrelated': ['a', 'b']})
+    allocation = pd.DataFrame({'Number of Shares': [7.0], 'Current Price': [150.25], 'Subtotal': [1051.75]},
+                              index=pd.Index(['aapl'], name='symbol'))
+    rows = list(csv.reader(io.StringIO(store.renderResults(42, results, allocation))))
+    assert len(rows) == 2 and len(rows[0]) == 2 + len(RESULT_COLUMNS)
+    record = dict(zip(['run_id', 'symbol'] + RESULT_COLUMNS, rows[0]))
+    assert record['run_id'] == '42' and record['symbol'] == 'aapl'
+    assert float(record['alpha']) == 0.001 and float(record['current_price']) == 150.25
+    assert record['se_alpha'] == '' and rows[1][RESULT_COLUMNS.index('shares') + 2] == ''
+
+    run = store.describeRun({'start': '2021-01-07', 'end': '2022-01-07', 'N': 10, 'w_fit': 0.0008,
+                             'w_alpha': 0.9992, 'not_in': ['market']}, ['xom', 'aapl'])
+    assert run['universe'] == store.describeRun({}, ['aapl', 'xom'])['universe']
+    assert run['universe_size'] == 2 and json.loads(run['params'])['N'] == 10
+    with pytest.raises(ValueError):
+        store.getRun(1, columns=['alpha; DROP TABLE runs'])
+
+def test_residual_store_round_trip(tmp_path):
+    store = ResultsStore(schema=None, residual_dir=str(tmp_path))
+    dates = pd.Index(['2021-10-18', '2021-10-19', '2021-10-20'], name='date')
+    resid = pd.DataFrame({'aapl': [0.01, np.nan, -0.02], 'xom': [0.0, 0.005, 0.001]}, index=dates)
+    store.storeResiduals(7, resid)
+    assert store.loadResiduals(8) is None
+    pd.testing.assert_frame_equal(store.loadResiduals(7), resid.astype(np.float32))
+    sub = store.loadResiduals(7, symbols=['xom', 'missing'])
+    assert list(sub.columns) == ['xom']
@@ -5,15 +5,102 @@ Spyder Editor
 This is a temporary script file.
 """
 
-import psycopg2, pandas as pd, numpy as np, os
+import psycopg2, pandas as pd, numpy as np, os, io, re, uuid
 from psycopg2 import extras
 from psycopg2.extensions import register_adapter, AsIs
-import pandas.io.sql as sqlio
+from LongPriceStore import LongPriceStore
+from ConnectionPool import getPool, readDatabaseConfig, DEFAULT_CONFIG
+from Metrics import instrumentQuery
+
+# Rows rendered per CSV chunk when bulk loading with COPY
+COPY_CHUNK_ROWS = 50
+# Bytes psycopg2 asks for per read from the COPY stream
+COPY_READ_BYTES = 1 << 20
+# Rows fetched per round trip from a server-side cursor when reading
+SELECT_CHUNK_ROWS = 20000
+
+# Column names that can be spliced into SQL unquoted (symbols, dates, and the
+# fundamentals fields all fit); anything else is rejected
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def checkIdentifier(name):
+    if not IDENTIFIER.match(str(name)):
+        raise ValueError('Not a valid column name: '+repr(name))
+    return name
+
+# Binary COPY framing: signature, flags and header extension length, and the
+# -1 field count that ends the stream
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00'
+COPY_BINARY_TRAILER = b'\xff\xff'
+
+# File-like object over an iterator of COPY data chunks (str for CSV, bytes
+# for binary). Handed to cursor.copy_expert, which pulls from read(); the
+# next chunk is only rendered once the previous one has been consumed.
+class CopyChunkReader:
+
+    def __init__(self,chunks):
+        self.chunks = iter(chunks)
+        self.buffer = io.StringIO()
+        self.empty = ''
+
+    def read(self,size=-1):
+        parts = []
+        remaining = size
+        while True:
+            part = self.buffer.read(remaining)
+            if part:
+                parts.append(part)
+                remaining = remaining-len(part) if size >= 0 else size
+                if remaining == 0:
+                    break
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.empty = chunk[:0]
+            self.buffer = io.BytesIO(chunk) if isinstance(chunk, bytes) else io.StringIO(chunk)
+        return self.empty.join(parts)
+
+    def readline(self,size=-1):
+        return self.read(size)
 
 class SchemaUtils:
     
-    def __init__(self):
+    # Inputs
+    #    storage         : 'wide' keeps one table per sector with a column per
+    #                      symbol. 'long' stores prices as (symbol, date, close)
+    #                      rows in price_data.prices (see LongPriceStore); the
+    #                      methods below take and return the same wide frames
+    #                      either way
+    #    partition_years : years to range-partition the long table by
+    #    config_path     : database.ini with the [postgresql] connection
+    #                      settings, optional [pool] minconn/maxconn and
+    #                      [storage] layout (used when storage is not given)
+    def __init__(self, storage=None, partition_years=None, config_path=DEFAULT_CONFIG):
         self.data = []
+        self.config_path = config_path
+        if storage is None:
+            try:
+                storage = readDatabaseConfig(config_path)['storage']['layout']
+            except FileNotFoundError:
+                storage = 'wide'
+        self.storage = storage
+        self.long_store = LongPriceStore(self, partition_years) if storage == 'long' else None
+
+    # Borrow a pooled connection for a with-block; commits on success and
+    # rolls back on error. The pool is shared by every SchemaUtils in the
+    # process and is safe to use from several threads at once.
+    def connection(self):
+        return getPool(self.config_path).connection()
+
+    # Checkout counts, peak concurrent use and time spent waiting for a free
+    # connection, for sizing [pool] maxconn
+    def getPoolStats(self):
+        return getPool(self.config_path).getStats()
+
+    # Fundamentals always stay in their own table; only price tables move to
+    # the long layout
+    def usesLongStore(self,table_name):
+        return self.long_store is not None and table_name != 'fundamentals'
     
     def writeCreateTableStatement(self,columns,table_name,index):
         create_statement = 'DROP TABLE IF EXISTS price_data.'+table_name+';CREATE TABLE IF NOT EXISTS price_data.'+table_name+' ( '+index+' VARCHAR(255)'
@@ -24,42 +111,372 @@ class SchemaUtils:
         return create_statement
 
     def executeCreateTableStatement(self,columns,table_name,index):
-        conn = psycopg2.connect(dbname='postgres', user='postgres', password='g6a!pSMMPOST')
-        cursor = conn.cursor()
+        if self.usesLongStore(table_name):
+            return self.long_store.executeCreateTableStatement(columns,table_name,index)
         create_statement = self.writeCreateTableStatement(columns,table_name,index)
         print(create_statement)
-        cursor.execute(create_statement)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(create_statement)
 
     def writeInsertStatement(self,df,table_name,index):
         cols = index+','+','.join(list(df.columns))
         insert_statement = "INSERT INTO %s(%s) VALUES %%s" % ('price_data.'+table_name,cols)
         return insert_statement
     
-    def executeInsertStatement(self,df,table_name,index):
+    # Inputs
+    #    method     : 'copy' streams the frame with COPY FROM STDIN; 'values'
+    #                 is the older execute_values path
+    #    chunk_size : rows rendered to CSV at a time by the copy path
+    @instrumentQuery('insert')
+    def executeInsertStatement(self,df,table_name,index,method='copy',chunk_size=COPY_CHUNK_ROWS):
+        if self.usesLongStore(table_name):
+            return self.long_store.executeInsertStatement(df,table_name,index,method,chunk_size)
+        if method == 'copy':
+            return self.executeCopyStatement(df,table_name,index,chunk_size)
         register_adapter(np.int64, AsIs)
-        conn = psycopg2.connect(dbname='postgres', user='postgres', password='g6a!pSMMPOST')
-        cursor = conn.cursor()
         df_values = df.values.tolist()
         for i in range(len(df_values)):
             df_values[i].insert(0,df.index.values[i])
         insert_statement = self.writeInsertStatement(df,table_name,index)
-        extras.execute_values(cursor,insert_statement,df_values)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with self.connection() as conn, conn.cursor() as cursor:
+            extras.execute_values(cursor,insert_statement,df_values)
+
+    # Renders df (index first) as CSV, chunk_size rows at a time
+    def iterCsvChunks(self,df,chunk_size=COPY_CHUNK_ROWS,na_rep='NaN'):
+        for start in range(0,len(df),chunk_size):
+            yield df.iloc[start:start+chunk_size].to_csv(header=False,na_rep=na_rep)
+
+    # The binary format needs every column numeric and every index value the
+    # same byte length (true for 'YYYY-MM-DD' dates), so rows have a fixed size
+    def canCopyBinary(self,df):
+        if len(df) == 0 or not all(np.issubdtype(dtype, np.number) for dtype in df.dtypes):
+            return False
+        lengths = pd.Index(df.index).astype(str).str.encode('utf-8').str.len()
+        return lengths.min() == lengths.max()
+
+    # Renders df (index as text, columns as float8) in COPY binary format,
+    # chunk_size rows at a time. Each chunk is filled through numpy views of
+    # one preallocated byte matrix, so no per-value Python work is done.
+    def iterBinaryChunks(self,df,chunk_size=COPY_CHUNK_ROWS):
+        index_bytes = np.array(pd.Index(df.index).astype(str).str.encode('utf-8').tolist())
+        width = index_bytes.dtype.itemsize
+        M = df.shape[1]
+        row_bytes = 2 + 4 + width + 12 * M
+        yield COPY_BINARY_HEADER
+        for start in range(0,len(df),chunk_size):
+            values = np.ascontiguousarray(df.iloc[start:start+chunk_size].to_numpy(dtype='>f8'))
+            rows = values.shape[0]
+            buf = np.empty((rows,row_bytes),dtype=np.uint8)
+            buf[:,0:2] = np.frombuffer(np.array(M+1,dtype='>i2').tobytes(),dtype=np.uint8)
+            buf[:,2:6] = np.frombuffer(np.array(width,dtype='>i4').tobytes(),dtype=np.uint8)
+            buf[:,6:6+width] = index_bytes[start:start+rows].view(np.uint8).reshape(rows,width)
+            fields = buf[:,6+width:].reshape(rows,M,12)
+            fields[:,:,0:4] = np.frombuffer(np.array(8,dtype='>i4').tobytes(),dtype=np.uint8)
+            fields[:,:,4:12] = values.view(np.uint8).reshape(rows,M,8)
+            yield buf.tobytes()
+        yield COPY_BINARY_TRAILER
+
+    def writeCopyStatement(self,df,table_name,index,binary=False):
+        cols = index+','+','.join(list(df.columns))
+        copy_format = 'binary' if binary else 'csv'
+        return 'COPY price_data.%s(%s) FROM STDIN WITH (FORMAT %s)' % (table_name,cols,copy_format)
+
+    # Bulk load through COPY. The frame is rendered chunk_size rows at a time
+    # as Postgres reads from the stream (binary format when possible, CSV
+    # otherwise), so no Python row lists are built and memory stays at one
+    # chunk. Everything happens in a single transaction: either all rows
+    # land or none do. Missing prices are
+    # written as 'NaN', the same as the execute_values path.
+    def executeCopyStatement(self,df,table_name,index,chunk_size=COPY_CHUNK_ROWS):
+        binary = self.canCopyBinary(df)
+        chunks = self.iterBinaryChunks(df,chunk_size) if binary else self.iterCsvChunks(df,chunk_size)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.copy_expert(self.writeCopyStatement(df,table_name,index,binary),
+                               CopyChunkReader(chunks),size=COPY_READ_BYTES)
     
-    def executeSelectStatement(self,table_name,index):
-        conn = psycopg2.connect(dbname='postgres', user='postgres', password='g6a!pSMMPOST')        
-        select_statement = 'SELECT * FROM price_data.'+table_name
-        df = sqlio.read_sql_query(select_statement, conn)
+    # Parameterized SELECT for executeSelectStatement/iterSelectStatement
+    # Inputs
+    #    columns    : columns to return besides the index, or None for all
+    #    start_date : first index value to return (inclusive), or None
+    #    end_date   : last index value to return (inclusive), or None
+    #    last       : only the last n index values (after the date bounds)
+    #    keys       : only rows whose key_column is one of keys
+    # Outputs
+    #    (statement, args) for cursor.execute
+    def writeSelectStatement(self,table_name,index=None,columns=None,start_date=None,end_date=None,
+                             last=None,keys=None,key_column=None):
+        if columns is None:
+            projection = '*'
+        else:
+            projection = ','.join(checkIdentifier(c) for c in ([index] if index is not None else []) + list(columns))
+        conditions = []
+        args = []
+        if start_date is not None:
+            conditions.append(checkIdentifier(index)+' >= %s')
+            args.append(start_date)
+        if end_date is not None:
+            conditions.append(checkIdentifier(index)+' <= %s')
+            args.append(end_date)
+        if keys is not None:
+            conditions.append(checkIdentifier(key_column)+' = ANY(%s)')
+            args.append(list(keys))
+        select_statement = 'SELECT '+projection+' FROM price_data.'+checkIdentifier(table_name)
+        if len(conditions) > 0:
+            select_statement += ' WHERE '+' AND '.join(conditions)
+        if last is not None:
+            # Newest rows first to apply the limit, then back in date order
+            select_statement = ('SELECT * FROM ('+select_statement+' ORDER BY '+index+' DESC LIMIT %s) t '
+                                'ORDER BY '+index)
+            args.append(int(last))
+        elif index is not None:
+            select_statement += ' ORDER BY '+index
+        return select_statement, args
+
+    # Resolves a symbol filter for a wide table: the symbols that are
+    # columns of table_name, matched case-insensitively as Postgres folds
+    # unquoted names to lower case. The fundamentals table keeps symbols in
+    # rows instead, so there the filter stays a row filter
+    def resolveColumns(self,table_name,index,columns,symbols):
+        if symbols is None or table_name == 'fundamentals':
+            return columns
+        stored = set(self.getTableColumns(table_name)) - set([index])
+        wanted = [str(s).lower() for s in symbols]
+        return list(columns or []) + [s for s in dict.fromkeys(wanted) if s in stored]
+
+    # Reads a table with the filtering done by the database. With no filters
+    # this is the whole table, as before.
+    # Inputs
+    #    columns    : columns to read besides the index, or None for all
+    #    symbols    : symbols to read: columns of a wide price table, rows of
+    #                 the fundamentals table and of the long store. Symbols
+    #                 the table does not have are skipped
+    #    start_date : first date to read (inclusive), or None
+    #    end_date   : last date to read (inclusive), or None
+    #    last       : only the last n dates
+    #    chunk_size : rows per round trip of the server-side cursor
+    @instrumentQuery('select')
+    def executeSelectStatement(self,table_name,index,columns=None,symbols=None,start_date=None,end_date=None,
+                               last=None,chunk_size=SELECT_CHUNK_ROWS):
+        if self.usesLongStore(table_name):
+            return self.long_store.executeSelectStatement(table_name,index,symbols=symbols,start_date=start_date,
+                                                          end_date=end_date,last=last,chunk_size=chunk_size)
+        chunks = list(self.iterSelectStatement(table_name,index,columns,symbols,start_date,end_date,last,chunk_size))
+        if len(chunks) == 0:
+            return pd.DataFrame(index=pd.Index([], name=index)) if index is not None else pd.DataFrame()
+        df = chunks[0] if len(chunks) == 1 else pd.concat(chunks)
         if index is not None:
             df.set_index(index,drop=True,inplace=True)
-        conn.close()
         return df
+
+    # Streams the rows of executeSelectStatement as DataFrames of at most
+    # chunk_size rows, through a named (server-side) cursor: the first chunk
+    # arrives as soon as the database has it, and client memory holds one
+    # chunk at a time. The index is left as a column. Wide tables only
+    def iterSelectStatement(self,table_name,index,columns=None,symbols=None,start_date=None,end_date=None,
+                            last=None,chunk_size=SELECT_CHUNK_ROWS):
+        columns = self.resolveColumns(table_name,index,columns,symbols)
+        keys = None
+        if symbols is not None and table_name == 'fundamentals':
+            keys = list(symbols)
+        if columns is not None and len(columns) == 0:
+            return
+        select_statement, args = self.writeSelectStatement(table_name,index,columns,start_date,end_date,
+                                                           last,keys,'symbol')
+        with self.connection() as conn:
+            cursor = conn.cursor(name='select_'+uuid.uuid4().hex)
+            cursor.itersize = chunk_size
+            try:
+                cursor.execute(select_statement, args)
+                names = None
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if names is None:
+                        names = [d[0] for d in cursor.description]
+                    if len(rows) == 0:
+                        break
+                    yield pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+            finally:
+                cursor.close()
+
+    # Latest price of each of symbols, looked up in every sector table but
+    # reading only the matching columns of the last few dates
+    # Inputs
+    #    symbols  : symbols to look up, as the price tables name them
+    #    lookback : dates read per table; a symbol's latest price is its last
+    #               non-missing value among them
+    # Outputs
+    #    Series of prices indexed by symbol; symbols not found are left out
+    def getLastPrices(self,symbols,table_list=None,lookback=5,index='date'):
+        if table_list is None:
+            table_list = self.getSectorList()
+        prices = []
+        for table_name in table_list:
+            df = self.executeSelectStatement(table_name,index,symbols=symbols,last=lookback)
+            if df.shape[1] > 0:
+                prices.append(df.astype(float).ffill().iloc[-1].dropna())
+        if len(prices) == 0:
+            return pd.Series(dtype=float)
+        prices = pd.concat(prices)
+        return prices[~prices.index.duplicated()]
     
+    # Cheap fingerprint of a table's contents: (latest index value, row
+    # count, column count). Changes whenever the updater adds dates, rows or
+    # symbols, so it can key caches of data read from the table
+    def getTableVersion(self,table_name,index):
+        if self.usesLongStore(table_name):
+            return self.long_store.getTableVersion(table_name,index)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM information_schema.columns "
+                           "WHERE table_schema = 'price_data' AND table_name = %s", (table_name.lower(),))
+            ncols = cursor.fetchone()[0]
+            if ncols == 0:
+                return (None, 0, 0)
+            cursor.execute('SELECT max('+index+'), count(*) FROM price_data.'+table_name)
+            latest, nrows = cursor.fetchone()
+        return (latest, nrows, ncols)
+
+    # Returns the column names of price_data.<table_name>, or an empty list if
+    # the table does not exist yet. Tables are created with unquoted names,
+    # which Postgres folds to lower case, so sectors such as 'Capital_Goods'
+    # are looked up in lower case
+    def getTableColumns(self,table_name):
+        if self.usesLongStore(table_name):
+            return self.long_store.getTableColumns(table_name)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT column_name FROM information_schema.columns "
+                           "WHERE table_schema = 'price_data' AND table_name = %s "
+                           "ORDER BY ordinal_position", (table_name.lower(),))
+            columns = [row[0] for row in cursor.fetchall()]
+        return columns
+
+    # Returns {column: last index value where column has data} for each of
+    # columns, computed in a single scan of the table. Columns with no data
+    # map to None. executeInsertStatement stores missing prices as 'NaN', so
+    # those are skipped as well as NULLs
+    @instrumentQuery('latest_dates')
+    def getLatestDates(self,table_name,index,columns):
+        if self.usesLongStore(table_name):
+            return self.long_store.getLatestDates(table_name,index,columns)
+        if len(columns) == 0:
+            return {}
+        aggregates = ','.join('max('+index+') FILTER (WHERE '+column+" <> 'NaN')" for column in columns)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute('SELECT '+aggregates+' FROM price_data.'+table_name)
+            row = cursor.fetchone()
+        return dict(zip(columns, row))
+
+    # Adds and drops symbol columns in place instead of rebuilding the table
+    def writeAlterTableStatement(self,table_name,add_columns,drop_columns):
+        actions = ['ADD COLUMN IF NOT EXISTS '+column+' double precision' for column in add_columns]
+        actions += ['DROP COLUMN IF EXISTS '+column for column in drop_columns]
+        if len(actions) == 0:
+            return None
+        return 'ALTER TABLE price_data.'+table_name+' '+', '.join(actions)+';'
+
+    def executeAlterTableStatement(self,table_name,add_columns,drop_columns):
+        if self.usesLongStore(table_name):
+            return self.long_store.executeAlterTableStatement(table_name,add_columns,drop_columns)
+        alter_statement = self.writeAlterTableStatement(table_name,add_columns,drop_columns)
+        if alter_statement is None:
+            return
+        print(alter_statement)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(alter_statement)
+
+    # Insert-or-update keyed on the index column. Existing values are kept
+    # where the incoming frame has no data, so symbols fetched over different
+    # date ranges can be written together
+    def writeUpsertStatement(self,df,table_name,index):
+        table = 'price_data.'+table_name
+        updates = ','.join(column+'=COALESCE(EXCLUDED.'+column+','+table+'.'+column+')' for column in df.columns)
+        insert_statement = self.writeInsertStatement(df,table_name,index)
+        return insert_statement+' ON CONFLICT ('+index+') DO UPDATE SET '+updates
+
+    @instrumentQuery('upsert')
+    def executeUpsertStatement(self,df,table_name,index):
+        if self.usesLongStore(table_name):
+            return self.long_store.executeUpsertStatement(df,table_name,index)
+        register_adapter(np.int64, AsIs)
+        df_values = df.astype(object).where(df.notna(), None).values.tolist()
+        for i in range(len(df_values)):
+            df_values[i].insert(0,df.index.values[i])
+        with self.connection() as conn, conn.cursor() as cursor:
+            # ON CONFLICT needs a unique index; older tables were created without one
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS '+table_name+'_'+index+'_key '
+                           'ON price_data.'+table_name+' ('+index+')')
+            extras.execute_values(cursor,self.writeUpsertStatement(df,table_name,index),df_values)
+
+    # Staged writes, for filling a table a few symbols at a time. Upserting
+    # each batch rewrites every date row of the table, leaving a dead row
+    # version per date and batch. Instead each batch is appended through COPY
+    # to price_data.<table>_stage as (symbol, index, close) rows, and
+    # executeMergeStageStatement folds the whole stage into the table with a
+    # single upsert. The stage is an ordinary table, so rows staged before an
+    # interruption are still merged by the run that resumes the job.
+    def writeCreateStageStatement(self,table_name,index):
+        return ('CREATE TABLE IF NOT EXISTS price_data.'+table_name+'_stage '
+                '(symbol VARCHAR(32), '+index+' VARCHAR(255), close double precision);')
+
+    # Renders df as (symbol, index, close) CSV rows, chunk_size wide rows at
+    # a time. Missing prices are left out; symbols are folded to lower case
+    # like the column names they become
+    def iterStageChunks(self,df,chunk_size=COPY_CHUNK_ROWS):
+        symbols = np.array([str(column).lower() for column in df.columns], dtype=object)
+        for start in range(0,len(df),chunk_size):
+            block = df.iloc[start:start+chunk_size]
+            values = block.to_numpy(dtype=np.float64)
+            rows, cols = np.nonzero(~np.isnan(values))
+            yield pd.DataFrame({'symbol': symbols[cols], 'index': np.asarray(block.index, dtype=object)[rows],
+                                'close': values[rows, cols]}).to_csv(index=False,header=False)
+
+    @instrumentQuery('stage')
+    def executeStageStatement(self,df,table_name,index,chunk_size=COPY_CHUNK_ROWS):
+        if self.usesLongStore(table_name):
+            # The long table is already written through a COPY stage
+            return self.long_store.executeUpsertStatement(df,table_name,index)
+        copy_statement = ('COPY price_data.'+table_name+'_stage (symbol,'+index+',close) '
+                          'FROM STDIN WITH (FORMAT csv)')
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(self.writeCreateStageStatement(table_name,index))
+            cursor.copy_expert(copy_statement,CopyChunkReader(self.iterStageChunks(df,chunk_size)),
+                               size=COPY_READ_BYTES)
+
+    # One upsert of the stage into the table: the stage rows are pivoted
+    # back to a column per symbol, and existing values are kept where the
+    # stage has none, as in writeUpsertStatement
+    def writeMergeStageStatement(self,symbols,table_name,index):
+        table = 'price_data.'+table_name
+        columns = [checkIdentifier(symbol) for symbol in symbols]
+        pivots = ','.join("max(close) FILTER (WHERE symbol = '"+column+"')" for column in columns)
+        updates = ','.join(column+'=COALESCE(EXCLUDED.'+column+','+table+'.'+column+')' for column in columns)
+        return ('INSERT INTO '+table+'('+index+','+','.join(columns)+') '
+                'SELECT '+index+','+pivots+' FROM '+table+'_stage GROUP BY '+index+' '
+                'ON CONFLICT ('+index+') DO UPDATE SET '+updates)
+
+    # Merges and drops the stage in one transaction, so an interrupted merge
+    # leaves the stage for the next attempt
+    @instrumentQuery('merge')
+    def executeMergeStageStatement(self,table_name,index):
+        if self.usesLongStore(table_name):
+            return
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(self.writeCreateStageStatement(table_name,index))
+            cursor.execute('SELECT DISTINCT symbol FROM price_data.'+table_name+'_stage ORDER BY symbol')
+            symbols = [row[0] for row in cursor.fetchall()]
+            if len(symbols) > 0:
+                # ON CONFLICT needs a unique index; older tables were created without one
+                cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS '+table_name+'_'+index+'_key '
+                               'ON price_data.'+table_name+' ('+index+')')
+                cursor.execute(self.writeMergeStageStatement(symbols,table_name,index))
+            cursor.execute('DROP TABLE price_data.'+table_name+'_stage')
+
+    # Discards rows staged by an earlier, abandoned job
+    def executeDropStageStatement(self,table_name):
+        if self.usesLongStore(table_name):
+            return
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS price_data.'+table_name+'_stage')
+
     def removeKeywordsFromSymbols(self,symbols):
         keywords = ['ALL', 'ASC', 'ELSE', 'FOR', 'ON']
         for keyword in keywords:
@@ -81,31 +498,32 @@ class SchemaUtils:
         sector_list = tickers.Sector.unique().tolist()
         sector_list.pop(sector_list.index(np.nan))
         return sector_list
-    def getConnection(dbname,user,password):
-        conn = psycopg2.connect(dbname='postgres', user='postgres', password='g6a!pSMMPOST')
+    # Unpooled connection using the database.ini settings, for callers that
+    # manage the connection's lifetime themselves
+    def getConnection(self):
+        conn = psycopg2.connect(**readDatabaseConfig(self.config_path)['postgresql'])
         return conn
-    def getCursor(conn):
+    def getCursor(self,conn):
         cur = conn.cursor()
         return cur    
     def main(self):
         print("Hello World!")
 
-    if __name__ == "__main__":
-        from SchemaUtils import SchemaUtils
-        schema = SchemaUtils()
-        #schema.main()
-        conn = psycopg2.connect(dbname='postgres', user='postgres', password='g6a!pSMMPOST')
-        tickers = getTickers(schema)
-        sector_list = tickers.Sector.unique().tolist()
-        sector_list.pop(sector_list.index(np.nan))
-        cur = getCursor(conn)
-        for sector in sector_list:
-            symbols=tickers[tickers['Sector'] == sector]['Symbol'].tolist()
-            symbols=schema.removeKeywordsFromSymbols(symbols)
-            command=schema.writeCreateTableStatement(symbols,sector,'Date')
-        df=schema.executeSelectStatement('fundamentals',None)
-        cur.execute(command)
-        conn.commit()
-        cur.close()
-        conn.close()
-    
\ No newline at end of file
+if __name__ == "__main__":
+    from SchemaUtils import SchemaUtils
+    schema = SchemaUtils()
+    #schema.main()
+    conn = schema.getConnection()
+    tickers = schema.getTickers()
+    sector_list = tickers.Sector.unique().tolist()
+    sector_list.pop(sector_list.index(np.nan))
+    cur = schema.getCursor(conn)
+    for sector in sector_list:
+        symbols=tickers[tickers['Sector'] == sector]['Symbol'].tolist()
+        symbols=schema.removeKeywordsFromSymbols(symbols)
+        command=schema.writeCreateTableStatement(symbols,sector,'Date')
+    df=schema.executeSelectStatement('fundamentals',None)
+    cur.execute(command)
+    conn.commit()
+    cur.close()
+    conn.close()
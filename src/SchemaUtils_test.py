@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the SQL written by SchemaUtils, and the lookups against an in-memory
+stand-in for the wide tables. No database connection is needed.
+"""
+
+import math
+import re
+import struct
+import pandas as pd
+import pytest
+from psycopg2 import extras
+from PriceCache import PriceCache
+from SchemaUtils import SchemaUtils, CopyChunkReader
+
+def test_alter_statement():
+    schema = SchemaUtils()
+    statement = schema.writeAlterTableStatement('energy', ['xom'], ['old'])
+    assert statement == ('ALTER TABLE price_data.energy ADD COLUMN IF NOT EXISTS xom double precision, '
+                         'DROP COLUMN IF EXISTS old;')
+    assert schema.writeAlterTableStatement('energy', [], []) is None
+
+def test_upsert_statement():
+    schema = SchemaUtils()
+    df = pd.DataFrame({'aa': [1.0], 'ach': [2.0]}, index=['2022-01-07'])
+    statement = schema.writeUpsertStatement(df, 'energy', 'date')
+    assert statement.startswith('INSERT INTO price_data.energy(date,aa,ach) VALUES %s ON CONFLICT (date)')
+    assert 'aa=COALESCE(EXCLUDED.aa,price_data.energy.aa)' in statement
+
+def test_staged_batches_are_merged_in_one_upsert():
+    schema = SchemaUtils()
+    df = pd.DataFrame({'AA': [1.5, float('nan')], '_ALL_': [4.0, 5.0]}, index=['2021-10-18', '2021-10-19'])
+    text = CopyChunkReader(schema.iterStageChunks(df, chunk_size=1)).read()
+    assert text == 'aa,2021-10-18,1.5\n_all_,2021-10-18,4.0\n_all_,2021-10-19,5.0\n'
+    statement = schema.writeMergeStageStatement(['aa', '_all_'], 'energy', 'date')
+    assert statement.startswith("INSERT INTO price_data.energy(date,aa,_all_) SELECT date,"
+                                "max(close) FILTER (WHERE symbol = 'aa'),max(close) FILTER (WHERE symbol = '_all_') "
+                                "FROM price_data.energy_stage GROUP BY date ON CONFLICT (date) DO UPDATE SET ")
+    assert 'aa=COALESCE(EXCLUDED.aa,price_data.energy.aa)' in statement
+    with pytest.raises(ValueError):
+        schema.writeMergeStageStatement(["aa') OR true --"], 'energy', 'date')
+
+def test_binary_copy_stream():
+    schema = SchemaUtils()
+    df = pd.DataFrame({'aa': [1.5, float('nan'), 3.0], 'ach': [4.0, 5.0, 6.25]},
+                      index=['2021-10-18', '2021-10-19', '2021-10-20'])
+    assert schema.canCopyBinary(df)
+    reader = CopyChunkReader(schema.iterBinaryChunks(df, chunk_size=2))
+    data = b''
+    part = reader.read(7)
+    while part:
+        data += part
+        part = reader.read(7)
+    assert data.startswith(b'PGCOPY\n\xff\r\n\x00') and data.endswith(b'\xff\xff')
+    pos = 19
+    for date, row in df.iterrows():
+        assert struct.unpack('>hi', data[pos:pos+6]) == (3, 10)
+        assert data[pos+6:pos+16].decode() == date
+        pos += 16
+        for value in row:
+            length, decoded = struct.unpack('>id', data[pos:pos+12])
+            assert length == 8
+            assert decoded == value or (math.isnan(decoded) and math.isnan(value))
+            pos += 12
+    assert pos == len(data) - 2
+
+def test_csv_fallback_for_ragged_index():
+    schema = SchemaUtils()
+    df = pd.DataFrame({'marketCap': [1.0, 2.0]}, index=['a', 'aacg'])
+    assert not schema.canCopyBinary(df)
+    text = CopyChunkReader(schema.iterCsvChunks(df, chunk_size=1)).read()
+    assert text == 'a,1.0\naacg,2.0\n'
+
+def test_select_statement_pushdown():
+    schema = SchemaUtils()
+    statement, args = schema.writeSelectStatement('energy', 'date', ['xom', 'cvx'],
+                                                  start_date='2021-06-01', end_date='2021-12-31')
+    assert statement == ('SELECT date,xom,cvx FROM price_data.energy '
+                         'WHERE date >= %s AND date <= %s ORDER BY date')
+    assert args == ['2021-06-01', '2021-12-31']
+
+    statement, args = schema.writeSelectStatement('energy', 'date', ['xom'], last=5)
+    assert statement == ('SELECT * FROM (SELECT date,xom FROM price_data.energy ORDER BY date DESC LIMIT %s) t '
+                         'ORDER BY date')
+    assert args == [5]
+
+    statement, args = schema.writeSelectStatement('fundamentals', None, ['symbol', 'updated_at'],
+                                                  keys=['XOM'], key_column='symbol')
+    assert statement == 'SELECT symbol,updated_at FROM price_data.fundamentals WHERE symbol = ANY(%s)'
+    assert args == [['XOM']]
+
+    # Values only ever travel as parameters; names that are not plain
+    # identifiers are refused
+    with pytest.raises(ValueError):
+        schema.writeSelectStatement('energy', 'date', ['xom; DROP TABLE energy'])
+
+def test_last_prices_leave_out_symbols_without_a_recent_price():
+    schema = SchemaUtils()
+    tables = {'energy': pd.DataFrame({'xom': [1.0, float('nan')], 'cvx': [float('nan')] * 2},
+                                     index=['2022-01-06', '2022-01-07']),
+              'finance': pd.DataFrame({'cvx': [2.0, 3.0]}, index=['2022-01-06', '2022-01-07'])}
+    schema.executeSelectStatement = lambda table_name, index, symbols, last: tables[table_name]
+    prices = schema.getLastPrices(['xom', 'cvx', 'gone'], ['energy', 'finance'])
+    assert prices.to_dict() == {'xom': 1.0, 'cvx': 3.0}
+
+class FakeWideDatabase:
+    # Wide tables under the names Postgres gives them: unquoted names are
+    # folded to lower case
+    def __init__(self, tables):
+        self.tables = {name.lower(): df for name, df in tables.items()}
+
+    def connection(self):
+        return FakeConnection(self)
+
+    # execute_values of an INSERT ... ON CONFLICT upsert
+    def executeValues(self, cursor, statement, rows, page_size=None):
+        name, columns = re.match(r'INSERT INTO price_data\.(\w+)\((\S+)\)', statement).groups()
+        name = name.lower()
+        columns = columns.split(',')
+        new = pd.DataFrame(rows, columns=columns).set_index(columns[0]).astype(float)
+        self.tables[name] = new.combine_first(self.tables[name])
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def cursor(self, name=None):
+        return FakeCursor(self.db)
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def close(self):
+        pass
+
+    def execute(self, statement, args=()):
+        tables = self.db.tables
+        if 'column_name FROM information_schema.columns' in statement:
+            df = tables.get(args[0])
+            self.rows = [] if df is None else [(c,) for c in [df.index.name] + list(df.columns)]
+        elif 'count(*) FROM information_schema.columns' in statement:
+            df = tables.get(args[0])
+            self.rows = [(0 if df is None else df.shape[1] + 1,)]
+        elif statement.startswith('SELECT max('):
+            df = tables[re.search(r'FROM price_data\.(\w+)', statement).group(1).lower()]
+            self.rows = [(max(df.index), len(df))]
+        elif statement.startswith('SELECT '):
+            # writeSelectStatement with a column list, optionally the last n
+            # dates
+            columns, name = re.search(r'SELECT ([\w,]+) FROM price_data\.(\w+)', statement).groups()
+            columns = columns.split(',')
+            df = tables[name.lower()].reset_index()[columns]
+            if 'LIMIT %s' in statement:
+                df = df.tail(args[-1])
+            self.description = [(c,) for c in columns]
+            self.rows = list(df.itertuples(index=False, name=None))
+        elif statement.startswith('CREATE UNIQUE INDEX'):
+            pass
+        else:
+            raise NotImplementedError(statement)
+
+    def fetchone(self):
+        return self.rows[0]
+    def fetchall(self):
+        return self.rows
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+def make_sector():
+    return pd.DataFrame({'aapl': [1.0, 2.0, float('nan')], 'msft': [4.0, float('nan'), float('nan')]},
+                        index=pd.Index(['2022-01-05', '2022-01-06', '2022-01-07'], name='date'))
+
+def test_mixed_case_sectors_are_found():
+    schema = SchemaUtils(storage='wide')
+    schema.connection = FakeWideDatabase({'Capital_Goods': make_sector()}).connection
+    assert schema.getTableColumns('Capital_Goods') == ['date', 'aapl', 'msft']
+    assert schema.getTableColumns('Energy') == []
+
+def test_price_key_changes_after_a_write_to_a_mixed_case_sector(monkeypatch):
+    db = FakeWideDatabase({'Capital_Goods': make_sector()})
+    monkeypatch.setattr(extras, 'execute_values', db.executeValues)
+    schema = SchemaUtils(storage='wide')
+    schema.connection = db.connection
+    assert schema.getTableVersion('Capital_Goods', 'date') == ('2022-01-07', 3, 3)
+    key = PriceCache().getSourceKey(schema, ['Capital_Goods'])
+    schema.executeUpsertStatement(pd.DataFrame({'aapl': [3.0]}, index=['2022-01-10']), 'Capital_Goods', 'date')
+    assert schema.getTableVersion('Capital_Goods', 'date') == ('2022-01-10', 4, 3)
+    assert PriceCache().getSourceKey(schema, ['Capital_Goods']) != key
+
+def test_last_prices_are_read_from_mixed_case_sectors():
+    schema = SchemaUtils(storage='wide')
+    schema.connection = FakeWideDatabase({'Capital_Goods': make_sector()}).connection
+    prices = schema.getLastPrices(['AAPL', 'msft', 'gone'], ['Capital_Goods'], lookback=2)
+    assert prices.to_dict() == {'aapl': 2.0}
+    prices = schema.getLastPrices(['AAPL', 'msft'], ['Capital_Goods'], lookback=3)
+    assert prices.to_dict() == {'aapl': 2.0, 'msft': 4.0}
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Stock selection from the Fama-French regression results.
+
+The objective rewards symbols whose alpha and R-squared are both close to
+the best in the universe. fama_french.py and the walk-forward backtester
+rank with the same code so a backtest measures the live selection rule.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Weights for optimization
+W_FIT = 0.0008
+W_ALPHA = 0.9992
+
+# Drop outliers where alpha is more than this many std from the mean
+OUTLIER_SIGMA = 6
+
+class SelectionUtils:
+
+    # Inputs
+    #    min_alpha_t : if set, symbols whose alpha has a lower Newey-West
+    #                  t-statistic ('hac_t_alpha', see SignificanceUtils) are
+    #                  dropped along with the outliers
+    def __init__(self, w_fit=W_FIT, w_alpha=W_ALPHA, outlier_sigma=OUTLIER_SIGMA, min_alpha_t=None):
+        self.w_fit = w_fit
+        self.w_alpha = w_alpha
+        self.outlier_sigma = outlier_sigma
+        self.min_alpha_t = min_alpha_t
+    #end def
+
+    # Scores every symbol; lower objective is better
+    # Inputs
+    #    params : DataFrame with 'alpha' and 'rsquared' columns, one row per
+    #             symbol
+    # Outputs
+    #    copy of params without the alpha outliers, with 'std_from_mean' and
+    #    'objective' columns added
+    def computeObjective(self, params):
+        max_fit = params['rsquared'].max()
+        max_alpha = params['alpha'].max()
+
+        std = params['alpha'].std()
+        mean = params['alpha'].mean()
+
+        params = params.copy()
+        params['std_from_mean'] = round(abs(params['alpha']-mean)/std, ndigits=2)
+        params = params[params['std_from_mean'] < self.outlier_sigma].copy()
+        if self.min_alpha_t is not None:
+            params = params[params['hac_t_alpha'] >= self.min_alpha_t].copy()
+        #end if
+
+        params['objective'] = self.w_fit*(params['rsquared']-max_fit)**2 + \
+                              self.w_alpha*(params['alpha']-max_alpha)**2
+        return params
+    #end def
+
+    # The N best rows of computeObjective's output, best first
+    def selectTop(self, params, N):
+        return params.sort_values(by='objective').head(N)
+    #end def
+
+    # Whole-share allocation of inv_amount split equally over the shortlist
+    # Inputs
+    #    shortlist      : output of selectTop (with 'symbol', 'rsquared', 'alpha')
+    #    current_prices : Series of latest prices indexed by symbol
+    #    inv_amount     : capital to invest
+    # Outputs
+    #    DataFrame indexed by symbol with 'Number of Shares', 'Current Price',
+    #    'Subtotal', 'rsquared' and 'alpha'
+    def allocate(self, shortlist, current_prices, inv_amount):
+        shortlist = shortlist.set_index('symbol')
+        target = inv_amount / len(shortlist)
+        price = pd.Series(current_prices, dtype=np.float64).reindex(shortlist.index)
+
+        allocation = pd.DataFrame({'Number of Shares': (target / price).round(),
+                                   'Current Price': price})
+        allocation['Subtotal'] = allocation['Number of Shares'] * allocation['Current Price']
+        return allocation.join(shortlist[['rsquared', 'alpha']])
+    #end def
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Significance of the factor loadings of every symbol.
+
+Daily returns are autocorrelated, so the plain OLS standard errors of
+RegressionUtils understate how uncertain an alpha is. Two batched
+alternatives are computed here for every symbol and coefficient:
+
+    hac        Newey-West (Bartlett kernel) standard errors and t-statistics
+    bootstrap  moving-block bootstrap standard errors and percentile
+               confidence intervals
+
+Both reuse the design matrix all symbols share. HAC needs one (X'X)^-1 and
+the lagged cross products of the scores x_t*e_t of all symbols at once. A
+block-bootstrap sample of rows only reweights them, so a draw is a vector c
+of row counts and b* = (X'diag(c)X)^-1 X'diag(c)Y: one K x K inverse per
+draw for every symbol, and one (draws*K x T) @ (T x symbols) product per
+chunk of draws. A symbol with gaps uses the draw's X'X less the rows it
+misses, and those systems are solved together by a Cholesky factorization
+unrolled across the whole stack.
+
+Each chunk of draws is generated from its own child of
+SeedSequence(seed), so the intervals depend on the seed and the chunk size
+only, not on how many worker processes share the chunks.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from RegressionUtils import RegressionUtils
+
+# Bootstrap draws generated and solved together
+DRAWS_PER_CHUNK = 50
+
+# Symbols whose T x K x M score array is held at once by hac
+SYMBOL_BLOCK = 1000
+
+# Symbols with gaps solved together by a bootstrap chunk; each holds a
+# draws x K x K block of systems
+MASKED_BLOCK = 1000
+
+# Newey-West lag truncation, floor(4*(T/100)^(2/9))
+def neweyWestLags(T):
+    return int(np.floor(4 * (T / 100.0) ** (2.0 / 9.0)))
+#end def
+
+# Bootstrap block length, about T^(1/3)
+def defaultBlockLength(T):
+    return max(1, int(round(T ** (1.0 / 3.0))))
+#end def
+
+# Row counts of moving-block bootstrap samples
+# Outputs
+#    draws x T array; row b counts how often each date is in sample b
+def drawCounts(rng, T, draws, block_length):
+    block_length = min(block_length, T)
+    blocks = -(-T // block_length)
+    starts = rng.integers(0, T - block_length + 1, size=(draws, blocks))
+    rows = (starts[:, :, None] + np.arange(block_length)).reshape(draws, -1)[:, :T]
+    rows = rows + (np.arange(draws) * T)[:, None]
+    return np.bincount(rows.ravel(), minlength=draws * T).reshape(draws, T).astype(np.float64)
+#end def
+
+# Inverses of a stack of K x K systems, NaN where one is singular
+def _invert(XtX):
+    inv = np.full(XtX.shape, np.nan)
+    det = np.linalg.det(XtX)
+    ok = np.abs(det) > 1e-300
+    inv[ok] = np.linalg.inv(XtX[ok])
+    return inv
+#end def
+
+# Quantiles along the last axis ignoring NaN (linear interpolation, as
+# np.nanquantile), from one sort instead of a pass per row
+def nanQuantiles(samples, qs):
+    ordered = np.sort(samples, axis=-1)
+    n = np.sum(~np.isnan(ordered), axis=-1, keepdims=True)
+    out = []
+    for q in qs:
+        position = q * np.maximum(n - 1, 0)
+        lo = np.floor(position).astype(np.int64)
+        hi = np.minimum(lo + 1, np.maximum(n - 1, 0))
+        below = np.take_along_axis(ordered, lo, axis=-1)
+        above = np.take_along_axis(ordered, hi, axis=-1)
+        value = (below + (position - lo) * (above - below))[..., 0]
+        value[n[..., 0] == 0] = np.nan
+        out.append(value)
+    #end for
+    return out
+#end def
+
+# Solves a stack of symmetric positive definite K x K systems by an
+# unrolled Cholesky factorization, one vector operation per entry across
+# the whole stack. Singular systems give NaN
+# Inputs
+#    A : K x K x ... array of systems
+#    b : K x ... array of right-hand sides
+def choleskySolve(A, b):
+    K = A.shape[0]
+    L = np.zeros_like(A)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for j in range(K):
+            d = A[j, j] - sum(L[j, k] ** 2 for k in range(j))
+            L[j, j] = np.sqrt(np.where(d > 0, d, np.nan))
+            for i in range(j + 1, K):
+                L[i, j] = (A[i, j] - sum(L[i, k] * L[j, k] for k in range(j))) / L[j, j]
+            #end for
+        #end for
+        # L z = b, then L' x = z
+        z = np.empty_like(b)
+        for i in range(K):
+            z[i] = (b[i] - sum(L[i, k] * z[k] for k in range(i))) / L[i, i]
+        #end for
+        x = np.empty_like(b)
+        for i in reversed(range(K)):
+            x[i] = (z[i] - sum(L[k, i] * x[k] for k in range(i + 1, K))) / L[i, i]
+        #end for
+    #end with
+    return x
+#end def
+
+# Coefficients of every symbol in every bootstrap sample
+# Inputs
+#    Y      : T x M returns, zero where masked
+#    X      : T x K design matrix
+#    mask   : T x M observed flags, or None if every symbol is complete
+#    counts : draws x T row counts (drawCounts)
+# Outputs
+#    K x M x draws float32 array
+def bootstrapParams(Y, X, mask, counts):
+    T, K = X.shape
+    M = Y.shape[1]
+    draws = counts.shape[0]
+    out = np.full((K, M, draws), np.nan, dtype=np.float32)
+
+    # Y is zero where masked, so one product gives X'diag(c)y of every
+    # symbol, gaps or not
+    CX = (counts[:, :, None] * X[None]).transpose(0, 2, 1).reshape(draws * K, T)
+    XtY = (CX @ Y).reshape(draws, K, M)
+    XX = (X[:, :, None] * X[:, None, :]).reshape(T, K * K)
+    XtX = counts @ XX
+
+    # Complete symbols: the reweighted X'X of a draw is shared
+    dense = np.ones(M, dtype=bool) if mask is None else mask.all(axis=0)
+    if dense.any():
+        XtX_inv = _invert(XtX.reshape(draws, K, K))
+        out[:, dense] = np.einsum('bkj,bjm->kmb', XtX_inv, XtY[:, :, dense])
+    #end if
+
+    # Symbols with gaps: the shared X'X less the rows they miss, solved
+    # per draw and symbol
+    gappy = np.flatnonzero(~dense)
+    if len(gappy) > 0:
+        CXX = (counts[:, :, None] * XX[None]).transpose(0, 2, 1).reshape(draws * K * K, T)
+    #end if
+    for a in range(0, len(gappy), MASKED_BLOCK):
+        cols = gappy[a:a + MASKED_BLOCK]
+        missed = (CXX @ (~mask[:, cols]).astype(np.float64)).reshape(draws, K * K, len(cols))
+        A = (XtX[:, :, None] - missed).reshape(draws, K, K, len(cols)).transpose(1, 2, 0, 3)
+        params = choleskySolve(A, XtY[:, :, cols].transpose(1, 0, 2))
+        out[:, cols] = params.transpose(0, 2, 1)
+    #end for
+    return out
+#end def
+
+# State of a pool worker, set once by _initWorker
+_worker = {}
+
+def _initWorker(shm_name, shape, X, mask):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    Y = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    Y.flags.writeable = False
+    _worker.update({'shm': shm, 'Y': Y, 'X': X, 'mask': mask})
+#end def
+
+def _runDraws(seed, draws, block_length):
+    counts = drawCounts(np.random.default_rng(seed), _worker['X'].shape[0], draws, block_length)
+    return bootstrapParams(_worker['Y'], _worker['X'], _worker['mask'], counts)
+#end def
+
+class SignificanceUtils:
+
+    # Inputs
+    #    max_workers : process pool size for the bootstrap; 0 or 1 runs
+    #                  in-process
+    def __init__(self, max_workers=1, draws_per_chunk=DRAWS_PER_CHUNK):
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.draws_per_chunk = draws_per_chunk
+    #end def
+
+    # Returns as a zero-filled matrix and its observed mask (None if
+    # complete)
+    def _prepare(self, Y, X):
+        Y = np.asarray(Y, dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if Y.ndim == 1:
+            Y = Y[:, None]
+        #end if
+        mask = ~np.isnan(Y)
+        if mask.all():
+            return Y, X, None
+        #end if
+        return np.where(mask, Y, 0.0), X, mask
+    #end def
+
+    # Newey-West standard errors of every symbol's coefficients
+    # Inputs
+    #    Y    : T x M returns, NaN where missing
+    #    X    : T x K design matrix shared by all symbols
+    #    lags : lag truncation (default neweyWestLags(T))
+    # Outputs
+    #    dictionary of K x M arrays 'params', 'se' and 't', matching
+    #    statsmodels' OLS fit(cov_type='HAC') symbol by symbol
+    def hac(self, Y, X, lags=None):
+        Y, X, mask = self._prepare(Y, X)
+        T, K = X.shape
+        M = Y.shape[1]
+        lags = neweyWestLags(T) if lags is None else lags
+        fit = RegressionUtils().fitOLS(Y if mask is None else np.where(mask, Y, np.nan), X,
+                                       mask=mask, resid=True)
+        # Masked dates contribute no score
+        E = np.nan_to_num(fit['resid'])
+        nobs = fit['nobs']
+
+        var = np.full((M, K), np.nan)
+        shared = _invert(np.asarray(X.T @ X)[None])[0]
+        for a in range(0, M, SYMBOL_BLOCK):
+            b = min(a + SYMBOL_BLOCK, M)
+            U = X[:, :, None] * E[:, None, a:b]
+            S = np.einsum('tkm,tjm->mkj', U, U)
+            for lag in range(1, min(lags, T - 1) + 1):
+                G = np.einsum('tkm,tjm->mkj', U[lag:], U[:-lag])
+                S += (1.0 - lag / (lags + 1.0)) * (G + G.transpose(0, 2, 1))
+            #end for
+            if mask is None:
+                var[a:b] = np.einsum('ki,mij,kj->mk', shared, S, shared)
+            else:
+                XtX_inv = _invert(np.einsum('ti,tj,tm->mij', X, X, mask[:, a:b].astype(np.float64)))
+                var[a:b] = np.einsum('mki,mij,mkj->mk', XtX_inv, S, XtX_inv)
+            #end if
+        #end for
+        var[nobs <= K] = np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            se = np.sqrt(var.T)
+            t = fit['params'] / se
+        #end with
+        return {'params': fit['params'], 'se': se, 't': t}
+    #end def
+
+    # Moving-block bootstrap of every symbol's coefficients
+    # Inputs
+    #    Y, X         : as for hac
+    #    draws        : number of bootstrap samples
+    #    block_length : rows per block (default defaultBlockLength(T))
+    #    level        : coverage of the percentile intervals
+    #    seed         : seed of the SeedSequence the chunks are spawned from
+    # Outputs
+    #    dictionary of K x M arrays 'se', 'lower' and 'upper'
+    def bootstrap(self, Y, X, draws=1000, block_length=None, level=0.95, seed=0):
+        Y, X, mask = self._prepare(Y, X)
+        T = X.shape[0]
+        block_length = defaultBlockLength(T) if block_length is None else block_length
+        sizes = [min(self.draws_per_chunk, draws - a) for a in range(0, draws, self.draws_per_chunk)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+        if self.max_workers <= 1 or len(sizes) == 1:
+            samples = [bootstrapParams(Y, X, mask, drawCounts(np.random.default_rng(s), T, n, block_length))
+                       for s, n in zip(seeds, sizes)]
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=max(Y.nbytes, 1))
+            try:
+                np.ndarray(Y.shape, dtype=np.float64, buffer=shm.buf)[:] = Y
+                with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_initWorker,
+                                         initargs=(shm.name, Y.shape, X, mask)) as executor:
+                    samples = list(executor.map(_runDraws, seeds, sizes, [block_length] * len(sizes)))
+                #end with
+            finally:
+                shm.close()
+                shm.unlink()
+            #end try
+        #end if
+        samples = np.concatenate(samples, axis=2)
+
+        tail = (1.0 - level) / 2.0
+        with np.errstate(invalid='ignore'):
+            lower, upper = nanQuantiles(samples, [tail, 1.0 - tail])
+            se = np.nanstd(samples, axis=2, ddof=1)
+        #end with
+        return {'se': se.astype(np.float64), 'lower': lower.astype(np.float64),
+                'upper': upper.astype(np.float64)}
+    #end def
+
+    # HAC and (optionally) bootstrap significance of every symbol, by name
+    # Inputs
+    #    returns : DataFrame of returns, one column per symbol
+    #    X       : DataFrame design matrix (its columns name the
+    #              coefficients)
+    #    symbols : columns of returns to test
+    #    draws   : bootstrap samples; 0 skips the bootstrap
+    # Outputs
+    #    DataFrame with 'symbol' and, per coefficient, 'hac_se_<name>' and
+    #    'hac_t_<name>', plus 'boot_se_<name>', 'boot_lower_<name>' and
+    #    'boot_upper_<name>' with a bootstrap
+    def testParams(self, returns, X, symbols, lags=None, draws=0, block_length=None, level=0.95, seed=0):
+        Y = returns[symbols].to_numpy(dtype=np.float64)
+        table = pd.DataFrame({'symbol': list(symbols)})
+        result = self.hac(Y, X.to_numpy(), lags=lags)
+        for i, name in enumerate(X.columns):
+            table['hac_se_'+name] = result['se'][i]
+            table['hac_t_'+name] = result['t'][i]
+        #end for
+        if draws > 0:
+            result = self.bootstrap(Y, X.to_numpy(), draws=draws, block_length=block_length,
+                                    level=level, seed=seed)
+            for i, name in enumerate(X.columns):
+                table['boot_se_'+name] = result['se'][i]
+                table['boot_lower_'+name] = result['lower'][i]
+                table['boot_upper_'+name] = result['upper'][i]
+            #end for
+        #end if
+        return table
+    #end def
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the batched Newey-West errors against statsmodels and the bootstrap
+draws against explicit reweighted regressions
+"""
+
+import numpy as np
+import pytest
+import statsmodels.api as sm
+from RegressionUtils_test import make_data
+from SignificanceUtils import SignificanceUtils, bootstrapParams, drawCounts, nanQuantiles
+
+def make_gappy_data(T=200, M=12):
+    Y, X = make_data(T, M)
+    Y[:30, 2] = np.nan   # listed late
+    Y[50:53, 3] = np.nan # short gap
+    return Y, X
+
+def test_hac_matches_statsmodels():
+    Y, X = make_gappy_data()
+    result = SignificanceUtils().hac(Y, X, lags=5)
+    for m in (0, 1, 2):
+        rows = ~np.isnan(Y[:, m])
+        fit = sm.OLS(Y[rows, m], X[rows]).fit(cov_type='HAC', cov_kwds={'maxlags': 5})
+        assert np.allclose(result['params'][:, m], fit.params)
+        assert np.allclose(result['se'][:, m], fit.bse)
+        assert np.allclose(result['t'][:, m], fit.tvalues)
+
+def test_bootstrap_draws_are_reweighted_regressions():
+    Y, X = make_gappy_data()
+    counts = drawCounts(np.random.default_rng(1), len(X), 4, block_length=6)
+    assert (counts.sum(axis=1) == len(X)).all()
+    mask = ~np.isnan(Y)
+    params = bootstrapParams(np.where(mask, Y, 0.0), X, mask, counts)
+    for b, m in [(0, 0), (1, 2), (3, 3)]:
+        w = counts[b] * mask[:, m]
+        expected = np.linalg.solve((X * w[:, None]).T @ X, (X * w[:, None]).T @ np.nan_to_num(Y[:, m]))
+        assert np.allclose(params[:, m, b], expected, rtol=1e-4)
+
+def test_bootstrap_is_reproducible_across_worker_counts():
+    Y, X = make_gappy_data(T=120, M=6)
+    single = SignificanceUtils(max_workers=1, draws_per_chunk=25).bootstrap(Y, X, draws=100, seed=7)
+    pooled = SignificanceUtils(max_workers=2, draws_per_chunk=25).bootstrap(Y, X, draws=100, seed=7)
+    for key in ('se', 'lower', 'upper'):
+        assert np.array_equal(single[key], pooled[key])
+    assert (single['lower'] < single['upper']).all()
+
+def test_nan_quantiles_match_numpy():
+    samples = np.random.default_rng(2).standard_normal((3, 4, 51))
+    samples[0, 0, :9] = np.nan
+    samples[1, 1] = np.nan
+    lower, upper = nanQuantiles(samples, [0.05, 0.95])
+    with pytest.warns(RuntimeWarning):
+        expected = np.nanquantile(samples, [0.05, 0.95], axis=2)
+    assert np.allclose(lower, expected[0], equal_nan=True)
+    assert np.allclose(upper, expected[1], equal_nan=True)
@@ -2,4 +2,7 @@ import os
 CONSUMER_KEY = 'KUXI2LXBGQBZK6LZGL8SDPFG3RZGLRFK'
 REDIRECT_URI = 'http://localhost/datapull'
 JSON_PATH = os.path.abspath("./TDA/credentials.json")
-QUANDL_TOKEN = 'gmL7ffezDdVsh2-1eSna'
\ No newline at end of file
+QUANDL_TOKEN = 'gmL7ffezDdVsh2-1eSna'
+
+# TD Ameritrade allows 2 API requests per second per consumer key
+REQUESTS_PER_SECOND = 2
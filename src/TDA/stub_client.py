@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Offline stand-in for td.client.TdAmeritradeClient.
+
+Serves deterministic synthetic candles and fundamentals with a configurable
+latency, and records the time of every request so throughput and rate
+limiting can be checked without network access or credentials.
+"""
+
+import threading
+import time
+import zlib
+
+class _StubPriceHistory:
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_price_history(self, symbol, period_type='year', period=1,
+                          frequency_type='daily', frequency=1,
+                          start_date=None, end_date=None, **kwargs):
+        self.client._record('price_history', symbol)
+        day = 86400000
+        if end_date is None:
+            end_date = self.client.end_date
+        if start_date is None:
+            start_date = end_date - self.client.days * day
+        seed = zlib.crc32(symbol.encode())
+        candles = []
+        t = start_date - start_date % day + 5 * 3600000
+        while t <= end_date:
+            # Simple deterministic walk so reruns give identical data
+            close = 10 + (seed % 90) + ((t // day) * (seed % 7 + 1)) % 13 / 10
+            candles.append({'open': close, 'high': close, 'low': close,
+                            'close': close, 'volume': 1000, 'datetime': t})
+            t += day
+        return {'candles': candles, 'symbol': symbol, 'empty': len(candles) == 0}
+
+class _StubInstruments:
+
+    def __init__(self, client):
+        self.client = client
+
+    def search_instruments(self, symbol, projection='fundamental'):
+        self.client._record('instruments', symbol)
+        symbols = symbol.split(',')
+        response = {}
+        for sym in symbols:
+            seed = zlib.crc32(sym.encode())
+            response[sym] = {'fundamental': {'symbol': sym,
+                                             'marketCap': float(seed % 100000 + 1),
+                                             'bookValuePerShare': float(seed % 50 + 1),
+                                             'sharesOutstanding': float(seed % 1000 + 1)}}
+        return response
+
+class StubTdClient:
+
+    # Inputs
+    #    latency  : seconds each request takes to "return"
+    #    days     : length of the price history served when no start is given
+    #    end_date : epoch milliseconds of the last candle
+    def __init__(self, latency=0.0, days=365, end_date=1641513600000):
+        self.latency = latency
+        self.days = days
+        self.end_date = end_date
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, endpoint, symbol):
+        with self.lock:
+            self.calls.append((time.monotonic(), endpoint, symbol))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def price_history(self):
+        return _StubPriceHistory(self)
+
+    def instruments(self):
+        return _StubInstruments(self)
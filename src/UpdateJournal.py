@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Durable progress journal for the database update job.
+
+A small SQLite file records, for the current job, which symbols of each
+stage ('fundamentals', 'prices:<sector>', ...) have been written and up to
+which date. A job that is interrupted (connection loss, expired token,
+killed process) is resumed by the next run with the same targets and mode,
+which skips the work already recorded; a new job starts once the previous
+one has finished. An unfinished job with other targets is left for a run
+that matches it.
+
+Failures are tracked across jobs: a symbol that still fails after the
+fetcher's retries has its failure count raised, and after quarantine_after
+failed jobs in a row it is quarantined, i.e. skipped by later jobs until it
+is released. A success, or a job in between that did not fail the symbol,
+resets the count.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'update_journal.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    job INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    targets TEXT,
+    incremental INTEGER
+);
+CREATE TABLE IF NOT EXISTS progress (
+    job INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    last_date TEXT,
+    rows INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job, stage, symbol)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    stage TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    last_job INTEGER NOT NULL,
+    last_error TEXT,
+    quarantined INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (stage, symbol)
+);
+'''
+
+class UpdateJournal:
+
+    # Inputs
+    #    path             : SQLite file, created if missing
+    #    quarantine_after : failed jobs in a row before a symbol is quarantined
+    def __init__(self, path=DEFAULT_PATH, quarantine_after=3, clock=time.time):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.quarantine_after = quarantine_after
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Writes come from the fetch loop and from the database writer thread
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        # Journals from before jobs recorded their targets
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')]
+        for column, kind in [('targets', 'TEXT'), ('incremental', 'INTEGER')]:
+            if column not in columns:
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN '+column+' '+kind)
+            #end if
+        #end for
+        self.job = None
+    #end def
+
+    def close(self):
+        self.conn.close()
+    #end def
+
+    # Resumes the last unfinished job with the same targets and mode, or
+    # starts a new one
+    # Inputs
+    #    targets     : what the job updates, e.g. ['fundamentals', 'prices']
+    #    incremental : whether the job is an incremental update
+    # Outputs
+    #    (job id, True if an interrupted job is being resumed)
+    def start(self, targets=None, incremental=None):
+        targets, incremental = self.getJobKey(targets, incremental)
+        with self.lock:
+            row = self.conn.execute('SELECT job FROM jobs WHERE finished_at IS NULL AND targets IS ? '
+                                    'AND incremental IS ? ORDER BY job DESC LIMIT 1',
+                                    (targets, incremental)).fetchone()
+            if row is not None:
+                self.job = row[0]
+                return self.job, True
+            #end if
+            cursor = self.conn.execute('INSERT INTO jobs (started_at, targets, incremental) VALUES (?, ?, ?)',
+                                       (self.clock(), targets, incremental))
+            self.job = cursor.lastrowid
+        #end with
+        return self.job, False
+    #end def
+
+    def finish(self):
+        with self.lock:
+            self.conn.execute('UPDATE jobs SET finished_at = ? WHERE job = ?', (self.clock(), self.job))
+        #end with
+    #end def
+
+    # The targets and mode as the jobs table records them
+    def getJobKey(self, targets, incremental):
+        targets = None if targets is None else ','.join(sorted(set(targets)))
+        incremental = None if incremental is None else int(bool(incremental))
+        return targets, incremental
+    #end def
+
+    # Unfinished jobs other than the current one
+    # Outputs
+    #    list of (job id, targets, incremental)
+    def getUnfinished(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT job, targets, incremental FROM jobs WHERE finished_at IS NULL '
+                                     'AND job IS NOT ? ORDER BY job', (self.job,)).fetchall()
+        #end with
+        return [(job, None if targets is None else targets.split(','),
+                 None if incremental is None else bool(incremental)) for job, targets, incremental in rows]
+    #end def
+
+    # Symbols of stage already written by the current job
+    def getDone(self, stage):
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol FROM progress WHERE job = ? AND stage = ?',
+                                     (self.job, stage)).fetchall()
+        #end with
+        return set(row[0] for row in rows)
+    #end def
+
+    # {symbol: rows} recorded by markDone for stage in the current job
+    def getRows(self, stage):
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol, rows FROM progress WHERE job = ? AND stage = ?',
+                                     (self.job, stage)).fetchall()
+        #end with
+        return dict(rows)
+    #end def
+
+    def isDone(self, stage, symbol='*'):
+        return symbol in self.getDone(stage)
+    #end def
+
+    # Records symbols as written. '*' marks a whole stage
+    # Inputs
+    #    symbols    : symbol or list of symbols
+    #    last_dates : matching last dates fetched, or None
+    #    rows       : matching row counts, or None
+    def markDone(self, stage, symbols='*', last_dates=None, rows=None):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+            last_dates = None if last_dates is None else [last_dates]
+            rows = None if rows is None else [rows]
+        #end if
+        now = self.clock()
+        last_dates = last_dates if last_dates is not None else [None] * len(symbols)
+        rows = rows if rows is not None else [None] * len(symbols)
+        with self.lock:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(self.job, stage, s, d, r, now) for s, d, r in zip(symbols, last_dates, rows)])
+            self.conn.executemany('DELETE FROM failures WHERE stage = ? AND symbol = ?',
+                                  [(stage, s) for s in symbols])
+            self.conn.execute('COMMIT')
+        #end with
+    #end def
+
+    # Records a failure that outlasted the retries. A symbol counts at most
+    # one failure per job, and its failures only add up over consecutive
+    # jobs
+    # Outputs
+    #    True if the symbol is now quarantined
+    def markFailed(self, stage, symbol, error):
+        now = self.clock()
+        with self.lock:
+            row = self.conn.execute('SELECT failures, last_job FROM failures WHERE stage = ? AND symbol = ?',
+                                    (stage, symbol)).fetchone()
+            previous = self.conn.execute('SELECT max(job) FROM jobs WHERE job < ?', (self.job,)).fetchone()[0]
+            if row is None:
+                failures = 1
+            elif row[1] == self.job:
+                failures = row[0]
+            elif row[1] == previous:
+                failures = row[0] + 1
+            else:
+                failures = 1
+            #end if
+            quarantined = int(failures >= self.quarantine_after)
+            self.conn.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (stage, symbol, failures, self.job, str(error), quarantined, now))
+        #end with
+        return bool(quarantined)
+    #end def
+
+    # Quarantined symbols of stage. Stages are matched by prefix, so
+    # 'prices' covers every 'prices:<sector>' stage
+    def getQuarantined(self, stage):
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol FROM failures WHERE quarantined = 1 AND '
+                                     '(stage = ? OR stage LIKE ?)', (stage, stage+':%')).fetchall()
+        #end with
+        return set(row[0] for row in rows)
+    #end def
+
+    # Puts quarantined symbols back into the job (all of them if symbols
+    # is None)
+    def release(self, stage=None, symbols=None):
+        query = 'DELETE FROM failures WHERE quarantined = 1'
+        args = []
+        if stage is not None:
+            query += ' AND stage = ?'
+            args.append(stage)
+        #end if
+        if symbols is not None:
+            query += ' AND symbol IN (' + ','.join('?' * len(symbols)) + ')'
+            args.extend(symbols)
+        #end if
+        with self.lock:
+            self.conn.execute(query, args)
+        #end with
+    #end def
+
+    # Per-stage counts for the current job: {stage: (done, failed, quarantined)}
+    def getSummary(self):
+        summary = {}
+        with self.lock:
+            for stage, done in self.conn.execute('SELECT stage, count(*) FROM progress WHERE job = ? '
+                                                 "AND symbol <> '*' GROUP BY stage", (self.job,)):
+                summary[stage] = [done, 0, 0]
+            #end for
+            for stage, failed, quarantined in self.conn.execute(
+                    'SELECT stage, count(*), sum(quarantined) FROM failures WHERE last_job = ? '
+                    'GROUP BY stage', (self.job,)):
+                summary.setdefault(stage, [0, 0, 0])[1:] = [failed, quarantined]
+            #end for
+        #end with
+        return {stage: tuple(counts) for stage, counts in summary.items()}
+    #end def
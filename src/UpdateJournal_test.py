@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Checks resuming and quarantining in the update journal
+"""
+
+from UpdateJournal import UpdateJournal
+
+def test_interrupted_job_is_resumed(tmp_path):
+    path = str(tmp_path / 'journal.sqlite')
+    journal = UpdateJournal(path)
+    job, resumed = journal.start()
+    assert not resumed
+    journal.markDone('prices:energy', ['XOM', 'CVX'], ['2022-01-07', '2022-01-06'], [252, 251])
+    journal.close()
+
+    # A new process picks up the unfinished job and its progress
+    journal = UpdateJournal(path)
+    assert journal.start() == (job, True)
+    assert journal.getRows('prices:energy') == {'XOM': 252, 'CVX': 251}
+    assert not journal.isDone('prices:energy')
+    journal.markDone('prices:energy')
+    assert journal.isDone('prices:energy')
+    assert journal.getSummary() == {'prices:energy': (2, 0, 0)}
+    journal.finish()
+
+    next_job, resumed = journal.start()
+    assert next_job != job and not resumed
+    assert journal.getDone('prices:energy') == set()
+
+def test_symbols_failing_in_consecutive_jobs_are_quarantined(tmp_path):
+    journal = UpdateJournal(str(tmp_path / 'journal.sqlite'), quarantine_after=2)
+    journal.start()
+    assert not journal.markFailed('prices:energy', 'BAD', 'ServerError')
+    # Several failures within one job count once
+    assert not journal.markFailed('prices:energy', 'BAD', 'ServerError')
+    assert not journal.markFailed('prices:energy', 'FLAKY', 'ConnectionError')
+    journal.finish()
+
+    journal.start()
+    journal.markDone('prices:energy', ['FLAKY'])
+    assert journal.markFailed('prices:energy', 'BAD', 'ServerError')
+    assert journal.getQuarantined('prices') == {'BAD'}
+    assert journal.getSummary() == {'prices:energy': (1, 1, 1)}
+    journal.finish()
+
+    # A success reset FLAKY's count, so one more failure does not quarantine it
+    journal.start()
+    assert not journal.markFailed('prices:energy', 'FLAKY', 'ConnectionError')
+    journal.release('prices:energy')
+    assert journal.getQuarantined('prices') == set()
+
+def test_failures_only_add_up_over_consecutive_jobs(tmp_path):
+    journal = UpdateJournal(str(tmp_path / 'journal.sqlite'), quarantine_after=3)
+    # Failing every other job, with jobs in between that record nothing
+    # for the symbol, never quarantines it
+    for i in range(6):
+        journal.start()
+        if i % 2 == 0:
+            assert not journal.markFailed('fundamentals', 'FLAKY', 'ServerError')
+        journal.finish()
+    for i in range(3):
+        journal.start()
+        quarantined = journal.markFailed('fundamentals', 'FLAKY', 'ServerError')
+        journal.finish()
+    assert quarantined
+
+def test_only_a_job_with_the_same_targets_is_resumed(tmp_path):
+    journal = UpdateJournal(str(tmp_path / 'journal.sqlite'))
+    job, resumed = journal.start(['fundamentals', 'prices'], incremental=False)
+    journal.markDone('fundamentals')
+
+    # Another kind of job runs on its own and leaves the interrupted one be
+    other, resumed = journal.start(['fundamentals'], incremental=False)
+    assert other != job and not resumed
+    assert not journal.isDone('fundamentals')
+    assert journal.getUnfinished() == [(job, ['fundamentals', 'prices'], False)]
+    journal.finish()
+
+    assert journal.start(['prices', 'fundamentals'], incremental=True)[1] is False
+    journal.finish()
+    assert journal.start(['prices', 'fundamentals'], incremental=False) == (job, True)
+    assert journal.isDone('fundamentals')
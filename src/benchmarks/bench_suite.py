@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths of the update and analysis pipeline over
+synthetic universes of increasing size.
+
+Each size builds a synthetic universe (see synthetic.py) and times, one at a
+time:
+    insert_prepare  rendering every sector table for binary COPY
+    insert_db       writing the sector tables (only with a database)
+    select_db       reading them back (only with a database)
+    assemble        aligning the sector frames into one panel
+    assemble_panel  the same through PricePanel
+    quality         data-quality measures and rules for every symbol
+    factors         SMB/HML with quarterly rebalancing
+    regression      the batched factor regressions
+    significance    Newey-West errors and a 500-draw block bootstrap
+    selection       objective ranking and top-N selection
+    sweep           the same for 1000 selection/allocation configurations
+
+Each benchmark reports the best wall time of --repeat runs and the peak
+memory (tracemalloc) of one further run. With --save-baseline the times are
+written to the baseline file. Otherwise they are compared with it, and the
+run exits with status 1 if any benchmark is slower than its baseline by
+more than --threshold.
+
+Usage (from src/):
+    python benchmarks/bench_suite.py [--sizes smol,1000,full,10000,20000]
+        [--days 252] [--sectors N] [--nan-density 0.01] [--repeat 3]
+        [--baseline benchmarks/baselines.json] [--save-baseline]
+        [--threshold 1.5] [--skip-db]
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from synthetic import makeUniverse, makeSectorPrices, makeFundamentals, universeSize
+from PanelUtils import PanelUtils
+from PricePanel import PricePanel
+from FactorUtils import FactorUtils
+from RegressionUtils import RegressionUtils
+from SelectionUtils import SelectionUtils
+from DataQuality import DataQuality
+from ParameterSweep import ParameterSweep
+from SignificanceUtils import SignificanceUtils
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# Benchmarks faster than this are too noisy to fail a run on
+MIN_COMPARABLE_SECONDS = 0.02
+
+def resolveSize(size):
+    return universeSize(size) if size in ('smol', 'full') else int(size)
+#end def
+
+# Synthetic inputs for one universe size, built once and shared by the
+# benchmarks
+def buildContext(symbols, days, sectors, nan_density):
+    universe = makeUniverse(symbols, sectors)
+    sector_prices = makeSectorPrices(universe, days, nan_density)
+    prices = PanelUtils().alignFrames(list(sector_prices.values()))
+    returns = PricePanel.fromFrame(prices).returns().toFrame()
+    fundamentals = makeFundamentals(universe)
+    factors = FactorUtils().buildFactors(returns, fundamentals,
+                                         FactorUtils().rebalanceDates(returns.index, 'Q'))
+    # Tiny universes can leave a portfolio empty (NaN factor); timings only
+    # need the shapes, so those are zero-filled
+    market = returns.mean(axis=1)
+    X = factors[['SMB', 'HML']].assign(excess_return=market)[['excess_return', 'SMB', 'HML']].fillna(0.0)
+    X.insert(0, 'const', 1.0)
+    return {'universe': universe, 'sector_prices': sector_prices, 'prices': prices,
+            'returns': returns, 'fundamentals': fundamentals, 'X': X}
+#end def
+
+def benchInsertPrepare(ctx):
+    from SchemaUtils import SchemaUtils, CopyChunkReader, COPY_CHUNK_ROWS
+    schema = SchemaUtils(storage='wide')
+    for df in ctx['sector_prices'].values():
+        reader = CopyChunkReader(schema.iterBinaryChunks(df, COPY_CHUNK_ROWS))
+        while reader.read(1 << 20):
+            pass
+        #end while
+    #end for
+#end def
+
+def benchInsertDb(ctx):
+    schema = ctx['schema']
+    for sector, df in ctx['sector_prices'].items():
+        table_name = 'bench_'+sector.lower()
+        schema.executeCreateTableStatement(columns=df.columns.tolist(), table_name=table_name, index='date')
+        schema.executeInsertStatement(df, table_name, 'date')
+    #end for
+#end def
+
+def benchSelectDb(ctx):
+    schema = ctx['schema']
+    for sector in ctx['sector_prices']:
+        schema.executeSelectStatement('bench_'+sector.lower(), 'date')
+    #end for
+#end def
+
+def benchAssemble(ctx):
+    PanelUtils().alignFrames(list(ctx['sector_prices'].values()))
+#end def
+
+def benchAssemblePanel(ctx):
+    PricePanel.concat([PricePanel.fromFrame(df) for df in ctx['sector_prices'].values()])
+#end def
+
+def benchQuality(ctx):
+    if 'panel' not in ctx:
+        ctx['panel'] = PricePanel.fromFrame(ctx['prices'])
+    #end if
+    DataQuality().check(ctx['panel'])
+#end def
+
+def benchFactors(ctx):
+    factor = FactorUtils()
+    returns = ctx['returns']
+    factor.buildFactors(returns, ctx['fundamentals'], factor.rebalanceDates(returns.index, 'Q'))
+#end def
+
+def benchRegression(ctx):
+    with np.errstate(all='ignore'):
+        RegressionUtils().fitParams(ctx['returns'], ctx['X'], list(ctx['prices'].columns))
+    #end with
+#end def
+
+def benchSignificance(ctx):
+    Y = ctx['returns'].to_numpy()
+    X = ctx['X'].to_numpy()
+    significance = SignificanceUtils(max_workers=1)
+    with np.errstate(all='ignore'):
+        significance.hac(Y, X)
+        significance.bootstrap(Y, X, draws=500)
+    #end with
+#end def
+
+def benchSelection(ctx):
+    if 'params' not in ctx:
+        with np.errstate(all='ignore'):
+            params = RegressionUtils().fitParams(ctx['returns'], ctx['X'], list(ctx['prices'].columns))
+        #end with
+        ctx['params'] = params.rename(columns={'const': 'alpha'})
+    #end if
+    selection = SelectionUtils()
+    selection.selectTop(selection.computeObjective(ctx['params']), 10)
+#end def
+
+def benchSweep(ctx):
+    if 'params' not in ctx:
+        benchSelection(ctx)
+    #end if
+    params = ctx['params']
+    prices = ctx['prices'].iloc[-1]
+    grid = {'w_fit': list(np.linspace(0.0, 0.5, 10)), 'outlier_sigma': [3, 4, 6, 8, 10],
+            'N': [5, 10, 20, 50], 'inv_amount': [10000, 25000, 50000, 100000, 250000]}
+    ParameterSweep(params).run(grid, prices)
+#end def
+
+BENCHMARKS = [('insert_prepare', benchInsertPrepare),
+              ('insert_db', benchInsertDb),
+              ('select_db', benchSelectDb),
+              ('assemble', benchAssemble),
+              ('assemble_panel', benchAssemblePanel),
+              ('quality', benchQuality),
+              ('factors', benchFactors),
+              ('regression', benchRegression),
+              ('significance', benchSignificance),
+              ('selection', benchSelection),
+              ('sweep', benchSweep)]
+
+# Best-of-repeat wall time and peak traced memory of fn(ctx)
+def measure(fn, ctx, repeat):
+    fn(ctx)  # warm-up, also fills lazily built inputs
+    best = math.inf
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(ctx)
+        best = min(best, time.perf_counter() - start)
+    #end for
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    #end try
+    return best, peak
+#end def
+
+def connectSchema():
+    try:
+        from SchemaUtils import SchemaUtils
+        schema = SchemaUtils(storage='wide')
+        schema.getConnection().close()
+        return schema
+    except Exception as e:
+        print('No database available, skipping database benchmarks ('+str(e).strip()+')')
+        return None
+    #end try
+#end def
+
+def dropTables(schema, ctx):
+    with schema.connection() as conn, conn.cursor() as cursor:
+        for sector in ctx['sector_prices']:
+            cursor.execute('DROP TABLE IF EXISTS price_data.bench_'+sector.lower())
+        #end for
+    #end with
+#end def
+
+# Runs every benchmark for every size
+# Outputs
+#    {'<symbols>x<days>': {benchmark: {'seconds': ..., 'peak_bytes': ...}}}
+def runSuite(sizes, days=252, sectors=None, nan_density=0.01, repeat=3, use_db=True, out=sys.stdout):
+    schema = connectSchema() if use_db else None
+    results = {}
+    for size in sizes:
+        symbols = resolveSize(size)
+        # Keep every sector table under the 1600-column Postgres limit
+        n_sectors = sectors or max(12, int(math.ceil(symbols / 1400)))
+        ctx = buildContext(symbols, days, n_sectors, nan_density)
+        ctx['schema'] = schema
+        key = str(symbols)+'x'+str(days)
+        results[key] = {}
+        out.write('%s symbols x %s days, %s sectors\n' % (symbols, days, n_sectors))
+        for name, fn in BENCHMARKS:
+            if name.endswith('_db') and schema is None:
+                continue
+            #end if
+            try:
+                seconds, peak = measure(fn, ctx, repeat)
+            except ImportError as e:
+                out.write('  %-15s skipped (%s)\n' % (name, e))
+                continue
+            #end try
+            results[key][name] = {'seconds': seconds, 'peak_bytes': peak}
+            out.write('  %-15s %9.4fs  %9.1f MiB peak\n' % (name, seconds, peak / 2**20))
+        #end for
+        if schema is not None:
+            dropTables(schema, ctx)
+        #end if
+    #end for
+    return results
+#end def
+
+# Benchmarks slower than their baseline by more than threshold
+# Outputs
+#    list of (size, benchmark, seconds, baseline seconds)
+def compare(results, baselines, threshold):
+    regressions = []
+    for key, benches in results.items():
+        for name, result in benches.items():
+            base = baselines.get(key, {}).get(name)
+            if base is None:
+                continue
+            #end if
+            if result['seconds'] > MIN_COMPARABLE_SECONDS and result['seconds'] > threshold * base['seconds']:
+                regressions.append((key, name, result['seconds'], base['seconds']))
+            #end if
+        #end for
+    #end for
+    return regressions
+#end def
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='smol,1000,full,10000,20000',
+                        help="comma-separated symbol counts; 'smol' and 'full' use the universe files")
+    parser.add_argument('--days', type=int, default=252)
+    parser.add_argument('--sectors', type=int, default=None)
+    parser.add_argument('--nan-density', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='fail if a benchmark takes more than this times its baseline')
+    parser.add_argument('--skip-db', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = runSuite(args.sizes.split(','), args.days, args.sectors, args.nan_density,
+                       args.repeat, not args.skip_db)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+        #end with
+    #end if
+    if args.save_baseline:
+        for key, benches in results.items():
+            baselines.setdefault(key, {}).update(benches)
+        #end for
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        #end with
+        print('Baselines written to '+args.baseline)
+        return 0
+    #end if
+
+    regressions = compare(results, baselines, args.threshold)
+    for key, name, seconds, base in regressions:
+        print('REGRESSION %s %s: %.4fs vs baseline %.4fs (x%.2f)' % (key, name, seconds, base, seconds / base))
+    #end for
+    return 1 if regressions else 0
+#end def
+
+if __name__ == "__main__":
+    sys.exit(main())
+#end if
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the synthetic universe layout and the suite's report on a small size
+"""
+
+import io
+import pandas as pd
+from synthetic import makeUniverse, makeSectorPrices, DATA_DIR, COLUMNS
+from bench_suite import runSuite, compare
+
+def test_universe_matches_asset_universe_layout():
+    real = pd.read_csv(DATA_DIR+'/asset_universe.csv', nrows=5)
+    universe = makeUniverse(300, sectors=14)
+    assert list(universe.columns) == list(real.columns) == COLUMNS
+    assert universe['Sector'].nunique() == 14
+    prices = makeSectorPrices(universe, days=30, nan_density=0.1)
+    assert sum(df.shape[1] for df in prices.values()) == 300
+    assert 0.05 < pd.concat(prices.values(), axis=1).isna().mean().mean() < 0.15
+
+def test_suite_reports_and_flags_slowdowns():
+    results = runSuite(['200'], days=60, repeat=1, use_db=False, out=io.StringIO())
+    benches = results['200x60']
+    assert {'assemble', 'factors', 'regression', 'selection'} <= set(benches)
+    assert all(b['seconds'] > 0 and b['peak_bytes'] > 0 for b in benches.values())
+
+    baselines = {'200x60': {'regression': {'seconds': benches['regression']['seconds'] / 10}}}
+    slow = {'200x60': {'regression': {'seconds': 1.0}}}
+    assert compare(results, {}, 1.5) == []
+    assert compare(slow, baselines, 1.5)[0][:2] == ('200x60', 'regression')
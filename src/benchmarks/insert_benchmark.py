@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the COPY and execute_values insert paths of SchemaUtils on a
+synthetic 7000-symbol x 250-day frame.
+
+Client-side preparation (building Python row lists vs. rendering binary COPY
+chunks) is always timed. If a database is reachable the full round trip is timed as
+well; because Postgres caps tables at 1600 columns, the frame is written as
+several 1400-column tables, the same way sectors split the real universe.
+
+Usage (from src/):
+    python benchmarks/insert_benchmark.py [symbols] [days]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from SchemaUtils import SchemaUtils, CopyChunkReader, COPY_CHUNK_ROWS
+
+def syntheticFrame(symbols=7000, days=250, nan_fraction=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    values = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, size=(days, symbols)), axis=0))
+    values[rng.random(values.shape) < nan_fraction] = np.nan
+    dates = pd.bdate_range('2021-01-07', periods=days).strftime('%Y-%m-%d')
+    columns = ['s'+str(i) for i in range(symbols)]
+    return pd.DataFrame(values, index=pd.Index(dates, name='date'), columns=columns)
+#end def
+
+def timeIt(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+#end def
+
+def prepareValues(df):
+    df_values = df.values.tolist()
+    for i in range(len(df_values)):
+        df_values[i].insert(0, df.index.values[i])
+    #end for
+    return df_values
+#end def
+
+def prepareCopy(schema, df):
+    reader = CopyChunkReader(schema.iterBinaryChunks(df, COPY_CHUNK_ROWS))
+    while reader.read(1 << 20):
+        pass
+    #end while
+#end def
+
+def main(symbols=7000, days=250):
+    schema = SchemaUtils()
+    df = syntheticFrame(symbols, days)
+    print('Frame: '+str(days)+' rows x '+str(symbols)+' columns')
+    print('prepare  row lists     : %.3fs' % timeIt(lambda: prepareValues(df)))
+    print('prepare  binary copy   : %.3fs' % timeIt(lambda: prepareCopy(schema, df)))
+
+    try:
+        schema.getConnection().close()
+    except Exception as e:
+        print('No database available, skipping round trip ('+str(e).strip()+')')
+        return
+    #end try
+    blocks = [df.iloc[:, i:i+1400] for i in range(0, symbols, 1400)]
+    for method in ['values', 'copy']:
+        elapsed = 0.0
+        for k, block in enumerate(blocks):
+            table_name = 'bench_insert_'+str(k)
+            schema.executeCreateTableStatement(columns=block.columns.tolist(), table_name=table_name, index='date')
+            elapsed += timeIt(lambda: schema.executeInsertStatement(block, table_name, 'date', method=method))
+        #end for
+        print('database %-14s: %.3fs' % (method, elapsed))
+    #end for
+    with schema.connection() as conn, conn.cursor() as cursor:
+        for k in range(len(blocks)):
+            cursor.execute('DROP TABLE IF EXISTS price_data.bench_insert_'+str(k))
+        #end for
+    #end with
+    print('pool: '+str(schema.getPoolStats()))
+#end def
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
+#end if
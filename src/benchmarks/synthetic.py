@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic stock universes for the benchmarks.
+
+makeUniverse produces a table with the columns of data/asset_universe.csv,
+so it can stand in for SchemaUtils.getTickers(). makeSectorPrices and
+makeFundamentals produce the per-sector price tables and the fundamentals
+table the updater would have written for that universe.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+# Sector names as they appear in asset_universe.csv
+SECTORS = ['Finance', 'Health Care', 'Consumer Services', 'Technology', 'Capital Goods',
+           'Energy', 'Consumer Non-Durables', 'Public Utilities', 'Basic Industries',
+           'Miscellaneous', 'Consumer Durables', 'Transportation']
+
+COLUMNS = ['Symbol', 'Name', 'Last Sale', 'Net Change', '% Change', 'Market Cap',
+           'Country', 'IPO Year', 'Volume', 'Sector', 'Industry']
+
+# Number of symbols with a sector in one of the universe files ('smol' or
+# 'full'), the part of the universe the updater actually loads
+def universeSize(name):
+    path = os.path.join(DATA_DIR, 'asset_universe_smol.csv' if name == 'smol' else 'asset_universe.csv')
+    return int(pd.read_csv(path, encoding='utf-8-sig')['Sector'].notna().sum())
+#end def
+
+# Inputs
+#    symbols : number of symbols
+#    sectors : number of sectors; beyond the 12 real names, sectors are
+#              numbered ('Sector 13', ...) so wide tables stay under the
+#              1600-column Postgres limit for large universes
+# Outputs
+#    DataFrame laid out like asset_universe.csv, Sector normalized the way
+#    SchemaUtils.getTickers does (spaces and dashes to underscores)
+def makeUniverse(symbols, sectors=12, seed=0):
+    rng = np.random.default_rng(seed)
+    names = (SECTORS + ['Sector '+str(i+1) for i in range(len(SECTORS), sectors)])[:sectors]
+    symbol = ['x'+str(i) for i in range(symbols)]
+    last = np.round(rng.lognormal(3, 1, symbols), 2)
+    change = np.round(rng.normal(0, 0.02, symbols) * last, 2)
+    universe = pd.DataFrame({
+        'Symbol': symbol,
+        'Name': [s.upper()+' Inc. Common Stock' for s in symbol],
+        'Last Sale': ['$%.2f' % v for v in last],
+        'Net Change': change,
+        '% Change': ['%.3f%%' % v for v in 100 * change / last],
+        'Market Cap': np.round(rng.lognormal(20, 2, symbols), 2),
+        'Country': 'United States',
+        'IPO Year': rng.integers(1980, 2022, symbols).astype(float),
+        'Volume': rng.integers(1000, 10000000, symbols),
+        'Sector': np.array(names)[rng.integers(0, len(names), symbols)],
+        'Industry': 'Synthetic'}, columns=COLUMNS)
+    universe['Sector'] = universe['Sector'].str.replace('[ -]', '_', regex=True)
+    return universe
+#end def
+
+# Inputs
+#    universe    : output of makeUniverse
+#    days        : trading days of history ending at end
+#    nan_density : fraction of prices missing at random
+# Outputs
+#    {sector: DataFrame of closes indexed by 'YYYY-MM-DD' strings, one
+#    column per symbol}, the layout of the price_data.<sector> tables
+def makeSectorPrices(universe, days=252, nan_density=0.01, end='2022-01-07', seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.Index(pd.bdate_range(end=end, periods=days).strftime('%Y-%m-%d'), name='date')
+    market = rng.normal(0.0003, 0.01, days)
+    prices = {}
+    for sector, members in universe.groupby('Sector', sort=False):
+        n = len(members)
+        beta = rng.uniform(0.5, 1.5, n)
+        returns = np.outer(market, beta) + rng.normal(0, 0.015, (days, n))
+        values = 50 * np.exp(np.cumsum(returns, axis=0))
+        values[rng.random(values.shape) < nan_density] = np.nan
+        prices[sector] = pd.DataFrame(values, index=dates, columns=members['Symbol'].str.lower().tolist())
+    #end for
+    return prices
+#end def
+
+# The fundamentals table for the universe: symbol, marketcap, booktomarket
+def makeFundamentals(universe, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'symbol': universe['Symbol'].str.lower().to_numpy(),
+                         'marketcap': universe['Market Cap'].to_numpy(),
+                         'booktomarket': rng.lognormal(-0.7, 0.6, len(universe))})
+#end def
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+The fama-french command.
+
+    fama-french update {fundamentals,prices,all} [--incremental] [--restart]
+    fama-french analyze [--no-save] [--residuals] [parameters]
+    fama-french allocate [parameters]
+    fama-french explain [stage ...] [parameters]
+    fama-french sweep [--n 5 10 20] [--w-fit 0.0008 0.01] [...] [--out FILE]
+    fama-french runs [--limit N] [--symbol SYMBOL]
+
+Only argparse is imported up front. Each subcommand imports what it needs
+(the TD client and the database for update, pandas, scipy and the
+reference downloads for the analysis) when it runs, so --help and the light
+subcommands start at once. Parameters not given on the command line keep
+their FamaFrenchPipeline.DEFAULT_PARAMS values.
+"""
+
+import argparse
+import sys
+
+# Pipeline parameters settable from the command line: (flag, name, type)
+PARAMETERS = [
+    ('--inv-amount', 'inv_amount', float),
+    ('--n', 'N', int),
+    ('--start', 'start', str),
+    ('--end', 'end', str),
+    ('--rebalance-freq', 'rebalance_freq', str),
+    ('--w-fit', 'w_fit', float),
+    ('--w-alpha', 'w_alpha', float),
+    ('--min-alpha-t', 'min_alpha_t', float),
+]
+
+def addParameters(parser):
+    group = parser.add_argument_group('analysis parameters')
+    for flag, name, kind in PARAMETERS:
+        group.add_argument(flag, dest=name, type=kind, default=None, metavar=name.upper())
+    #end for
+    group.add_argument('--rolling-windows', dest='rolling_windows', type=int, nargs='*', default=None,
+                       metavar='DAYS', help='window lengths of the rolling regressions')
+    group.add_argument('--bootstrap', dest='bootstrap', type=int, default=None, metavar='DRAWS',
+                       help='add block-bootstrap intervals from this many draws')
+#end def
+
+# Selection parameters a sweep takes lists of: (flag, name, type)
+SWEEP_PARAMETERS = [
+    ('--n', 'N', int),
+    ('--inv-amount', 'inv_amount', float),
+    ('--w-fit', 'w_fit', float),
+    ('--w-alpha', 'w_alpha', float),
+    ('--outlier-sigma', 'outlier_sigma', float),
+    ('--min-alpha-t', 'min_alpha_t', float),
+    ('--max-volatility', 'max_volatility', float),
+]
+
+# Parameters given on the command line, to pass to the pipeline as overrides
+def getOverrides(args):
+    names = [name for flag, name, kind in PARAMETERS] + ['rolling_windows']
+    overrides = {name: getattr(args, name) for name in names if getattr(args, name, None) is not None}
+    if getattr(args, 'bootstrap', None) is not None:
+        overrides['significance'] = {'draws': args.bootstrap}
+    #end if
+    return overrides
+#end def
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='fama-french',
+                                     description='Fama-French 3-factor stock selection.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    update = commands.add_parser('update', help='fetch fundamentals and prices into the database')
+    update.add_argument('target', choices=['fundamentals', 'prices', 'all'])
+    update.add_argument('--incremental', action='store_true',
+                        help='refetch only stale fundamentals and prices after the last stored date')
+    update.add_argument('--restart', action='store_true',
+                        help='start over instead of resuming an interrupted job')
+    update.add_argument('--workers', type=int, default=4, help='API requests kept in flight')
+    update.set_defaults(handler=runUpdateCommand)
+
+    analyze = commands.add_parser('analyze', help='run the regressions and shortlist, and save the run')
+    addParameters(analyze)
+    analyze.add_argument('--no-save', dest='save', action='store_false',
+                         help='do not write the run to the results store')
+    analyze.add_argument('--residuals', action='store_true', help='also store the residual matrix')
+    analyze.set_defaults(handler=runAnalyzeCommand)
+
+    allocate = commands.add_parser('allocate', help='allocate the capital over the shortlist')
+    addParameters(allocate)
+    allocate.set_defaults(handler=runAllocateCommand)
+
+    explain = commands.add_parser('explain', help='show which stages are cached and which would run')
+    explain.add_argument('stages', nargs='*', default=['allocation', 'rolling'], metavar='stage')
+    addParameters(explain)
+    explain.set_defaults(handler=runExplainCommand)
+
+    sweep = commands.add_parser('sweep', help='shortlists and costs over a grid of selection parameters')
+    grid = sweep.add_argument_group('grid (every combination is evaluated)')
+    for flag, name, kind in SWEEP_PARAMETERS:
+        grid.add_argument(flag, dest=name, type=kind, nargs='+', default=None, metavar=name.upper())
+    #end for
+    for flag in ('--start', '--end', '--rebalance-freq'):
+        sweep.add_argument(flag, default=None)
+    #end for
+    sweep.add_argument('--out', default=None, help='write the table as CSV instead of printing it')
+    sweep.set_defaults(handler=runSweepCommand)
+
+    runs = commands.add_parser('runs', help='list saved runs, or one symbol across runs')
+    runs.add_argument('--limit', type=int, default=20)
+    runs.add_argument('--symbol', default=None, help='show this symbol\'s alpha across runs')
+    runs.set_defaults(handler=runRunsCommand)
+    return parser
+#end def
+
+def runUpdateCommand(args):
+    from DBUpdateScript import runUpdate
+    targets = ['fundamentals', 'prices'] if args.target == 'all' else [args.target]
+    runUpdate(targets, incremental=args.incremental, restart=args.restart, max_workers=args.workers)
+#end def
+
+def runAnalyzeCommand(args):
+    from FamaFrenchPipeline import FamaFrenchPipeline
+    overrides = getOverrides(args)
+    ff = FamaFrenchPipeline()
+    ff.printQuality(**overrides)
+    print(ff.run('shortlist', **overrides))
+    if args.save:
+        run_id = ff.saveResults(residuals=args.residuals, **overrides)
+        print("Saved as run " + str(run_id))
+    #end if
+#end def
+
+def runAllocateCommand(args):
+    from FamaFrenchPipeline import FamaFrenchPipeline
+    allocation = FamaFrenchPipeline().run('allocation', **getOverrides(args))
+    print(allocation)
+    print("Total Portfolio Cost = $" + str(round(allocation.sum()['Subtotal'],2)))
+#end def
+
+def runExplainCommand(args):
+    from FamaFrenchPipeline import FamaFrenchPipeline
+    FamaFrenchPipeline().printExplain(args.stages, **getOverrides(args))
+#end def
+
+def runSweepCommand(args):
+    from FamaFrenchPipeline import FamaFrenchPipeline
+    grid = {name: getattr(args, name) for flag, name, kind in SWEEP_PARAMETERS
+            if getattr(args, name) is not None}
+    # The grid flags share names with the single-valued parameters, so only
+    # the data window is passed on as overrides
+    overrides = {name: getattr(args, name) for name in ('start', 'end', 'rebalance_freq')
+                 if getattr(args, name) is not None}
+    table = FamaFrenchPipeline().sweep(grid, **overrides)
+    if args.out is not None:
+        table.to_csv(args.out, index=False)
+        print(str(len(table))+' configurations written to '+args.out)
+    else:
+        print(table.to_string())
+    #end if
+#end def
+
+def runRunsCommand(args):
+    from ResultsStore import ResultsStore
+    store = ResultsStore()
+    if args.symbol is not None:
+        print(store.getHistory(args.symbol.lower()))
+    else:
+        print(store.getRuns(limit=args.limit))
+    #end if
+#end def
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    args.handler(args)
+    return 0
+#end def
+
+if __name__ == "__main__":
+    sys.exit(main())
+#end if
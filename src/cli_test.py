@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the command's parsing and that its subcommands import their
+modules lazily
+"""
+
+import subprocess
+import sys
+import pytest
+import cli
+
+def imported_after(statement):
+    code = statement + '; import sys; print(" ".join(sorted(sys.modules)))'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return set(out.stdout.split())
+
+def test_help_imports_no_heavy_modules():
+    modules = imported_after('import cli\ntry:\n    cli.main(["--help"])\nexcept SystemExit:\n    pass')
+    assert not modules & {'pandas', 'numpy', 'scipy', 'psycopg2', 'td', 'requests'}
+
+def test_importing_the_updater_does_not_load_td_or_connect():
+    modules = imported_after('import DBUpdateScript')
+    assert not modules & {'td', 'requests'}
+    modules = imported_after('import DBUpdateScript; DBUpdateScript.DBUpdateScript()')
+    assert not modules & {'td', 'requests'}
+
+def test_only_given_parameters_are_overrides():
+    args = cli.buildParser().parse_args(['allocate', '--n', '15', '--rolling-windows', '60', '126'])
+    assert cli.getOverrides(args) == {'N': 15, 'rolling_windows': [60, 126]}
+
+def test_update_targets_reach_the_updater(monkeypatch):
+    calls = []
+    import DBUpdateScript
+    monkeypatch.setattr(DBUpdateScript, 'runUpdate', lambda targets, **kwargs: calls.append((targets, kwargs)))
+    cli.main(['update', 'prices', '--incremental'])
+    assert calls == [(['prices'], {'incremental': True, 'restart': False, 'max_workers': 4})]
+
+def test_unknown_subcommand_is_rejected():
+    with pytest.raises(SystemExit):
+        cli.main(['backtest'])
+
+def test_sweep_takes_lists_and_keeps_them_out_of_the_overrides(monkeypatch):
+    calls = []
+    import FamaFrenchPipeline
+    class FakePipeline:
+        def sweep(self, grid, **overrides):
+            calls.append((grid, overrides))
+            return FamaFrenchPipeline.pd.DataFrame({'N': [5, 10]})
+    monkeypatch.setattr(FamaFrenchPipeline, 'FamaFrenchPipeline', FakePipeline)
+    cli.main(['sweep', '--n', '5', '10', '--w-fit', '0.0008', '--start', '2021-01-07'])
+    assert calls == [({'N': [5, 10], 'w_fit': [0.0008]}, {'start': '2021-01-07'})]
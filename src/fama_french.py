@@ -26,16 +26,7 @@
 
 #%%######################## Import modules ####################################
 
-import pandas as pd
-import math
-import nasdaqdatalink as ndl
-import statsmodels.api as sm
-
-import numpy as np
-from TDA.config import QUANDL_TOKEN
-from SchemaUtils import SchemaUtils
-from DBUpdateScript import DBUpdateScript
-import yfinance as yf
+from FamaFrenchPipeline import FamaFrenchPipeline
 
 
 #%%####################### Define constants ###################################
@@ -46,257 +37,111 @@ inv_amount = 10000
 # Number of stocks to include in portfolio
 N = 10
 
-#%%####################### Function definitions ###############################
-
-# Given a list of symbols in a portfolios, returns the price of the value-
-# weighted portfolio of the symbols. For example, if list_of_symbols contains
-# ["GOOG","AAPL"], returns the price of GOOG + AAPL (one share each)
-def get_portfolio_prices(list_of_symbols, prices_df):
-    j = 1
-    x = 0
-    for sym in list_of_symbols:
-        if sym in prices_df.columns:
-            if sym == "BRK/B":
-                sym = "BRK.B"
-            #end if
-            if j == 1:
-                x = prices_df[sym]
-            else:
-                x = x + prices_df[sym]
-            #end if
-            j = j + 1
-        #end if
-    #end for
-    return x
-#end def
-    
-# Get daily risk-free rate of return
-def yearly_to_daily(yearly_rate):
-    return (1 + yearly_rate) ** (1/360) - 1
-#end def
+# Rebalance the Fama-French portfolios at the start of every period of this
+# length ('M', 'Q' or 'Y'). None holds the initial portfolios for the whole
+# sample.
+rebalance_freq = None
 
-#%%#################### Construct Portfolios ##################################
+# Window lengths (trading days) for rolling factor loadings, e.g. [60, 126].
+# Leave empty to skip the rolling regressions.
+rolling_windows = []
 
-schema = SchemaUtils()
-fundamentals=schema.executeSelectStatement('fundamentals',None)
-#fundamentals['symbol']=fundamentals['symbol'].str.lower()
-[x.lower() for x in ["A", "B", "C"]]
-fundamentals['symbol']= [x.lower() for x in schema.removeKeywordsFromSymbols(fundamentals['symbol'].tolist())]
-
-# If values are zero, we don't care about them
-subFund = fundamentals[abs(fundamentals.booktomarket) > 0.00001]
-subFund = subFund[subFund.marketcap > 0.0001]
-
-# Get percentiles for determining Fama-French portfolios
-n = subFund.shape[0]
-pc10 = math.floor(n/10)
-pc30 = pc10 * 3
-pc70 = pc10 * 7
-pc90 = pc10 * 9
-
-# Sort by Book to Market Ratio, construct growth, neutral, and value portfolios
-bm = subFund.sort_values('booktomarket')
-growth = bm.iloc[0:pc30]
-neutral = bm.iloc[pc30:pc70]
-value = bm.iloc[pc70:n]
-
-# Sort by market cap, construct small and big portfolios
-mc = subFund.sort_values('marketcap')
-small = mc.iloc[0:pc10]
-big = mc.iloc[pc90:n]
-
-# Create the six Fama-French portfolios
-sg = pd.merge(small, growth, how='inner')['symbol']
-sn = pd.merge(small, neutral, how='inner')['symbol']
-sv = pd.merge(small, value, how='inner')['symbol']
-bg = pd.merge(big, growth, how='inner')['symbol']
-bn = pd.merge(big, neutral, how='inner')['symbol']
-bv = pd.merge(big, value, how='inner')['symbol']
+# Every stage result is cached (in memory and under cache/pipeline), keyed by
+# the parameters and data it depends on. After changing a constant above,
+# rerun this cell and then any cell below; only the stages downstream of the
+# change are recomputed.
+settings = {'inv_amount': inv_amount, 'N': N, 'rebalance_freq': rebalance_freq,
+            'rolling_windows': rolling_windows}
 
-#%%#################### Get Prices ##################################
+#%%####################### Set up pipeline ####################################
 
-update = DBUpdateScript()
-td_client = update.login()        
-sector_list = schema.getSectorList()
-firstPrices = True
-for sector in sector_list:
-    price = schema.executeSelectStatement(sector,'date')
-    if not price.empty:
-        if firstPrices:
-            prices = price
-            firstPrices = False
-        else:
-            prices = pd.merge(prices, price, how='outer',left_index=True,
-                              right_index=True) 
-    else:
-        print('Dataset price_data.'+sector+' is empty. Rerun the DBUpdateScript to get this data.')
-
-prices.rename(columns={'date_x':'date'},inplace = True)
-
-# Get prices for value-weighted Fama-French portfolios
-prices['sg'] = get_portfolio_prices(sg, prices)
-prices['sn'] = get_portfolio_prices(sn, prices)  
-prices['sv'] = get_portfolio_prices(sv, prices)
-prices['bg'] = get_portfolio_prices(bg, prices)
-prices['bn'] = get_portfolio_prices(bn, prices)
-prices['bv'] = get_portfolio_prices(bv, prices)
-
-today = '2022-01-07'
-epoch_today = update.get_latest_date(prices, '2022-01-07')
-
-# Get the market portfolio price (NASDAQ + NYSE + XMI)
-nasdaq = yf.download("^NDX", start="2021-01-07", end="2022-01-07");
-nasdaq = nasdaq[['Close']]
-nasdaq = nasdaq.rename(columns={'Close':'NDX'})
-prices = pd.merge(prices,nasdaq,how='outer',left_index=True,right_index=True)
-
-nyse = yf.download("^NYA", start="2021-01-07", end="2022-01-07");
-nyse = nyse[['Close']]
-nyse = nyse.rename(columns={'Close':'NYA'})
-prices = pd.merge(prices,nyse,how='outer',left_index=True,right_index=True)
-
-xmi = yf.download("^XMI", start="2021-01-07", end="2022-01-07");
-xmi = xmi[['Close']]
-xmi = xmi.rename(columns={'Close':'XMI'})
-prices = pd.merge(prices,xmi,how='outer',left_index=True,right_index=True)
-
-prices['market']=prices['NDX']+prices['NYA']+prices['XMI']
+ff = FamaFrenchPipeline()
 
-#%%####################### Calculate returns ##################################
+# Dry run: which stages are cached and which will be computed
+ff.printExplain(['portfolios', 'allocation', 'rolling'], **settings)
 
-# Calculate returns
-returns = prices.pct_change()
-vol = prices.pct_change().std()*(252**0.5)
-#print(vol)
-vol = vol.where(vol < 0.2)
-returns = returns.drop(returns.index[0]) #First row is always NaN, just drop
-returns = returns.filter(items=vol.index)
+#%%#################### Construct Portfolios ##################################
 
-# Get the daily risk-free rate of return
-tbill = ndl.get("USTREASURY/BILLRATES", authtoken=QUANDL_TOKEN).tail(250)
-tbill = tbill[['52 Wk Bank Discount Rate']]
-tbill = tbill.rename(columns={'52 Wk Bank Discount Rate':'riskFreeRate'})
+# Assign symbols to the six size/value portfolios (small/big x growth/
+# neutral/value). Weights are by market cap and are built when the factor
+# returns are calculated below.
+members = ff.run('portfolios', **settings)
+for name, group in members[members['size'] != ''].groupby(members['size'] + members['value']):
+    print(name + ': ' + str(len(group)) + ' symbols')
+#end for
 
-# TODO: Do we need to divide by 100 here???
-tbill['riskFreeRate'] = (tbill['riskFreeRate']).apply(yearly_to_daily)
+#%%#################### Get Prices ##################################
 
-returns = pd.merge(returns,tbill,how='outer',left_index=True,right_index=True)
+# Sector tables from the database, plus the market index (NASDAQ + NYSE +
+# XMI) and the daily risk-free rate
+prices = ff.run('prices', **settings)
+market = ff.run('market', **settings)
 
-# Get excess return of the market over the risk-free rate
-returns['excess_return'] = returns['market'] - returns['riskFreeRate']
+#%%####################### Check data quality ##################################
 
-# Calculate SMB and HML returns
-returns['SMB'] = (1/3)*(returns['sg']+returns['sn']+returns['sv']) - \
-                 (1/3)*(returns['bg']+returns['bn']+returns['bv'])
+# Missing data, gaps, stale prices, return outliers and volatility of every
+# symbol. Symbols that break a rule (DataQuality.DEFAULT_RULES, overridden
+# with settings['quality']) are left out of the analysis as a whole
+ff.printQuality(**settings)
 
-returns['HML'] = (1/2)*(returns['sv']+returns['bv']) - \
-                 (1/2)*(returns['sg']+returns['bg'])
+#%%####################### Calculate returns ##################################
 
+# Returns of every symbol, value-weighted Fama-French SMB and HML, and the
+# excess return of the market over the risk-free rate
+returns = ff.run('returns', **settings)
 
 #%%#################### Run linear regressions ################################
 
-# Use linear interpolation to fill missing data
-returns = returns.interpolate(method='linear',limit_direction='forward',axis=0)
-returns = returns.dropna()
-
-X = returns[['excess_return', 'SMB', 'HML']]
-X = sm.add_constant(X)
-
-#Get rid of date
-prices_columns = prices.columns[1:]
-returns_columns = returns.columns[1:]
-np.seterr(all='raise')
-k=1
-for sym in prices_columns:
-    if sym in returns_columns:
-        y = returns[sym]
-        try:
-           model = sm.OLS(y,X).fit()
-        except ValueError as e:  #raised if `y` is empty.
-            print('Invalid value!!!')
-            print(e)
-        paramdict = model.params.to_dict()
-        paramdict['symbol'] = sym
-        try:
-            paramdict['rsquared'] = model.rsquared
-        except FloatingPointError as e:
-            print('Division by zero.. skipping ticker '+sym)
-            print(e)
-        paramdict['error'] = model.resid
-        df = pd.DataFrame(paramdict, index=[k-1])
-        if k == 1:
-            params = df
-        else:
-            params = params.append(df)
-        #end if
-        k = k + 1
-    #end if
-#end for
-    
-params = params.rename(columns={'excess_return':'beta_market','SMB':'beta_smb',
-                                'HML':'beta_hml','const':'alpha'})
-#params = params.sort_values(by='alpha',ascending=False)
+# Every symbol fitted in one batched pass
+params = ff.run('regressions', **settings)
 
-#not_in = ['market','NDX','XMI','NYA','bg','bn','bv','sg','sn','sv']
-not_in = ['market','QQQ','ONEQ','DIA','bg','bn','bv','sg','sn','sv']
+#%%####################### Rolling factor loadings ############################
 
-params=params[~params['symbol'].isin(not_in)]
+# For every window length: a date x symbol x coefficient array with
+# coefficients in (const, excess_return, SMB, HML) order
+rolling_params = ff.run('rolling', **settings)
 
 #%%####################### Maximize both alpha and rsquared ##################
 
+# Weights for optimization and the outlier cut are SelectionUtils' defaults
+# (w_fit = 0.0008, w_alpha = 0.9992, alpha within 6 std of the mean)
+params = ff.run('objective', **settings)
 
-max_fit = params.max()['rsquared']
-max_alpha = params.max()['alpha']
-
-
-# Weights for optimization
-w_fit = 0.0008
-w_alpha = 0.9992
-
-std = params.std()['alpha']
-mean = params.mean()['alpha']
-
-params['std_from_mean'] = round(abs(params['alpha']-mean)/std,ndigits=2)
-
-# Drop outliers where alpha is more than 6 std from the mean
-
-params = params[params['std_from_mean'] < 6]
-
-# Calculate objective function
-
-params['objective'] = w_fit*(params['rsquared']-max_fit)**2 + w_alpha*(params['alpha']-max_alpha)**2
-
-params.to_excel('results.xlsx')
+# Newey-West t-statistics of every alpha and beta (daily returns are
+# autocorrelated, so the plain OLS errors are too small). Set
+# settings['significance'] = {'draws': 2000} for block-bootstrap intervals
+# as well, and settings['min_alpha_t'] = 2 to rank only significant alphas
+significance = ff.run('significance', **settings)
 
 # Minimize objective function to maximize combination of alpha and rsquared
-params = params.sort_values(by='objective')
-
-shortlist = params.head(N)
+shortlist = ff.run('shortlist', **settings)
 print(shortlist)
 
    
    
 #%%######################### Allocate Assets ##################################
 
-target = inv_amount / N
-
-allocation = {}
-current_prices = {}
-symbols = list(shortlist['symbol'])
-shortlist = shortlist.set_index('symbol')
-    
-for asset in symbols:
-    current_prices[asset] = list(prices[asset])[-1]
-    allocation[asset] = round(target / current_prices[asset])
-    
-allocation = pd.DataFrame(allocation, index=['Number of Shares']).transpose()
-current_prices = pd.DataFrame(current_prices, index=['Current Price']).transpose()
-
-allocation = allocation.join(current_prices)
-allocation['Subtotal'] = allocation['Number of Shares'] * allocation['Current Price']
-allocation = allocation.join(shortlist[['rsquared', 'alpha']])
-
-allocation.to_excel('allocation.xlsx')
+allocation = ff.run('allocation', **settings)
+
 print(allocation)
 print("Total Portfolio Cost = $" + str(round(allocation.sum()['Subtotal'],2)))
 
+#%%################### Explore selection parameters ###########################
+
+# Every combination of the lists below, ranked and allocated from the
+# regressions above (nothing is refitted): one row per configuration with
+# its shortlist and cost. Also takes outlier_sigma, w_alpha (default
+# 1 - w_fit) and max_volatility
+sweep = ff.sweep({'N': [5, 10, 20], 'w_fit': [0.0008, 0.01, 0.1],
+                  'inv_amount': [inv_amount]}, **settings)
+print(sweep[['N', 'w_fit', 'shortlist', 'cost']])
+
+#%%########################### Save results ###################################
+
+# Coefficients, fit statistics, objective and allocation of every symbol go
+# to price_data.run_results under a new run_id, with this run's parameters in
+# price_data.runs (pass residuals=True to keep the residual matrix as well).
+# Earlier runs can be queried, e.g. one symbol's alpha across runs:
+#     ResultsStore().getHistory('aapl')
+run_id = ff.saveResults(**settings)
+print("Saved as run " + str(run_id))
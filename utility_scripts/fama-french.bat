@@ -0,0 +1,7 @@
+:: ###############################################################
+:: ############# FAMA-FRENCH COMMAND #############################
+:: ###############################################################
+
+:: e.g. fama-french update prices --incremental, fama-french analyze --n 15
+:: Run fama-french --help for the subcommands
+python "%~dp0..\src\cli.py" %*
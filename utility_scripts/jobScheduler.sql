@@ -23,11 +23,11 @@ INSERT INTO pgagent.pga_jobstep (
 :: ############# BATCH SCRIPT FOR JOB RUNNER #####################
 :: ###############################################################
 
-:: FIND DBUPDATESCRIPT.PY
+:: FIND CLI.PY
 cd "%~dp0..\src"
 
 :: RUN SCRIPT
-python DBUpdateScript.py %*
+python cli.py update all --incremental %*
 PAUSE'::text, ''::text
 ) ;
 
@@ -2,9 +2,9 @@
 :: ############# BATCH SCRIPT FOR JOB RUNNER #####################
 :: ###############################################################
 
-:: FIND DBUPDATESCRIPT.PY
+:: FIND CLI.PY
 cd "%~dp0..\src"
 
 :: RUN SCRIPT
-python DBUpdateScript.py %*
+python cli.py update all %*
 PAUSE
\ No newline at end of file